@@ -2,14 +2,30 @@ import os
 import sys
 from PyQt5.QtWidgets import QMessageBox
 
+_stylesheets = {}  # Path -> style sheet text, read once per process
+
+def load_stylesheet(path: str) -> str:
+    stylesheet = _stylesheets.get(path)
+    if stylesheet is None:
+        with open(path, 'r') as file:
+            stylesheet = _stylesheets[path] = file.read()
+    return stylesheet
+
 class StylesheetMixin:
     def apply_stylesheet(self, prefix: str = "custom"):
         stylesheet_path = self.get_default_stylesheet_path(prefix)
         try:
-            with open(stylesheet_path, 'r') as file:
-                self.setStyleSheet(file.read())
+            stylesheet = load_stylesheet(stylesheet_path)
         except Exception as e:
             QMessageBox.warning(self, "Style Error", f"Failed to apply stylesheet: {e}")
+            return
+        # Style sheets apply to child widgets too, setting the one a parent already has would only make Qt parse it again
+        parent = self.parentWidget()
+        while parent is not None:
+            if parent.styleSheet() == stylesheet:
+                return
+            parent = parent.parentWidget()
+        self.setStyleSheet(stylesheet)
 
     def get_default_stylesheet_path(self, prefix: str = "custom"):
         # Determine the base path (works with frozen executables)
@@ -18,4 +34,4 @@ class StylesheetMixin:
         # Ensure self.settings exists before accessing it
         if os.path.exists(custom_path) and getattr(self, 'settings', None) and self.settings.get('UI', 'custom_theming'):
             return custom_path
-        return os.path.join(base_path, 'style.qss')
\ No newline at end of file
+        return os.path.join(base_path, 'style.qss')
@@ -0,0 +1,274 @@
+import os
+import shutil
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from PyQt5.QtCore import QObject, QTimer, QRect, QLockFile, QStandardPaths
+from PyQt5.QtGui import QImage, QImageReader, QPainter
+
+from canvasObjects import write_image
+
+JOURNAL_MAGIC = b'BBJ1'
+JOURNAL_HEADER = struct.Struct('<4sII')  # magic, canvas width, canvas height
+RECORD_HEADER = struct.Struct('<IIIII')  # x, y, width, height, compressed size
+
+def default_autosave_dir() -> str:
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), 'autosave')
+
+class PageJournal:
+    """Autosave state of one page: its directory, the canvas area its snapshot covers and the
+    tiles changed since the last flush."""
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.canvas = None  # None while the page has no canvas, after it was spilled
+        self.needs_snapshot = True
+        self.dirty = set()
+        self.bounds = QRect()  # Canvas area of the snapshot
+        self.journal_size = 0  # Bytes in journal.bin, kept by the worker
+        self.connections = []
+
+class AutosaveJournal(QObject):
+    """Crash recovery for the pages of a session through a snapshot plus an append-only journal of
+    dirty tiles per page.
+
+    Changed tiles are collected from each canvas' pixelsChanged signal and, every interval,
+    copied on the GUI thread and compressed and appended on a single worker thread. Once a
+    journal grows past compact_size the whole canvas is written as a new snapshot and the
+    journal starts over, as it does when an infinite canvas gets content outside the snapshot.
+    Records are positioned relative to the snapshot, which covers canvas.content_rect(). Each running session keeps its own directory with a lock file, so a
+    session whose lock is stale belongs to a process that crashed. Pages keep a directory of
+    their own in it, listed in page order in the pages file."""
+    def __init__(self, root: str = None, interval: int = 10000, compact_size: int = 32 * 1024 * 1024, tile_size: int = 256):
+        super().__init__()
+        self.root = root or default_autosave_dir()
+        self.tile_size = tile_size
+        self.compact_size = compact_size
+        self.pages = {}  # Page -> PageJournal
+        self.order = []  # Pages as the session lists them
+        self.page_count = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)  # One worker keeps writes in order
+        os.makedirs(self.root, exist_ok=True)
+        self.directory = self._new_session_dir()
+        self.lock = QLockFile(os.path.join(self.directory, 'lock'))
+        self.lock.tryLock(0)
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
+
+    def attach(self, canvas, page=None, snapshot: bool = False):
+        """Starts journaling canvas as page, or as a page of its own if page is None. Pages
+        attached before are still journaled; attaching a page again with a new canvas, the one
+        it is read back into after a spill, continues its journal. The first snapshot waits for
+        the first change, so opening a board does not force all of its tiles to be decoded,
+        unless snapshot is set for pages that exist nowhere else."""
+        # Tiles of the page being left are written before it can be spilled
+        self.flush()
+        key = canvas if page is None else page
+        journal = self.pages.get(key)
+        if journal is None:
+            journal = PageJournal(os.path.join(self.directory, f'page-{self.page_count}'))
+            self.page_count += 1
+            os.makedirs(journal.directory)
+            self.pages[key] = journal
+            self._update_index()
+        if journal.canvas is not canvas:
+            self._release(journal)
+            journal.canvas = canvas
+            journal.connections = [canvas.pixelsChanged.connect(partial(self.mark_dirty, journal)),
+                                   canvas.destroyed.connect(partial(self._on_destroyed, journal, canvas))]
+        if snapshot:
+            self.compact(journal)
+
+    def arrange(self, pages: list):
+        """Orders the journaled pages like pages and deletes the ones that are no longer in it."""
+        if pages == self.order:
+            return
+        self.order = list(pages)
+        for key in [key for key in self.pages if key not in self.order]:
+            journal = self.pages.pop(key)
+            self._release(journal)
+            self.executor.submit(shutil.rmtree, journal.directory, True)
+        self._update_index()
+
+    def mark_dirty(self, journal: PageJournal, rect: QRect):
+        size = self.tile_size
+        for ty in range(rect.top() // size, rect.bottom() // size + 1):
+            for tx in range(rect.left() // size, rect.right() // size + 1):
+                journal.dirty.add((tx, ty))
+
+    def flush(self):
+        """Queues the tiles changed since the last flush for writing."""
+        for journal in self.pages.values():
+            canvas = journal.canvas
+            if canvas is None or not journal.dirty:
+                continue
+            if journal.needs_snapshot or journal.journal_size >= self.compact_size or not journal.bounds.contains(canvas.content_rect()):
+                self.compact(journal)
+                continue
+            canvas.layers.update()  # The journal records the flattened canvas
+            size = self.tile_size
+            tiles = []
+            for tx, ty in journal.dirty:
+                rect = QRect(tx * size, ty * size, size, size).intersected(journal.bounds)
+                if not rect.isEmpty():
+                    tiles.append((rect.translated(-journal.bounds.topLeft()), canvas.pixmap.copy(rect)))
+            journal.dirty.clear()
+            self.executor.submit(self._append, journal, tiles)
+
+    def compact(self, journal: PageJournal):
+        """Writes the whole canvas of a page as a new snapshot and starts an empty journal."""
+        if journal.canvas is None:
+            return
+        journal.dirty.clear()
+        journal.journal_size = 0  # Until the worker has written the new journal
+        journal.needs_snapshot = False
+        image = journal.canvas.snapshot()
+        journal.bounds = journal.canvas.content_rect()
+        self.executor.submit(self._write_snapshot, journal, image, journal.canvas.color.name())
+
+    def close(self, discard: bool = True):
+        """Stops journaling. The session is deleted unless discard is False."""
+        self.timer.stop()
+        if not discard:
+            self.flush()
+        self.executor.shutdown(wait=True)
+        self.lock.unlock()
+        if discard:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _new_session_dir(self) -> str:
+        index = 0
+        while os.path.exists(os.path.join(self.root, f'session-{os.getpid()}-{index}')):
+            index += 1
+        path = os.path.join(self.root, f'session-{os.getpid()}-{index}')
+        os.makedirs(path)
+        return path
+
+    def _release(self, journal: PageJournal):
+        """Stops watching the canvas of a page, whose unflushed tiles are lost."""
+        if journal.canvas is not None:
+            journal.canvas.pixelsChanged.disconnect(journal.connections[0])
+            journal.canvas.destroyed.disconnect(journal.connections[1])
+        journal.canvas = None
+        journal.connections = []
+        journal.dirty.clear()
+
+    def _on_destroyed(self, journal: PageJournal, canvas, _=None):
+        if journal.canvas is canvas:
+            journal.canvas = None
+            journal.connections = []
+            journal.dirty.clear()
+
+    def _update_index(self):
+        # Pages that were attached without being arranged go last
+        keys = [key for key in self.order if key in self.pages] + [key for key in self.pages if key not in self.order]
+        self.executor.submit(self._write_index, [os.path.basename(self.pages[key].directory) for key in keys])
+
+    def _write_index(self, names: list):
+        with open(os.path.join(self.directory, 'pages.tmp'), 'w') as file:
+            file.write(''.join(name + '\n' for name in names))
+        os.replace(os.path.join(self.directory, 'pages.tmp'), os.path.join(self.directory, 'pages'))
+
+    def _write_snapshot(self, journal: PageJournal, image: QImage, color: str):
+        write_image(image, os.path.join(journal.directory, 'snapshot.png'), {"canvas_color": color}, compression=1)
+        # Only start the new journal once the snapshot it builds on is in place
+        with open(os.path.join(journal.directory, 'journal.tmp'), 'wb') as file:
+            file.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, image.width(), image.height()))
+        os.replace(os.path.join(journal.directory, 'journal.tmp'), os.path.join(journal.directory, 'journal.bin'))
+        journal.journal_size = JOURNAL_HEADER.size
+
+    def _append(self, journal: PageJournal, tiles: list):
+        records = []
+        for rect, image in tiles:
+            image = image.convertToFormat(QImage.Format_ARGB32)
+            bits = image.constBits()
+            bits.setsize(image.sizeInBytes())
+            data = zlib.compress(bytes(bits), 1)
+            records.append(RECORD_HEADER.pack(rect.x(), rect.y(), rect.width(), rect.height(), len(data)) + data)
+        records = b''.join(records)
+        with open(os.path.join(journal.directory, 'journal.bin'), 'ab') as file:
+            file.write(records)
+            file.flush()
+            os.fsync(file.fileno())
+        journal.journal_size += len(records)
+
+def find_recoverable_sessions(root: str = None) -> list:
+    """Returns the session directories left behind by processes that did not exit cleanly."""
+    root = root or default_autosave_dir()
+    if not os.path.isdir(root):
+        return []
+    sessions = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not any(os.path.isfile(os.path.join(page, 'snapshot.png')) for page in session_pages(path)):
+            continue
+        lock = QLockFile(os.path.join(path, 'lock'))
+        if lock.tryLock(0):
+            lock.unlock()
+            sessions.append(path)
+    return sessions
+
+def session_pages(directory: str) -> list:
+    """Returns the page directories of a session in page order."""
+    if os.path.isfile(os.path.join(directory, 'snapshot.png')):
+        return [directory]  # Written before sessions had pages
+    try:
+        with open(os.path.join(directory, 'pages')) as file:
+            names = file.read().split()
+    except OSError:
+        return []
+    return [os.path.join(directory, name) for name in names]
+
+def recover_session(directory: str) -> list:
+    """Rebuilds the pages of a session, returning a (QImage, canvas color name) per page.
+    Pages that were never changed, or whose snapshot cannot be read, are left out."""
+    pages = []
+    for page in session_pages(directory):
+        image, color = recover_page(page)
+        if image is not None:
+            pages.append((image, color))
+    return pages
+
+def recover_page(directory: str) -> tuple:
+    """Rebuilds the canvas of a page from its snapshot and journal.
+
+    Returns (QImage, canvas color name), or (None, None) if the snapshot cannot be read.
+    A record cut short by the crash ends the replay."""
+    reader = QImageReader(os.path.join(directory, 'snapshot.png'))
+    color = reader.text("canvas_color") or "#1c1c1c"
+    image = reader.read()
+    if image.isNull():
+        return None, None
+    image = image.convertToFormat(QImage.Format_ARGB32)
+    journal_path = os.path.join(directory, 'journal.bin')
+    if not os.path.isfile(journal_path):
+        return image, color
+    with open(journal_path, 'rb') as file:
+        data = file.read()
+    if len(data) < JOURNAL_HEADER.size:
+        return image, color
+    magic, width, height = JOURNAL_HEADER.unpack_from(data)
+    if magic != JOURNAL_MAGIC or (width, height) != (image.width(), image.height()):
+        return image, color
+
+    painter = QPainter(image)
+    painter.setCompositionMode(QPainter.CompositionMode_Source)
+    offset = JOURNAL_HEADER.size
+    while offset + RECORD_HEADER.size <= len(data):
+        x, y, w, h, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(data):
+            break
+        try:
+            raw = zlib.decompress(data[offset:offset + length])
+        except zlib.error:
+            break
+        offset += length
+        painter.drawImage(x, y, QImage(raw, w, h, w * 4, QImage.Format_ARGB32))
+    painter.end()
+    return image, color
+
+def discard_session(directory: str):
+    shutil.rmtree(directory, ignore_errors=True)
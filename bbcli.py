@@ -0,0 +1,186 @@
+"""Headless batch tool for Blackboard boards.
+
+Converts, resizes, thumbnails and re-compresses PNG and .bboard files across a process
+pool without a display. Results are printed as each file finishes, followed by the
+overall throughput. The pdf command instead writes boards as the pages of one PDF.
+
+    python bbcli.py convert boards/ --to bboard --out-dir converted/
+    python bbcli.py thumbnail boards/*.png --size 256 --out-dir thumbs/ --jobs 8
+    python bbcli.py pdf boards/ --out boards.pdf
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImageReader
+
+from boardFormat import BOARD_EXTENSION, BoardReader, is_board_file, write_board
+from canvasObjects import image_texts, write_image
+from headless import application
+from vectorExport import write_pdf
+
+APP_NAME = 'blackboard'
+INPUT_EXTENSIONS = ('.png', BOARD_EXTENSION)
+
+_app = None
+
+def _init_worker():
+    # Image format plugins are only guaranteed to load with an application instance
+    global _app
+    _app = application(widgets=False)
+
+def read_board_image(path: str, preview_size: int = 0) -> tuple:
+    """Returns (QImage, metadata dict) for a PNG or board file.
+
+    If preview_size is set, a board's stored preview is used when it is at least that large."""
+    if is_board_file(path):
+        reader = BoardReader(path)
+        try:
+            texts = dict(reader.texts)
+            if preview_size:
+                preview = reader.preview()
+                if not preview.isNull() and max(preview.width(), preview.height()) >= preview_size:
+                    return preview, texts
+            return reader.read_flattened(), texts
+        finally:
+            reader.close()
+    reader = QImageReader(path)
+    texts = {key: reader.text(key) for key in reader.textKeys()}
+    image = reader.read()
+    if image.isNull():
+        raise IOError(f"{path}: {reader.errorString()}")
+    return image, texts
+
+def output_path(path: str, out_dir: str, extension: str, suffix: str = '') -> str:
+    name = os.path.splitext(os.path.basename(path))[0] + suffix + extension
+    return os.path.join(out_dir or os.path.dirname(path), name)
+
+def process_file(path: str, options: dict) -> dict:
+    """Runs one command on one file. Runs in a worker process."""
+    start = time.perf_counter()
+    bytes_in = os.path.getsize(path)
+    command = options['command']
+    extension = os.path.splitext(path)[1].lower()
+    suffix = ''
+    image, texts = read_board_image(path, options.get('size', 0) if command == 'thumbnail' else 0)
+    pixels = image.width() * image.height()
+
+    if command == 'convert':
+        extension = '.' + options['to'].lstrip('.')
+    elif command == 'resize':
+        if options.get('scale'):
+            width, height = round(image.width() * options['scale']), round(image.height() * options['scale'])
+        else:
+            width, height = options.get('width') or image.width(), options.get('height') or image.height()
+        image = image.scaled(max(1, width), max(1, height), Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    elif command == 'thumbnail':
+        size = options['size']
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        extension, suffix = '.png', '.thumb'
+
+    # Keep the original canvas color and tags, like JCanvas.save does
+    texts = {**texts, **image_texts(texts.get("canvas_color") or "#1c1c1c", APP_NAME)}
+    texts.pop("layers", None)  # Layers are flattened on the way through
+    target = output_path(path, options.get('out_dir'), extension, suffix)
+    if os.path.abspath(target) == os.path.abspath(path) and command != 'recompress' and not options.get('overwrite'):
+        raise IOError(f"{target} would overwrite its input, use --out-dir or --overwrite")
+    writer = write_board if is_board_file(target) else write_image
+    error = writer(image, target, texts, options['level'])
+    if error:
+        raise IOError(f"{target}: {error}")
+    return {
+        'input': path, 'output': target, 'pixels': pixels,
+        'bytes_in': bytes_in, 'bytes_out': os.path.getsize(target),
+        'seconds': time.perf_counter() - start,
+    }
+
+def collect_inputs(paths: list) -> list:
+    """Expands directories into the board and PNG files they contain."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(INPUT_EXTENSIONS))
+        else:
+            files.append(path)
+    return files
+
+def run(files: list, options: dict, jobs: int = None, out=sys.stdout) -> int:
+    """Processes files on a process pool, printing each result as it arrives. Returns the failure count."""
+    if options.get('out_dir'):
+        os.makedirs(options['out_dir'], exist_ok=True)
+    start = time.perf_counter()
+    done = failed = pixels = bytes_in = bytes_out = 0
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as pool:
+        futures = {pool.submit(process_file, path, options): path for path in files}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"FAIL {futures[future]}: {e}", file=out, flush=True)
+                continue
+            done += 1
+            pixels += result['pixels']
+            bytes_in += result['bytes_in']
+            bytes_out += result['bytes_out']
+            print(f"ok   {result['input']} -> {result['output']} "
+                  f"({result['bytes_in'] / 1024:.0f} KB -> {result['bytes_out'] / 1024:.0f} KB, {result['seconds'] * 1000:.0f} ms)", file=out, flush=True)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"{done} done, {failed} failed in {elapsed:.2f} s: {done / elapsed:.1f} files/s, "
+          f"{pixels / elapsed / 1e6:.1f} MP/s, {bytes_in / 1e6:.1f} MB in, {bytes_out / 1e6:.1f} MB out", file=out, flush=True)
+    return failed
+
+def export_pdf(boards: list, filename: str, out=sys.stdout) -> int:
+    """Writes boards as the pages of one PDF, one page in memory at a time. Returns the failure count."""
+    _init_worker()
+    start = time.perf_counter()
+    error = write_pdf(boards, filename, os.path.splitext(os.path.basename(filename))[0])
+    if error:
+        print(f"FAIL {filename}: {error}", file=out, flush=True)
+        return 1
+    print(f"ok   {len(boards)} boards -> {filename} ({os.path.getsize(filename) / 1024:.0f} KB, "
+          f"{time.perf_counter() - start:.2f} s)", file=out, flush=True)
+    return 0
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Headless batch processing for Blackboard boards.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('inputs', nargs='+', help="Files or directories to process")
+    common.add_argument('--out-dir', help="Output directory (defaults to next to each input)")
+    common.add_argument('--jobs', type=int, default=None, help="Worker processes (defaults to the CPU count)")
+    common.add_argument('--level', type=int, default=6, help="Compression level 0-9 for the output")
+    common.add_argument('--overwrite', action='store_true', help="Allow outputs to replace their inputs")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    convert = commands.add_parser('convert', parents=[common], help="Convert between PNG and .bboard")
+    convert.add_argument('--to', choices=['png', 'bboard'], required=True)
+    resize = commands.add_parser('resize', parents=[common], help="Resize boards")
+    resize.add_argument('--scale', type=float)
+    resize.add_argument('--width', type=int)
+    resize.add_argument('--height', type=int)
+    thumbnail = commands.add_parser('thumbnail', parents=[common], help="Write PNG thumbnails")
+    thumbnail.add_argument('--size', type=int, default=256)
+    commands.add_parser('recompress', parents=[common], help="Rewrite files at another compression level")
+    pdf = commands.add_parser('pdf', help="Write boards as the pages of one PDF, in the order given")
+    pdf.add_argument('inputs', nargs='+', help="Board files or directories")
+    pdf.add_argument('--out', required=True, help="PDF file to write")
+
+    args = parser.parse_args(argv)
+    if args.command == 'resize' and not (args.scale or args.width or args.height):
+        parser.error("resize needs --scale, --width or --height")
+    files = collect_inputs(args.inputs)
+    if args.command == 'pdf':
+        files = [path for path in files if is_board_file(path)]
+    if not files:
+        parser.error("no input files found")
+    if args.command == 'pdf':
+        return 1 if export_pdf(files, args.out) else 0
+    options = {key: value for key, value in vars(args).items() if key not in ('inputs', 'jobs')}
+    return 1 if run(files, options, args.jobs) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,18 @@
+import os
 import sys
-import time
-from PyQt5.QtCore import Qt #, QThread, pyqtSignal
-from PyQt5.QtGui import QFont, QPixmap, QImageReader
+from PyQt5.QtCore import Qt, QThreadPool #, QThread, pyqtSignal
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QAction, QWidget,
+    QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QAction, QActionGroup, QWidget,
     QDialog, QMessageBox, QSizePolicy, QPushButton, QScrollArea, QSlider,
-    QFileDialog
+    QFileDialog, QInputDialog, QColorDialog
 )
-import dialogs
+from boardFormat import BoardReader, is_board_file
+from boardSession import BoardSession, JPageStrip
+from autosave import AutosaveJournal, find_recoverable_sessions, recover_session, discard_session
+from canvasMetrics import MetricsHud, metrics
+from imageImport import IMPORT_MEMORY_LIMIT, ImageImportTask
 from canvasObjects import (
-    JCanvas, JPaletteButton, JCanvasContainer
+    JCanvas, JPaletteButton, JCanvasContainer, ImageSaveTask
 )
 from StylesheetMixin import StylesheetMixin
 
@@ -22,17 +25,49 @@ LIGHTCOLORS = [
     '#ff0000', '#ffa500', '#a52a2a', '#ffd700'
 ]
 
+FILE_FILTER = "Boards and Images (*.bboard *.png);;Blackboard Board (*.bboard);;Image Files (*.png);;All Files (*)"
+EXPORT_FILTER = "PDF Document (*.pdf);;SVG Image (*.svg);;PNG Image (*.png)"
+AUTOSAVE_INTERVAL = 10000  # Milliseconds between autosave journal flushes
+
 class Blackboard(QMainWindow, StylesheetMixin):
     def __init__(self):
         super().__init__()
         self.setWindowTitle('Blackboard')
         self.setGeometry(100, 100, 1280, 720)
         self.setMinimumSize(480, 360)
-        self.current_file = None
-        self.init_ui()
-
-    def init_ui(self):
+        self.session = BoardSession()  # Open pages, the current one is shown
+        self.session.spillFailed.connect(lambda error: self.statusBar().showMessage(f"Could not move a page out of memory: {error}", 5000))
+        self.autosave = None
+        self.collab = None
+        self.pending_exports = []  # Signals of board exports that are still being written
+        self.pending_imports = {}  # Signals of images still being decoded -> their canvas, None until it is made
+        # BLACKBOARD_IMPORT_LIMIT sets the memory opened images may take, in MiB
+        limit = os.environ.get("BLACKBOARD_IMPORT_LIMIT", "")
+        self.import_memory_limit = int(limit) * 1024 * 1024 if limit.isdigit() and int(limit) > 0 else IMPORT_MEMORY_LIMIT
         self.apply_stylesheet(prefix='bb')
+        # A recovered board becomes the first canvas, so no default one is built just to be replaced
+        recovered = self.recover_autosave()
+        self.init_ui(recovered[0] if recovered else JCanvas())
+        for canvas in recovered[1:]:
+            self.session.add(canvas, index=len(self.session))
+        self.autosave = AutosaveJournal(interval=AUTOSAVE_INTERVAL)
+        # Recovered pages are snapshotted right away, the old session is gone
+        for page in self.session.pages:
+            self.autosave.attach(page.canvas, page, snapshot=bool(recovered))
+        self.autosave.arrange(self.session.pages)
+        self.session.pagesChanged.connect(lambda: self.autosave.arrange(self.session.pages))
+
+    @property
+    def current_file(self) -> str:
+        """File of the current page, None until it is saved or if it was never opened from one."""
+        page = self.session.page()
+        return page.path if page is not None else None
+
+    @current_file.setter
+    def current_file(self, filename: str):
+        self.session.page().path = filename
+
+    def init_ui(self, canvas):
         main_widget = QWidget()
         self.setCentralWidget(main_widget)
         self.main_layout = QVBoxLayout()
@@ -62,6 +97,19 @@ class Blackboard(QMainWindow, StylesheetMixin):
         save_action.setShortcut('Ctrl+Shift+S')
         file_menu.addAction(save_action)
 
+        export_action = QAction('Export...', self)
+        export_action.triggered.connect(self.export_action)
+        export_action.setShortcut('Ctrl+E')
+        file_menu.addAction(export_action)
+
+        export_pages_action = QAction('Export Pages as PDF...', self)
+        export_pages_action.triggered.connect(self.export_pages_action)
+        file_menu.addAction(export_pages_action)
+
+        export_boards_action = QAction('Export Boards as PDF...', self)
+        export_boards_action.triggered.connect(self.export_boards_action)
+        file_menu.addAction(export_boards_action)
+
         edit_menu = self.menu_bar.addMenu('Edit')
 
         undo_action = QAction('Undo', self)
@@ -74,6 +122,76 @@ class Blackboard(QMainWindow, StylesheetMixin):
         redo_action.setShortcut('Ctrl+Shift+Z')
         edit_menu.addAction(redo_action)
 
+        edit_menu.addSeparator()
+
+        canvas_color_action = QAction('Canvas Color...', self)
+        canvas_color_action.triggered.connect(self.canvas_color_action)
+        edit_menu.addAction(canvas_color_action)
+
+        view_menu = self.menu_bar.addMenu('View')
+
+        zoom_in_action = QAction('Zoom In', self)
+        zoom_in_action.triggered.connect(lambda: self.zoom_canvas(1.25))
+        zoom_in_action.setShortcut('Ctrl+=')
+        view_menu.addAction(zoom_in_action)
+
+        zoom_out_action = QAction('Zoom Out', self)
+        zoom_out_action.triggered.connect(lambda: self.zoom_canvas(0.8))
+        zoom_out_action.setShortcut('Ctrl+-')
+        view_menu.addAction(zoom_out_action)
+
+        zoom_reset_action = QAction('Actual Size', self)
+        zoom_reset_action.triggered.connect(lambda: self.zoom_canvas(1 / self.canvas.zoom))
+        zoom_reset_action.setShortcut('Ctrl+0')
+        view_menu.addAction(zoom_reset_action)
+
+        view_menu.addSeparator()
+
+        self.hud_action = QAction('Performance HUD', self)
+        self.hud_action.setCheckable(True)
+        self.hud_action.toggled.connect(self.toggle_hud)
+        self.hud_action.setShortcut('F3')
+        view_menu.addAction(self.hud_action)
+
+        export_trace_action = QAction('Export Performance Trace...', self)
+        export_trace_action.triggered.connect(self.export_trace)
+        view_menu.addAction(export_trace_action)
+
+        page_menu = self.menu_bar.addMenu('Page')
+
+        new_page_action = QAction('New Page', self)
+        new_page_action.triggered.connect(self.new_page_action)
+        new_page_action.setShortcut('Ctrl+T')
+        page_menu.addAction(new_page_action)
+
+        next_page_action = QAction('Next Page', self)
+        next_page_action.triggered.connect(lambda: self.turn_page(1))
+        next_page_action.setShortcut('Ctrl+PgDown')
+        page_menu.addAction(next_page_action)
+
+        previous_page_action = QAction('Previous Page', self)
+        previous_page_action.triggered.connect(lambda: self.turn_page(-1))
+        previous_page_action.setShortcut('Ctrl+PgUp')
+        page_menu.addAction(previous_page_action)
+
+        delete_page_action = QAction('Delete Page', self)
+        delete_page_action.triggered.connect(self.delete_page_action)
+        page_menu.addAction(delete_page_action)
+
+        # Filled in when opened, the layers belong to the current canvas
+        self.layer_menu = self.menu_bar.addMenu('Layer')
+        self.layer_menu.aboutToShow.connect(self.update_layer_menu)
+
+        collab_menu = self.menu_bar.addMenu('Collaborate')
+
+        join_action = QAction('Join Session...', self)
+        join_action.triggered.connect(self.join_session)
+        collab_menu.addAction(join_action)
+
+        leave_action = QAction('Leave Session', self)
+        leave_action.triggered.connect(self.leave_session)
+        collab_menu.addAction(leave_action)
+
         # Main UI
         widget = QWidget()
         layout = QVBoxLayout()
@@ -81,10 +199,25 @@ class Blackboard(QMainWindow, StylesheetMixin):
         layout.setSpacing(0)
         widget.setLayout(layout)
         
-        self.canvas = JCanvas()
+        self.session.activate(self.session.add(canvas))
+        self.canvas = canvas
         self.canvas.wheelScrolled.connect(self.scroll_on_canvas)
+        self.canvas.panRequested.connect(self.pan_canvas)
+        self.canvas.saveFinished.connect(self.on_save_finished)
         self.scroll_area = JCanvasContainer(self.canvas)
         layout.addWidget(self.scroll_area)
+        self.page_strip = JPageStrip(self.session)
+        self.page_strip.pageSelected.connect(self.show_page)
+        layout.addWidget(self.page_strip)
+        metrics.set_gauge("session.bytes", self.session.nbytes)
+        self.hud = MetricsHud(self.scroll_area.viewport())
+        self.watch_metrics(self.canvas)
+        # Input is recorded for replayBench.py when BLACKBOARD_RECORD names a session file
+        self.recorder = None
+        if os.environ.get("BLACKBOARD_RECORD"):
+            from inputSession import SessionRecorder
+            self.recorder = SessionRecorder(os.environ["BLACKBOARD_RECORD"])
+            self.recorder.attach(self.canvas)
 
         # Tools
         tools = QScrollArea()
@@ -128,6 +261,24 @@ class Blackboard(QMainWindow, StylesheetMixin):
         line_tool.clicked.connect(lambda: self.canvas.set_tool('line'))
         tool_selector.addWidget(line_tool)
 
+        fill_tool = QPushButton('Fill')
+        fill_tool.setShortcut('F')
+        fill_tool.setToolTip('<b>Fill (F):</b> Fill an area of similar color.')
+        fill_tool.clicked.connect(lambda: self.canvas.set_tool('fill'))
+        tool_selector.addWidget(fill_tool)
+
+        select_tool = QPushButton('Select')
+        select_tool.setShortcut('S')
+        select_tool.setToolTip('<b>Select (S):</b> Select a rectangle, then drag it to move, its corners to scale or its top handle to rotate.')
+        select_tool.clicked.connect(lambda: self.canvas.set_tool('select'))
+        tool_selector.addWidget(select_tool)
+
+        lasso_tool = QPushButton('Lasso')
+        lasso_tool.setShortcut('Shift+S')
+        lasso_tool.setToolTip('<b>Lasso (Shift+S):</b> Select a freehand area to move, scale or rotate.')
+        lasso_tool.clicked.connect(lambda: self.canvas.set_tool('lasso'))
+        tool_selector.addWidget(lasso_tool)
+
         self.width_slider = QSlider()
         self.width_slider.setMinimum(1)
         self.width_slider.setMaximum(50)
@@ -136,7 +287,7 @@ class Blackboard(QMainWindow, StylesheetMixin):
         self.width_slider.valueChanged.connect(lambda: self.canvas.set_tool_width(self.width_slider.value()))
         tools_layout.addWidget(self.width_slider)
 
-        self.add_palette_buttons(self.palette, DARKCOLORS)
+        self.add_palette_buttons(self.palette, DARKCOLORS if self.canvas.color.getHsl()[2] < 128 else LIGHTCOLORS)
 
         palette_widget = QWidget()
         palette_widget.setLayout(tools_layout)
@@ -152,18 +303,155 @@ class Blackboard(QMainWindow, StylesheetMixin):
 
         self.setCentralWidget(widget)
 
+    def set_canvas(self, new_canvas):
+        """Shows new_canvas instead of the current one, keeping the selected tool, its width and the pen color."""
+        pen_color, tool = self.canvas.pen_color, self.canvas.tool
+        self.canvas.wheelScrolled.disconnect(self.scroll_on_canvas)
+        self.canvas.panRequested.disconnect(self.pan_canvas)
+        self.canvas.saveFinished.disconnect(self.on_save_finished)
+        self.canvas.deselect()
+        self.add_palette_buttons(self.palette, DARKCOLORS if new_canvas.color.getHsl()[2] < 128 else LIGHTCOLORS)
+        self.canvas = new_canvas
+        self.canvas.wheelScrolled.connect(self.scroll_on_canvas)
+        self.canvas.panRequested.connect(self.pan_canvas)
+        self.canvas.saveFinished.connect(self.on_save_finished)
+        self.scroll_area.set_canvas(self.canvas)
+        self.watch_metrics(self.canvas)
+        if self.recorder is not None:
+            self.recorder.attach(self.canvas)
+        if self.autosave is not None:
+            self.autosave.attach(self.canvas, self.session.page())
+        if self.collab is not None:
+            self.collab.attach(self.canvas)
+        self.canvas.set_tool(tool)
+        self.canvas.set_tool_width(self.width_slider.value())
+        self.canvas.set_pen_color(pen_color)
+
+    def watch_metrics(self, canvas):
+        """Points the memory gauges of the performance metrics at canvas."""
+        metrics.set_gauge("history.bytes", canvas.history.memory_usage)
+        metrics.set_gauge("redo.bytes", canvas.history.redo_memory_usage)
+        metrics.set_gauge("strokes.bytes", canvas.strokes.nbytes)
+        metrics.set_gauge("layers.bytes", canvas.layers.nbytes)
+        self.hud.raise_()  # The new canvas widget would cover it
+
+    def toggle_hud(self, visible: bool):
+        self.hud.set_visible(visible)
+
+    def export_trace(self):
+        """Writes the performance metrics recorded so far to a JSON or CSV file."""
+        if not metrics.enabled:
+            QMessageBox.information(self, "Performance Trace", "Metrics are only recorded while the performance HUD is shown or BLACKBOARD_METRICS is set.")
+            return
+        filename, _ = QFileDialog.getSaveFileName(self, "Export Performance Trace", "", "JSON Trace (*.json);;CSV Trace (*.csv)")
+        if not filename:
+            return
+        try:
+            metrics.export(filename)
+        except OSError as e:
+            QMessageBox.warning(self, "Error", f"Failed to export trace: {e}")
+        else:
+            self.statusBar().showMessage(f"Exported {filename}", 3000)
+
+    def update_layer_menu(self):
+        self.layer_menu.clear()
+        layers = list(enumerate(self.canvas.layers))[::-1]  # Top-most first, like a layer panel
+        group = QActionGroup(self.layer_menu)
+        for index, layer in layers:
+            action = QAction(f'Draw on {layer.name}', self.layer_menu, checkable=True)
+            action.setChecked(index == self.canvas.active_layer)
+            action.triggered.connect(lambda _, index=index: self.canvas.set_active_layer(index))
+            group.addAction(action)
+            self.layer_menu.addAction(action)
+        self.layer_menu.addSeparator()
+        for index, layer in layers:
+            action = QAction(f'Show {layer.name}', self.layer_menu, checkable=True)
+            action.setChecked(layer.visible)
+            action.toggled.connect(lambda visible, index=index: self.canvas.set_layer_visible(index, visible))
+            self.layer_menu.addAction(action)
+
+    def recover_autosave(self) -> list:
+        """Offers to recover the pages of a session that crashed. Returns their canvases, if any."""
+        sessions = find_recoverable_sessions()
+        if not sessions:
+            return []
+        canvases = []
+        answer = QMessageBox.question(self, "Recover Board", "Blackboard did not shut down properly. Do you want to recover the unsaved board?")
+        if answer == QMessageBox.Yes:
+            # Only the most recent session is offered, older ones are stale
+            canvases = [JCanvas(loadedImage=image, color=color) for image, color in recover_session(sessions[-1])]
+        for session in sessions:
+            discard_session(session)
+        return canvases
+
+    def join_session(self):
+        # The networking modules are only loaded once a session is joined
+        from collabClient import CollabClient
+        from collabProtocol import DEFAULT_PORT
+        address, ok = QInputDialog.getText(self, "Join Session", "Server address (host:port):", text=f"127.0.0.1:{DEFAULT_PORT}")
+        if not ok or not address.strip():
+            return
+        host, _, port = address.strip().rpartition(':')
+        if not host or not port.isdigit():
+            host, port = address.strip(), str(DEFAULT_PORT)
+        self.leave_session()
+        self.collab = CollabClient(name=QApplication.applicationName())
+        self.collab.snapshotReceived.connect(self.on_snapshot_received)
+        self.collab.connected.connect(lambda: self.statusBar().showMessage(f"Joined session on {host}:{port}", 3000))
+        self.collab.disconnected.connect(self.on_session_disconnected)
+        self.collab.attach(self.canvas)
+        self.collab.connect_to(host, int(port))
+
+    def leave_session(self):
+        if self.collab is not None:
+            self.collab.disconnected.disconnect(self.on_session_disconnected)
+            self.collab.close()
+            self.collab.deleteLater()
+            self.collab = None
+
+    def on_snapshot_received(self, image, color):
+        # The shared board replaces the current page
+        canvas = JCanvas(loadedImage=image, color=color)
+        self.session.replace(self.session.current, canvas)
+        self.set_canvas(canvas)
+
+    def on_session_disconnected(self, error):
+        if error:
+            QMessageBox.warning(self, "Collaboration", f"Lost connection to the session: {error}")
+        else:
+            self.statusBar().showMessage("Left the session", 3000)
+        self.leave_session()
+
+    def closeEvent(self, event):
+        self.leave_session()
+        self.autosave.close()
+        self.session.close()
+        if self.recorder is not None:
+            self.recorder.write()
+        super().closeEvent(event)
+
     def undo(self):
+        if self.recorder is not None:
+            self.recorder.note("undo")
         self.canvas.undo()
 
     def redo(self):
+        if self.recorder is not None:
+            self.recorder.note("redo")
         self.canvas.redo()
 
+    def canvas_color_action(self):
+        color = QColorDialog.getColor(self.canvas.color, self, "Canvas Color")
+        if color.isValid():
+            self.canvas.set_color(color)
+            self.add_palette_buttons(self.palette, DARKCOLORS if color.getHsl()[2] < 128 else LIGHTCOLORS)
+
     def scroll_on_canvas(self, direction, crtl_pressed):
         if crtl_pressed:
           if direction == 1:
-              pass
+              self.zoom_canvas(1.25)
           elif direction == -1:
-              pass
+              self.zoom_canvas(0.8)
         else:
             if direction == 1:
                 if self.width_slider.value() in range(1,50):
@@ -172,6 +460,26 @@ class Blackboard(QMainWindow, StylesheetMixin):
                 if self.width_slider.value() in range(2,51):
                     self.width_slider.setValue(self.width_slider.value() - 1)
 
+    def zoom_canvas(self, factor):
+        # Keep the point in the middle of the viewport where it is
+        h_bar = self.scroll_area.horizontalScrollBar()
+        v_bar = self.scroll_area.verticalScrollBar()
+        viewport = self.scroll_area.viewport()
+        center_x = (h_bar.value() + viewport.width() / 2) / max(1, self.scroll_area.widget().width())
+        center_y = (v_bar.value() + viewport.height() / 2) / max(1, self.scroll_area.widget().height())
+
+        self.canvas.set_zoom(self.canvas.zoom * factor)
+        self.scroll_area.widget().adjustSize()
+
+        h_bar.setValue(round(center_x * self.scroll_area.widget().width() - viewport.width() / 2))
+        v_bar.setValue(round(center_y * self.scroll_area.widget().height() - viewport.height() / 2))
+
+    def pan_canvas(self, delta):
+        h_bar = self.scroll_area.horizontalScrollBar()
+        v_bar = self.scroll_area.verticalScrollBar()
+        h_bar.setValue(h_bar.value() + delta.x())
+        v_bar.setValue(v_bar.value() + delta.y())
+
     def add_palette_buttons(self, layout, colors):
         # Clear existing palette buttons if they exist
         for i in reversed(range(layout.count())): 
@@ -195,9 +503,8 @@ class Blackboard(QMainWindow, StylesheetMixin):
         layout.addWidget(rainbow_button)
 
     def new_action(self):
-        self.current_file = None
-        pen_color = self.canvas.pen_color
-        dialog = dialogs.NewCanvasDialog(self.canvas.width, self.canvas.height)
+        import dialogs
+        dialog = dialogs.NewCanvasDialog(self.canvas.width, self.canvas.height, self)
         if dialog.exec_() == QDialog.Accepted:
             try:
                 width = int(dialog.width_input.text())
@@ -206,48 +513,154 @@ class Blackboard(QMainWindow, StylesheetMixin):
                 QMessageBox.critical(self, "Value Error", "Both the height and width must be entered to create a new canvas.")
                 return
             color = '#ffffff' if dialog.selected_color[0] == 'Light' else dialog.selected_color[1] if dialog.selected_color[0] == 'Custom Color' else '#1c1c1c'
-            new_canvas = JCanvas(width, height, color)
-            self.add_palette_buttons(self.palette, DARKCOLORS if new_canvas.color.getHsl()[2] < 128 else LIGHTCOLORS)
-            self.canvas = new_canvas
-            self.canvas.wheelScrolled.connect(self.scroll_on_canvas)
-            self.scroll_area.set_canvas(self.canvas)
-            self.canvas.clear()
-            self.canvas.set_tool('pen')
-            self.canvas.set_tool_width(self.width_slider.value())
-            self.canvas.set_pen_color(pen_color)
+            self.add_page(JCanvas(width, height, color, infinite=dialog.infinite_checkbox.isChecked()))
 
     def load_action(self):
-        pen_color = self.canvas.pen_color
         options = QFileDialog.Options()
         try:
-            filename, _ = QFileDialog.getOpenFileName(self, "Open File", "", "Image Files (*.png);;All Files (*)", options=options)
-            if filename:
-                reader = QImageReader(filename)
-                metadata_color = reader.text("canvas_color")  # Extract metadata
-
-                # Default to dark if no color metadata is found
-                canvas_color = metadata_color if metadata_color else "#1c1c1c"
-
-                new_canvas = JCanvas(loadedImage=QPixmap(filename), color=canvas_color)
-                self.add_palette_buttons(self.palette, DARKCOLORS if new_canvas.color.getHsl()[2] < 128 else LIGHTCOLORS)
-                self.canvas = new_canvas
-                self.canvas.wheelScrolled.connect(self.scroll_on_canvas)
-                self.scroll_area.set_canvas(self.canvas)
-                self.canvas.set_tool('pen')
-                self.canvas.set_tool_width(self.width_slider.value())
-                self.canvas.set_pen_color(pen_color)
-                self.current_file = filename
+            filename, _ = QFileDialog.getOpenFileName(self, "Open File", "", FILE_FILTER, options=options)
+            if filename and is_board_file(filename):
+                # Board files are decoded tile by tile as they scroll into view
+                reader = BoardReader(filename)
+                self.add_page(JCanvas(color=reader.color.name(), tile_source=reader), filename)
+            elif filename:
+                self.import_image(filename)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load image: {str(e)}")
 
+    def import_image(self, filename: str):
+        """Opens an image as a page, decoded on a worker. The page is added as soon as the
+        image size is known and shows the image once it is decoded."""
+        task = ImageImportTask(filename, self.import_memory_limit)
+        signals = task.signals
+        signals.sized.connect(lambda size, image_size, color: self.on_import_sized(signals, filename, size, image_size, color))
+        signals.finished.connect(lambda image, error: self.on_import_finished(signals, filename, image, error))
+        self.pending_imports[signals] = None
+        QThreadPool.globalInstance().start(task)
+
+    def on_import_sized(self, signals, filename: str, size, image_size, color: str):
+        canvas = JCanvas(size.width(), size.height(), color)
+        canvas.follow_import(signals)
+        self.pending_imports[signals] = canvas
+        if size != image_size:
+            # Saving the smaller canvas must not replace the original image
+            self.add_page(canvas)
+            self.statusBar().showMessage(f"Opened {os.path.basename(filename)} at {size.width()}x{size.height()}, "
+                                         f"scaled down from {image_size.width()}x{image_size.height()} to fit in memory", 8000)
+        else:
+            self.add_page(canvas, filename)
+
+    def on_import_finished(self, signals, filename: str, image, error: str):
+        canvas = self.pending_imports.pop(signals, None)
+        index = None  # Of the page, unless it was closed meanwhile
+        if canvas is not None:
+            canvas.finish_import(image)
+            index = next((index for index, page in enumerate(self.session.pages) if page.canvas is canvas), None)
+        if error:
+            QMessageBox.critical(self, "Error", f"Failed to load image {os.path.basename(filename)}: {error}")
+            if index is not None and len(self.session) > 1:
+                shown = index == self.session.current
+                index = self.session.remove(index)
+                if shown:
+                    self.show_page(index)
+        elif index is not None:
+            self.session.update_thumbnail(self.session.page(index))
+            self.session.pagesChanged.emit()
+
+    def add_page(self, canvas, filename: str = None):
+        """Adds canvas as a page after the current one and shows it. A blank current page that
+        was never drawn on is replaced instead, like the one a new window starts with."""
+        if (self.current_file is None and self.canvas.tile_source is None and not self.canvas.history.can_undo()
+                and not any(layer.is_allocated() for layer in self.canvas.layers)):
+            self.session.replace(self.session.current, canvas, filename)
+            self.set_canvas(canvas)
+        else:
+            self.show_page(self.session.add(canvas, filename))
+
+    def show_page(self, index: int):
+        try:
+            canvas = self.session.activate(index)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Error", f"Failed to read page {index + 1}: {e}")
+            return
+        if canvas is not self.canvas:
+            self.set_canvas(canvas)
+
+    def turn_page(self, step: int):
+        index = self.session.current + step
+        if 0 <= index < len(self.session):
+            self.show_page(index)
+
+    def new_page_action(self):
+        """Adds an empty page like the current one after it."""
+        canvas = JCanvas(self.canvas.width, self.canvas.height, self.canvas.color.name(), infinite=self.canvas.layers.infinite)
+        self.show_page(self.session.add(canvas))
+
+    def delete_page_action(self):
+        if len(self.session) < 2:
+            return
+        answer = QMessageBox.question(self, "Delete Page", f"Delete page {self.session.current + 1} and everything drawn on it?")
+        if answer == QMessageBox.Yes:
+            self.show_page(self.session.remove(self.session.current))
+
     def save_action(self):
         if self.current_file == None: return
+        if self.recorder is not None:
+            self.recorder.note("save", ".bboard" if is_board_file(self.current_file) else ".png")
         self.canvas.save(self.current_file, "blackboard")
 
+    def export_action(self):
+        """Writes the canvas to a PDF, SVG or PNG file without making it the current file."""
+        filename, selected = QFileDialog.getSaveFileName(self, "Export", "", EXPORT_FILTER)
+        if not filename:
+            return
+        if os.path.splitext(filename)[1].lower() not in ('.pdf', '.svg', '.png'):
+            filename += selected[selected.index('*') + 1:-1] if '*' in selected else '.pdf'
+        self.canvas.save(filename, "blackboard")
+
+    def export_pages_action(self):
+        """Writes every page of the session as one PDF, on a worker thread."""
+        filename, _ = QFileDialog.getSaveFileName(self, "Export Pages as PDF", "", "PDF Document (*.pdf)")
+        if not filename:
+            return
+        if not filename.lower().endswith('.pdf'):
+            filename += '.pdf'
+        self.start_export(self.session.export_pages(), filename)
+
+    def export_boards_action(self):
+        """Writes a number of board files as the pages of one PDF, on a worker thread."""
+        boards, _ = QFileDialog.getOpenFileNames(self, "Boards to Export", "", "Blackboard Board (*.bboard)")
+        if not boards:
+            return
+        filename, _ = QFileDialog.getSaveFileName(self, "Export Boards as PDF", "", "PDF Document (*.pdf)")
+        if not filename:
+            return
+        if not filename.lower().endswith('.pdf'):
+            filename += '.pdf'
+        self.start_export(boards, filename)
+
+    def start_export(self, pages, filename: str):
+        task = ImageSaveTask(pages, filename)
+        task.signals.finished.connect(self.on_export_finished)
+        self.pending_exports.append(task.signals)
+        QThreadPool.globalInstance().start(task)
+
+    def on_export_finished(self, filename, error):
+        signals = self.sender()
+        if signals in self.pending_exports:
+            self.pending_exports.remove(signals)
+        if error:
+            QMessageBox.critical(self, "Failed to export boards", "An unexpected error occoured:\n" + error)
+        self.on_save_finished(filename, error)
+
+    def on_save_finished(self, filename, error):
+        if not error:
+            self.statusBar().showMessage(f"Saved {filename}", 3000)
+
     def save_as(self):
         options = QFileDialog.Options()
         try:
-            filename, _ = QFileDialog.getSaveFileName(self, "Save File As", "", "Image Files (*.png);;All Files (*)", options=options)
+            filename, _ = QFileDialog.getSaveFileName(self, "Save File As", "", FILE_FILTER, options=options)
             if filename:
                 self.current_file = filename
                 self.save_action()
@@ -256,6 +669,10 @@ class Blackboard(QMainWindow, StylesheetMixin):
                 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
+    app.setApplicationName('Blackboard')
     blackboard = Blackboard()
+    if os.environ.get("BLACKBOARD_STARTUP_TRACE"):
+        from startupBench import FirstPaintProbe
+        FirstPaintProbe(blackboard)
     blackboard.show()
     sys.exit(app.exec_())
\ No newline at end of file
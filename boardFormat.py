@@ -0,0 +1,196 @@
+import json
+import mmap
+import os
+import struct
+import uuid
+import zlib
+from PyQt5.QtCore import Qt, QBuffer, QByteArray, QIODevice, QRect
+from PyQt5.QtGui import QColor, QImage, QPainter
+
+from canvasLayers import parse_layers
+
+BOARD_EXTENSION = '.bboard'
+BOARD_MAGIC = b'BBRD'
+BOARD_VERSION = 1
+# magic, version, layer count, width, height, tile size, metadata offset/length,
+# preview offset/length, tile index offset
+HEADER = struct.Struct('<4sHHIIIQIQIQ')
+INDEX_ENTRY = struct.Struct('<QI')  # tile offset, compressed length (0 = solid canvas color)
+
+def is_board_file(filename: str) -> bool:
+    return filename.lower().endswith(BOARD_EXTENSION)
+
+def image_bytes(image: QImage) -> bytes:
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    return bytes(bits)
+
+def flatten_layers(images: list, background: QColor, visible: list = None) -> QImage:
+    """Draws the layer images bottom first over the canvas color, skipping hidden and empty (None) ones."""
+    image = QImage(images[0].width(), images[0].height(), QImage.Format_ARGB32)
+    image.fill(background)
+    painter = QPainter(image)
+    for index, layer in enumerate(images):
+        if layer is not None and (visible is None or visible[index]):
+            painter.drawImage(0, 0, layer)
+    painter.end()
+    return image
+
+def write_board(images, filename: str, texts: dict = None, compression: int = 6, tile_size: int = 256, preview_size: int = 256) -> str:
+    """Writes one image, or a list of layer images of the same size, as a tiled board file.
+    Upper layers may be None if they are empty.
+
+    Every tile is compressed on its own so readers can decode only what they show. Tiles
+    that are entirely the canvas color (texts["canvas_color"]) on the bottom layer, or fully
+    transparent on the layers above, are not stored at all. Layer names and visibility go in
+    texts["layers"].
+    Returns an empty string on success or the error message, like write_image."""
+    if isinstance(images, QImage):
+        images = [images]
+    texts = dict(texts or {})
+    width, height = images[0].width(), images[0].height()
+    background = QColor(texts.get("canvas_color", "#1c1c1c"))
+    tiles_x, tiles_y = -(-width // tile_size), -(-height // tile_size)
+
+    metadata = json.dumps(texts).encode('utf-8')
+    preview = b''
+    if preview_size:
+        buffer = QBuffer()
+        buffer.open(QIODevice.WriteOnly)
+        visible = [visible for _, visible in parse_layers(texts.get("layers", ""), len(images))]
+        preview_image = flatten_layers(images, background, visible) if len(images) > 1 else images[0]
+        preview_image.scaled(preview_size, preview_size, Qt.KeepAspectRatio, Qt.SmoothTransformation).save(buffer, 'PNG')
+        preview = bytes(buffer.data())
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    temp_path = os.path.join(directory, f".{os.path.basename(filename)}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(temp_path, 'wb') as file:
+            metadata_offset = HEADER.size
+            preview_offset = metadata_offset + len(metadata)
+            index_offset = preview_offset + len(preview)
+            file.write(HEADER.pack(BOARD_MAGIC, BOARD_VERSION, len(images), width, height, tile_size,
+                                   metadata_offset, len(metadata), preview_offset, len(preview), index_offset))
+            file.write(metadata)
+            file.write(preview)
+
+            index = []
+            offset = index_offset + INDEX_ENTRY.size * tiles_x * tiles_y * len(images)
+            file.seek(offset)
+            for layer, image in enumerate(images):
+                if image is None:
+                    index.extend([(0, 0)] * (tiles_x * tiles_y))
+                    continue
+                image = image.convertToFormat(QImage.Format_ARGB32)
+                # The bottom layer holds the canvas color, the layers above start out transparent
+                fill = background.rgba() if layer == 0 else 0
+                for ty in range(tiles_y):
+                    for tx in range(tiles_x):
+                        tile = image.copy(QRect(tx * tile_size, ty * tile_size, tile_size, tile_size).intersected(image.rect()))
+                        raw = image_bytes(tile)
+                        if raw == struct.pack('=I', fill) * (tile.width() * tile.height()):
+                            index.append((0, 0))
+                            continue
+                        data = zlib.compress(raw, min(max(compression, 0), 9))
+                        file.write(data)
+                        index.append((offset, len(data)))
+                        offset += len(data)
+
+            file.seek(index_offset)
+            file.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in index))
+        os.replace(temp_path, filename)
+    except OSError as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return str(e)
+    return ""
+
+class BoardReader:
+    """Memory-mapped reader for board files that decodes tiles on request."""
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            (magic, version, self.layer_count, self.width, self.height, self.tile_size,
+             metadata_offset, metadata_length, self.preview_offset, self.preview_length,
+             self.index_offset) = HEADER.unpack_from(self.data)
+            if magic != BOARD_MAGIC:
+                raise ValueError(f"{filename} is not a board file")
+            if version > BOARD_VERSION:
+                raise ValueError(f"{filename} was written by a newer version (format {version})")
+            self.texts = json.loads(bytes(self.data[metadata_offset:metadata_offset + metadata_length]).decode('utf-8'))
+        except Exception:
+            self.close()
+            raise
+        self.tiles_x = -(-self.width // self.tile_size)
+        self.tiles_y = -(-self.height // self.tile_size)
+        self.color = QColor(self.texts.get("canvas_color", "#1c1c1c"))
+
+    def text(self, key: str) -> str:
+        return self.texts.get(key, "")
+
+    def preview(self) -> QImage:
+        """Returns the stored preview image, or a null image if the file has none."""
+        image = QImage()
+        if self.preview_length:
+            image.loadFromData(QByteArray(bytes(self.data[self.preview_offset:self.preview_offset + self.preview_length])), 'PNG')
+        return image
+
+    def tile_rect(self, tx: int, ty: int) -> QRect:
+        size = self.tile_size
+        return QRect(tx * size, ty * size, size, size).intersected(QRect(0, 0, self.width, self.height))
+
+    def tiles_in(self, rect: QRect):
+        """Yields the (tx, ty) of every tile that intersects rect."""
+        rect = rect.intersected(QRect(0, 0, self.width, self.height))
+        if rect.isEmpty():
+            return
+        size = self.tile_size
+        for ty in range(rect.top() // size, rect.bottom() // size + 1):
+            for tx in range(rect.left() // size, rect.right() // size + 1):
+                yield tx, ty
+
+    def is_stored(self, tx: int, ty: int, layer: int = 0) -> bool:
+        """Returns False for tiles that are implicitly the empty layer content."""
+        return self._entry(tx, ty, layer)[1] != 0
+
+    def read_tile(self, tx: int, ty: int, layer: int = 0) -> QImage:
+        """Decodes one tile, or returns None if it is the empty layer content."""
+        offset, length = self._entry(tx, ty, layer)
+        if not length:
+            return None
+        raw = zlib.decompress(self.data[offset:offset + length])
+        rect = self.tile_rect(tx, ty)
+        return QImage(raw, rect.width(), rect.height(), rect.width() * 4, QImage.Format_ARGB32).copy()
+
+    def read_image(self, layer: int = 0) -> QImage:
+        """Decodes a whole layer."""
+        image = QImage(self.width, self.height, QImage.Format_ARGB32)
+        image.fill(self.color if layer == 0 else QColor(Qt.transparent))
+        painter = QPainter(image)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for ty in range(self.tiles_y):
+            for tx in range(self.tiles_x):
+                tile = self.read_tile(tx, ty, layer)
+                if tile is not None:
+                    painter.drawImage(self.tile_rect(tx, ty).topLeft(), tile)
+        painter.end()
+        return image
+
+    def read_flattened(self) -> QImage:
+        """Decodes every layer and flattens the visible ones, as the canvas shows them."""
+        if self.layer_count == 1:
+            return self.read_image()
+        visible = [visible for _, visible in parse_layers(self.text("layers"), self.layer_count)]
+        return flatten_layers([self.read_image(layer) for layer in range(self.layer_count)], self.color, visible)
+
+    def close(self):
+        if getattr(self, 'data', None) is not None:
+            self.data.close()
+            self.data = None
+        self.file.close()
+
+    def _entry(self, tx: int, ty: int, layer: int) -> tuple:
+        index = (layer * self.tiles_y + ty) * self.tiles_x + tx
+        return INDEX_ENTRY.unpack_from(self.data, self.index_offset + index * INDEX_ENTRY.size)
@@ -0,0 +1,422 @@
+"""Multi-page sessions: a number of boards open at once, switched between like slides.
+
+Pages are JCanvases that stay in memory, least recently shown first, while their pixels fit
+the memory budget. Past it, the least recently shown pages are written to board files in a
+temporary directory and their canvases dropped; their undo history and vector strokes stay
+in memory, they are small next to the pixels and come back with the page. The boards of the
+pages next to the current one are decoded on a worker thread ahead of time, so turning to
+them only hands the decoded tiles to a new canvas.
+
+Exports hand the pages to a worker one at a time, each built on the GUI thread when the
+worker gets to it, see PageExport.
+"""
+import os
+import shutil
+import tempfile
+from PyQt5.QtCore import Q_ARG, Qt, QCoreApplication, QMetaObject, QObject, QRunnable, QSize, QThread, QThreadPool, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QIcon, QImage, QPainter, QPixmap
+from PyQt5.QtWidgets import QListView, QListWidget, QListWidgetItem
+
+from boardFormat import BoardReader
+from canvasObjects import JCanvas
+
+SESSION_MEMORY_BUDGET = 512 * 1024 * 1024  # Bytes of page pixels kept in memory
+PREFETCH_DISTANCE = 1  # Pages on either side of the current one that are decoded ahead of time
+THUMBNAIL_SIZE = QSize(128, 72)
+
+class SessionPage:
+    """One page of a session. While canvas is None the page lives in source, a board file,
+    with the history, strokes and zoom its canvas had."""
+    def __init__(self, canvas: JCanvas, path: str = None):
+        self.canvas = canvas
+        self.path = path  # File the user opened the page from or saved it to
+        # Spilled board file with the page's pixels, as long as modified is not set. Files the
+        # user opened are never used, they could be overwritten from another page.
+        self.source = None
+        self.modified = True
+        self.history = None
+        self.strokes = None
+        self.zoom = 1.0
+        self.thumbnail = QImage()
+        self.spilling = None  # Signals of the board write in flight
+        self.prefetching = False
+        self.prefetched = None  # {(layer, tx, ty): QImage} decoded from source ahead of time
+
+    def nbytes(self) -> int:
+        """Returns the bytes of pixel data the page holds, what dropping its canvas would free."""
+        size = 0
+        if self.canvas is not None:
+            size += self.canvas.layers.nbytes() + self.canvas.pyramid.nbytes()
+        if self.prefetched:
+            size += sum(tile.sizeInBytes() for tile in self.prefetched.values())
+        return size
+
+class DecodedBoard:
+    """A BoardReader whose tiles were decoded ahead of time, usable as a JCanvas tile_source."""
+    def __init__(self, reader: BoardReader, tiles: dict):
+        self.reader = reader
+        self.tiles = tiles
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    def read_tile(self, tx: int, ty: int, layer: int = 0) -> QImage:
+        tile = self.tiles.pop((layer, tx, ty), None)
+        return tile if tile is not None else self.reader.read_tile(tx, ty, layer)
+
+    def close(self):
+        self.tiles.clear()
+        self.reader.close()
+
+class PrefetchSignals(QObject):
+    finished = pyqtSignal(str, object)  # board file, {(layer, tx, ty): QImage} or None on failure
+
+class PrefetchTask(QRunnable):
+    """Decodes every stored tile of a board file on a QThreadPool worker."""
+    def __init__(self, filename: str):
+        super().__init__()
+        self.filename = filename
+        self.signals = PrefetchSignals()
+
+    def run(self):
+        try:
+            reader = BoardReader(self.filename)
+            try:
+                tiles = {(layer, tx, ty): reader.read_tile(tx, ty, layer) for layer in range(reader.layer_count)
+                         for ty in range(reader.tiles_y) for tx in range(reader.tiles_x) if reader.is_stored(tx, ty, layer)}
+            finally:
+                reader.close()
+        except Exception:
+            tiles = None  # The page is then read when it is shown, which reports the error
+        self.signals.finished.emit(self.filename, tiles)
+
+class PageExport(QObject):
+    """The pages of a session as they are when the export starts, for vectorExport.write_pdf() on a
+    worker thread. Iterating asks the GUI thread for one page at a time: a VectorPage of a page in
+    memory, made when the writer gets to it, or the board file of a spilled page. The session keeps
+    those files until the export is finished."""
+    def __init__(self, session: 'BoardSession'):
+        super().__init__()
+        self.session = session
+        self.pages = list(session.pages)
+        self.sources = set()  # Spilled board files handed to the writer
+        self.built = None
+        self.cancelled = False
+
+    def __iter__(self):
+        try:
+            for index in range(len(self.pages)):
+                if QThread.currentThread() is self.thread():
+                    self.build(index)
+                elif not self.cancelled:
+                    QMetaObject.invokeMethod(self, "build", Qt.BlockingQueuedConnection, Q_ARG(int, index))
+                if self.cancelled:
+                    raise OSError("The export was cancelled")
+                page, self.built = self.built, None
+                if page is not None:
+                    yield page
+        finally:
+            QMetaObject.invokeMethod(self, "finish", Qt.QueuedConnection)
+
+    @pyqtSlot(int)
+    def build(self, index: int):
+        from vectorExport import VectorPage
+        page = self.pages[index]
+        if self.cancelled or page not in self.session.pages:
+            return  # Removed since the export started
+        if page.canvas is not None:
+            self.built = VectorPage.from_canvas(page.canvas)
+            # Tiles of an opened board are all decoded now, the canvas may no longer fit the budget
+            self.session.enforce_budget()
+        elif page.source is not None:
+            self.sources.add(page.source)
+            self.built = page.source
+
+    @pyqtSlot()
+    def finish(self):
+        if self in self.session.exports:
+            self.session.exports.remove(self)
+            for filename in self.sources & self.session.stale:
+                self.session.remove_spill(filename)
+        self.deleteLater()
+
+    def cancel(self):
+        """Ends the export with an error once the page being written is done. Called on the GUI thread."""
+        self.cancelled = True
+        # Deleting a blocking call that is waiting for the GUI thread lets the worker go on
+        QCoreApplication.removePostedEvents(self)
+
+def page_thumbnail(canvas: JCanvas, size: QSize = THUMBNAIL_SIZE) -> QImage:
+    """Returns the visible layers of canvas scaled to fit size, drawn from its zoomed-out tiles."""
+    rect = canvas.content_rect()
+    scale = min(size.width() / rect.width(), size.height() / rect.height())
+    image = QImage(max(1, round(rect.width() * scale)), max(1, round(rect.height() * scale)), QImage.Format_ARGB32_Premultiplied)
+    image.fill(canvas.color)
+    canvas.layers.update()
+    painter = QPainter(image)
+    painter.translate(-rect.x() * scale, -rect.y() * scale)
+    canvas.pyramid.render(painter, rect, scale)
+    painter.end()
+    return image
+
+class BoardSession(QObject):
+    """The pages of a session, see the module docstring. activate() returns the canvas of a
+    page to show; the session owns the canvases and deletes them when pages are dropped."""
+    pagesChanged = pyqtSignal()  # Pages were added, removed, switched or got new thumbnails
+    spillFailed = pyqtSignal(str)  # Error message of a page that could not be written out
+    def __init__(self, memory_budget: int = SESSION_MEMORY_BUDGET, prefetch_distance: int = PREFETCH_DISTANCE):
+        super().__init__()
+        self.memory_budget = memory_budget
+        self.prefetch_distance = prefetch_distance
+        self.pages = []
+        self.current = -1
+        self.recent = []  # Pages with a canvas, least recently shown first
+        self.pending = []  # Signals of spills and prefetches still running
+        self.directory = None  # Temporary directory of the spilled pages, made on first use
+        self.spills = 0
+        self.exports = []  # PageExports that are still being written
+        self.stale = set()  # Spilled files to delete once no export reads them
+
+    def __len__(self):
+        return len(self.pages)
+
+    def page(self, index: int = None) -> SessionPage:
+        """Returns the page at index, or the current one, which is None while no page is shown."""
+        if index is None:
+            return self.pages[self.current] if self.current >= 0 else None
+        return self.pages[index]
+
+    def add(self, canvas: JCanvas, path: str = None, index: int = None) -> int:
+        """Adds canvas as a page after the current one, or at index, and returns its index."""
+        index = self.current + 1 if index is None else index
+        page = SessionPage(canvas, path)
+        self.watch(page)
+        self.pages.insert(index, page)
+        self.recent.insert(0, page)
+        if index <= self.current:
+            self.current += 1
+        self.update_thumbnail(page)
+        self.pagesChanged.emit()
+        return index
+
+    def replace(self, index: int, canvas: JCanvas, path: str = None):
+        """Makes canvas the content of the page at index, dropping what it had, undo history included."""
+        page = self.pages[index]
+        self.forget(page)
+        self.pages[index] = page = SessionPage(canvas, path)
+        self.watch(page)
+        self.recent.append(page)
+        self.update_thumbnail(page)
+        self.pagesChanged.emit()
+
+    def remove(self, index: int) -> int:
+        """Removes the page at index and returns the index of the page to show instead. The last page stays."""
+        if len(self.pages) < 2:
+            return self.current
+        self.forget(self.pages.pop(index))
+        if index < self.current:
+            self.current -= 1
+        elif index == self.current:
+            self.current = -1  # Nothing is shown until the caller activates a page
+        self.pagesChanged.emit()
+        return min(index, len(self.pages) - 1)
+
+    def activate(self, index: int) -> JCanvas:
+        """Returns the canvas of the page at index, reading it back if it was spilled, and makes it
+        the current page. Raises OSError or ValueError if a spilled page cannot be read."""
+        page = self.pages[index]
+        if 0 <= self.current < len(self.pages) and self.current != index:
+            self.update_thumbnail(self.pages[self.current])
+        if page.canvas is None:
+            self.restore(page)
+        self.current = index
+        self.recent.remove(page)
+        self.recent.append(page)
+        self.prefetch_around(index)
+        self.enforce_budget()
+        self.pagesChanged.emit()
+        return page.canvas
+
+    def nbytes(self) -> int:
+        return sum(page.nbytes() for page in self.pages)
+
+    def export_pages(self) -> PageExport:
+        """Returns every page for vectorExport.write_pdf() on a worker thread, see PageExport."""
+        export = PageExport(self)
+        self.exports.append(export)
+        return export
+
+    def close(self):
+        """Deletes the spilled pages. Pages that are still being written and exports fail quietly."""
+        for export in self.exports:
+            export.cancel()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def watch(self, page: SessionPage):
+        page.canvas.pixelsChanged.connect(lambda _, page=page: setattr(page, 'modified', True))
+
+    def forget(self, page: SessionPage):
+        if page in self.recent:
+            self.recent.remove(page)
+        if page.canvas is not None:
+            page.canvas.deleteLater()
+            page.canvas = None
+        self.remove_spill(page.source)
+
+    def update_thumbnail(self, page: SessionPage):
+        canvas = page.canvas
+        if canvas.is_importing():
+            page.thumbnail = QImage()  # Made once the image is in
+            return
+        if canvas.pending_tiles and not canvas.history.can_undo():
+            # Parts of an opened board that were never shown are not decoded yet, its preview has them
+            preview = canvas.tile_source.preview()
+            if not preview.isNull():
+                page.thumbnail = preview.scaled(THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                return
+        page.thumbnail = page_thumbnail(canvas)
+
+    def enforce_budget(self):
+        """Spills the least recently shown pages, then drops decoded tiles of pages that are no
+        longer next to the current one, until the pixels fit the memory budget."""
+        # Pages being written are already on their way out
+        total = sum(page.nbytes() for page in self.pages if page.spilling is None)
+        current = self.page()
+        for page in list(self.recent):
+            if total <= self.memory_budget:
+                return
+            if page is current or page.spilling is not None or page.canvas.is_saving() or page.canvas.is_importing():
+                continue
+            total -= page.nbytes()
+            self.spill(page)
+        near = set(range(self.current - self.prefetch_distance, self.current + self.prefetch_distance + 1))
+        for index, page in enumerate(self.pages):
+            if total <= self.memory_budget:
+                return
+            if page.prefetched and index not in near:
+                total -= page.nbytes()
+                page.prefetched = None
+
+    def spill(self, page: SessionPage):
+        """Writes the page to a board file on a worker and drops its canvas once that is done.
+        Pages that were not changed since they were read from a board file are dropped right away."""
+        page.zoom = page.canvas.zoom
+        self.update_thumbnail(page)
+        if not page.modified and page.source is not None:
+            self.drop(page)
+            return
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='blackboard-pages-')
+        filename = os.path.join(self.directory, f'page-{self.spills}.bboard')
+        self.spills += 1
+        task = page.canvas.save_task(filename)
+        page.modified = False  # Changes from here on make the file stale
+        page.spilling = task.signals
+        task.signals.finished.connect(lambda filename, error, page=page: self.on_spilled(page, filename, error))
+        self.pending.append(task.signals)
+        QThreadPool.globalInstance().start(task)
+
+    def on_spilled(self, page: SessionPage, filename: str, error: str):
+        if page.spilling in self.pending:
+            self.pending.remove(page.spilling)
+        page.spilling = None
+        if error or page not in self.pages or page.modified:
+            # Failed, removed meanwhile or drawn on again since it was written
+            self.remove_spill(filename)
+            if error and self.directory is not None:
+                self.spillFailed.emit(error)
+            return
+        self.remove_spill(page.source)
+        page.source = filename
+        if page is not self.page():
+            self.drop(page)
+
+    def drop(self, page: SessionPage):
+        """Deletes the canvas of a page whose pixels are in its source, keeping the rest of its state."""
+        canvas = page.canvas
+        page.history, page.strokes = canvas.history, canvas.strokes
+        page.canvas = None
+        self.recent.remove(page)
+        canvas.deleteLater()
+
+    def restore(self, page: SessionPage):
+        reader = BoardReader(page.source)
+        tiles, page.prefetched = page.prefetched, None
+        canvas = JCanvas(color=reader.color.name(), tile_source=DecodedBoard(reader, tiles) if tiles else reader)
+        if page.history is not None:
+            canvas.adopt(page.history, page.strokes)
+            page.history = page.strokes = None
+        canvas.set_zoom(page.zoom)
+        page.canvas = canvas
+        self.watch(page)
+        self.recent.append(page)
+
+    def prefetch_around(self, index: int):
+        for distance in range(1, self.prefetch_distance + 1):
+            for neighbour in (index + distance, index - distance):
+                if 0 <= neighbour < len(self.pages):
+                    self.prefetch(self.pages[neighbour])
+
+    def prefetch(self, page: SessionPage):
+        if page.canvas is not None or page.source is None or page.prefetched is not None or page.prefetching:
+            return
+        page.prefetching = True
+        task = PrefetchTask(page.source)
+        task.signals.finished.connect(lambda filename, tiles, page=page, signals=task.signals: self.on_prefetched(page, signals, filename, tiles))
+        self.pending.append(task.signals)
+        QThreadPool.globalInstance().start(task)
+
+    def on_prefetched(self, page: SessionPage, signals: PrefetchSignals, filename: str, tiles: dict):
+        if signals in self.pending:
+            self.pending.remove(signals)
+        page.prefetching = False
+        # The page may have been shown, removed or written again meanwhile
+        if tiles is not None and page.canvas is None and page.source == filename and page in self.pages:
+            page.prefetched = tiles
+            self.enforce_budget()
+
+    def remove_spill(self, filename: str):
+        """Deletes filename if it is one of the session's own files, never a board the user opened."""
+        if filename is None or self.directory is None or os.path.dirname(filename) != self.directory:
+            return
+        if any(filename in export.sources for export in self.exports):
+            self.stale.add(filename)
+            return
+        self.stale.discard(filename)
+        try:
+            os.remove(filename)
+        except OSError:
+            pass  # Still open on some platforms, the directory is removed on close()
+
+class JPageStrip(QListWidget):
+    """The pages of a session as a row of thumbnails. Hidden while the session has a single page."""
+    pageSelected = pyqtSignal(int)
+    def __init__(self, session: BoardSession):
+        super().__init__()
+        self.session = session
+        self.setObjectName('JPageStrip')
+        self.setViewMode(QListView.IconMode)
+        self.setFlow(QListView.LeftToRight)
+        self.setWrapping(False)
+        self.setMovement(QListView.Static)
+        self.setIconSize(THUMBNAIL_SIZE)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setFixedHeight(THUMBNAIL_SIZE.height() + 48)
+        self.currentRowChanged.connect(self.on_row_changed)
+        session.pagesChanged.connect(self.refresh)
+        self.refresh()
+
+    def refresh(self):
+        self.blockSignals(True)
+        self.clear()
+        for index, page in enumerate(self.session.pages):
+            self.addItem(QListWidgetItem(QIcon(QPixmap.fromImage(page.thumbnail)), str(index + 1)))
+        self.setCurrentRow(self.session.current)
+        self.blockSignals(False)
+        self.setVisible(len(self.session) > 1)
+
+    def on_row_changed(self, row: int):
+        if row >= 0 and row != self.session.current:
+            self.pageSelected.emit(row)
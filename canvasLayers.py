@@ -0,0 +1,250 @@
+import json
+from PyQt5.QtCore import Qt, QRect
+from PyQt5.QtGui import QColor, QImage, QPainter, QRegion
+
+from tiledPixmap import TiledPixmap, draw_area
+
+DEFAULT_LAYERS = ("Background", "Ink", "Annotations")
+
+class Layer:
+    """One layer of a canvas. bounds covers everything that was ever painted on it, raster the
+    parts whose pixels the canvas' vector strokes may not account for, like fills.
+
+    The pixmap, a premultiplied ARGB32 QImage, is only allocated once the layer is first
+    painted on; until then the layer is entirely its fill. Layers of infinite canvases get
+    a TiledPixmap instead."""
+    __slots__ = ('name', 'rect', 'fill', 'visible', 'bounds', 'raster', 'tiled', '_pixmap')
+
+    def __init__(self, name: str, rect: QRect, fill: QColor = None, visible: bool = True, tiled: bool = False):
+        self.name = name
+        self.rect = QRect(rect)
+        self.fill = QColor(fill) if fill is not None else QColor(Qt.transparent)
+        self.visible = visible
+        self.bounds = QRect()
+        self.raster = QRegion()
+        self.tiled = tiled
+        self._pixmap = None
+
+    @property
+    def pixmap(self) -> QImage:
+        if self._pixmap is None:
+            if self.tiled:
+                self._pixmap = TiledPixmap(self.rect, self.fill)
+            else:
+                self._pixmap = QImage(self.rect.size(), QImage.Format_ARGB32_Premultiplied)
+                self._pixmap.fill(self.fill)
+        return self._pixmap
+
+    @pixmap.setter
+    def pixmap(self, pixmap: QImage):
+        self._pixmap = pixmap
+
+    def is_allocated(self) -> bool:
+        return self._pixmap is not None
+
+    def image(self, rect: QRect = None) -> QImage:
+        """Returns the layer content, or only rect of it, or None if nothing was ever painted on it."""
+        if self._pixmap is None:
+            return None
+        if rect is None:
+            # A full image shares the pixels until either side is painted on
+            return self._pixmap.image() if self.tiled else QImage(self._pixmap)
+        return self._pixmap.copy(rect)
+
+class LayerStack:
+    """Layers drawn bottom first over the canvas color, with a cached composite.
+
+    The bottom layer is filled with the canvas color, the others start out transparent.
+    Changes only mark areas of the composite dirty; update() re-composites just those areas,
+    and only from layers that were ever painted there, so empty layers cost nothing.
+
+    Layers are premultiplied ARGB32 QImages. The composite is always opaque, so it is an
+    RGB32 QImage, which has the same pixels; paintEvent draws straight from it, so only
+    the area a repaint exposes ever goes to the screen. With infinite, the layers and the
+    composite are TiledPixmaps that only store the tiles that were drawn on, and rect, the
+    area the canvas shows, can grow with set_rect()."""
+    def __init__(self, width: int, height: int, background: QColor, names: tuple = DEFAULT_LAYERS, infinite: bool = False, rect: QRect = None):
+        self.rect = QRect(0, 0, width, height) if rect is None else QRect(rect)
+        self.width = self.rect.width()
+        self.height = self.rect.height()
+        self.background = QColor(background)
+        self.infinite = infinite
+        self.layers = []
+        for index, name in enumerate(names):
+            self.add(name, self.background if index == 0 else None)
+        if infinite:
+            self.composite = TiledPixmap(self.rect, self.background)
+        else:
+            self.composite = QImage(self.width, self.height, QImage.Format_RGB32)
+            self.composite.fill(self.background)
+        self.dirty = QRegion()
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, index: int) -> Layer:
+        return self.layers[index]
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def add(self, name: str, fill: QColor = None) -> Layer:
+        layer = Layer(name, self.rect, fill, tiled=self.infinite)
+        self.layers.append(layer)
+        return layer
+
+    def set_rect(self, rect: QRect):
+        """Grows or moves the area of an infinite canvas, the pixels stay where they are."""
+        self.rect = QRect(rect)
+        self.width, self.height = rect.width(), rect.height()
+        self.composite.set_rect(rect)
+        for layer in self.layers:
+            layer.rect = QRect(rect)
+            if layer.is_allocated():
+                layer.pixmap.set_rect(rect)
+
+    def set_pixmap(self, index: int, pixmap: QImage):
+        """Replaces the content of a layer, e.g. with a loaded image."""
+        layer = self.layers[index]
+        layer.pixmap = pixmap.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        layer.bounds = pixmap.rect()
+        layer.raster = QRegion(pixmap.rect())
+        self.mark_dirty(pixmap.rect())
+
+    def recolor(self, color: QColor):
+        """Changes the canvas color. Pixels of the bottom layer that were exactly the old color
+        take the new one, anything painted there stays as it is."""
+        from pixelKernels import recolor_image
+        old, self.background = self.background, QColor(color)
+        bottom = self.layers[0]
+        bottom.fill = QColor(color)
+        if bottom.is_allocated():
+            if self.infinite:
+                bottom.pixmap.recolor(color)
+            else:
+                recolor_image(bottom.pixmap, old, color)
+        if self.infinite:
+            self.composite.fill(color)  # Its tiles are rebuilt from the layers below
+        self.mark_dirty(self.composite.rect())
+
+    def pixmaps(self) -> dict:
+        """Returns {index: pixmap} of the layers that were painted on."""
+        return {index: layer.pixmap for index, layer in enumerate(self.layers) if layer.is_allocated()}
+
+    def touch(self, index: int, rect: QRect):
+        """Records that rect of a layer is about to be painted."""
+        layer = self.layers[index]
+        layer.bounds = layer.bounds.united(rect.intersected(self.composite.rect()))
+
+    def mark_raster(self, index: int, rect: QRect):
+        """Records that rect of a layer was painted with something other than a vector stroke."""
+        self.layers[index].raster += rect
+
+    def mark_dirty(self, rect: QRect):
+        self.dirty += rect.intersected(self.composite.rect())
+
+    def set_visible(self, index: int, visible: bool):
+        layer = self.layers[index]
+        if layer.visible != visible:
+            layer.visible = visible
+            self.mark_dirty(layer.bounds)
+
+    def update(self, rect: QRect = None) -> QRegion:
+        """Re-composites the dirty areas, or only those inside rect, and returns them."""
+        if rect is None:
+            dirty, self.dirty = self.dirty, QRegion()
+        else:
+            dirty = self.dirty.intersected(rect)
+            self.dirty -= dirty
+        if dirty.isEmpty():
+            return dirty
+        if self.infinite:
+            self._update_tiles(dirty)
+            return dirty
+        painter = QPainter(self.composite)
+        for rect in dirty.rects():
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.fillRect(rect, self.background)
+            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+            for layer in self.layers:
+                if layer.visible and layer.bounds.intersects(rect):
+                    painter.drawImage(rect, layer.pixmap, rect)
+        painter.end()
+        return dirty
+
+    def _update_tiles(self, dirty: QRegion):
+        # Composite tiles no layer has a tile for are left out, they are the background
+        composite = self.composite
+        for tx, ty in {key for rect in dirty.rects() for key in composite.tiles_in(rect)}:
+            tile_rect = composite.tile_rect(tx, ty)
+            layers = [layer for layer in self.layers if layer.visible and layer.bounds.intersects(tile_rect)
+                      and (tx, ty) in layer.pixmap.tiles]
+            if not layers:
+                composite.tiles.pop((tx, ty), None)
+                continue
+            tile = composite.tiles.get((tx, ty))
+            rects = (dirty & tile_rect).rects()
+            if tile is None:
+                tile = QImage(tile_rect.size(), QImage.Format_ARGB32_Premultiplied)
+                rects = [tile_rect]
+            painter = QPainter(tile)
+            painter.translate(-tile_rect.topLeft())
+            for rect in rects:
+                painter.setCompositionMode(QPainter.CompositionMode_Source)
+                painter.fillRect(rect, self.background)
+                painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+                for layer in layers:
+                    draw_area(painter, rect, layer.pixmap, rect)
+            painter.end()
+            composite.tiles[(tx, ty)] = tile
+
+    def nbytes(self) -> int:
+        """Returns the bytes of pixel data held by the allocated layers and the composite."""
+        pixmaps = [layer.pixmap for layer in self.layers if layer.is_allocated()] + [self.composite]
+        return sum(pixmap.nbytes() if isinstance(pixmap, TiledPixmap) else pixmap.sizeInBytes() for pixmap in pixmaps)
+
+    def content_rect(self) -> QRect:
+        """Returns the area that differs from the background. That is the whole canvas unless it is infinite."""
+        if not self.infinite:
+            return QRect(self.rect)
+        rect = QRect()
+        for layer in self.layers:
+            if layer.is_allocated():
+                rect = rect.united(layer.pixmap.content_rect().intersected(layer.bounds))
+        return rect
+
+    def flatten(self, rect: QRect = None) -> QImage:
+        """Returns the visible layers flattened, the whole canvas or only rect of it."""
+        self.update()
+        if rect is None and not self.infinite:
+            return QImage(self.composite)  # Shares the pixels until the composite is next painted
+        image = self.composite.copy() if rect is None else self.composite.copy(rect)
+        # Opaque either way, images without an alpha channel are written smaller and faster
+        image.reinterpretAsFormat(QImage.Format_RGB32)
+        return image
+
+    def images(self, rect: QRect = None) -> list:
+        """Returns each layer as an image, the whole canvas or only rect of it, bottom first,
+        with None for upper layers that were never painted on."""
+        images = [layer.image(rect) for layer in self.layers]
+        if images[0] is None:
+            size = self.rect.size() if rect is None else rect.size()
+            images[0] = QImage(size, QImage.Format_ARGB32)
+            images[0].fill(self.layers[0].fill)
+        return images
+
+    def describe(self) -> str:
+        """Returns the layer names and visibility as stored in a board's "layers" text."""
+        return json.dumps([{"name": layer.name, "visible": layer.visible} for layer in self.layers])
+
+def parse_layers(text: str, count: int) -> list:
+    """Returns [(name, visible)] for count layers from a "layers" text, filling in defaults."""
+    try:
+        described = [(str(entry["name"]), bool(entry.get("visible", True))) for entry in json.loads(text)]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        described = []
+    defaults = [(name, True) for name in DEFAULT_LAYERS]
+    layers = described[:count]
+    for index in range(len(layers), max(count, len(DEFAULT_LAYERS))):
+        layers.append(defaults[index] if index < len(defaults) else (f"Layer {index + 1}", True))
+    return layers
@@ -0,0 +1,268 @@
+"""Performance counters for the drawing path.
+
+Code under measurement wraps stages in `with metrics.stage("name"):` or decorates them with
+@timed("name"), and counts events with metrics.count(). While metrics.enabled is False, stage()
+hands out one shared no-op context manager, timed functions are called straight through and
+count() returns at once, so the calls can stay in hot paths. Set the
+BLACKBOARD_METRICS environment variable to record from startup. Stages may be recorded
+from worker threads, like the encoding of a save.
+
+A trace, written with export() as JSON or CSV, holds per-stage latency statistics, counter
+totals and rates, and gauges such as the memory held by the undo history.
+"""
+import contextlib
+import csv
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import QLabel
+
+TRACE_VERSION = 1
+SAMPLES_KEPT = 4096  # Most recent durations kept per stage for percentiles
+FRAME_GAP = 0.5  # Seconds between paints after which the canvas counts as idle, not slow
+RECORD_FROM_STARTUP = bool(os.environ.get("BLACKBOARD_METRICS"))
+
+_IDLE = contextlib.nullcontext()
+
+def percentile(values: list, fraction: float) -> float:
+    """Returns the nearest-rank percentile of values, or 0 if there are none."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+class StageStats:
+    __slots__ = ('count', 'total', 'maximum', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.samples = deque(maxlen=SAMPLES_KEPT)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        self.samples.append(seconds)
+
+    def summary(self) -> dict:
+        """Returns the statistics in milliseconds."""
+        samples = list(self.samples)
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total * 1000 / self.count if self.count else 0.0,
+            "p50_ms": percentile(samples, 0.5) * 1000,
+            "p95_ms": percentile(samples, 0.95) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000,
+            "max_ms": self.maximum * 1000,
+        }
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    """Stage timers, event counters and gauges for one application run."""
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.stages = {}  # name -> StageStats
+        self.counters = {}  # name -> count
+        self.gauges = {}  # name -> callable returning a number
+        self.ratios = {}  # name -> (stage, counter), milliseconds of the stage per counted unit
+        self.started = time.time()
+        self._clock = time.perf_counter()
+        self._last_frame = None
+        self._rate_marks = {}  # counter name -> (time, count) the current rate is measured from
+        self._rates = {}  # counter name -> events per second over the last second or so
+        self._lock = threading.Lock()  # Guards stages and counters, workers record too
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+        self.started = time.time()
+        self._clock = time.perf_counter()
+        self._last_frame = None
+        self._rate_marks.clear()
+        self._rates.clear()
+
+    def stage(self, name: str):
+        """Returns a context manager that times the stage name, or a no-op one while disabled."""
+        if not self.enabled:
+            return _IDLE
+        return _Timer(self, name)
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.add(seconds)
+
+    def count(self, name: str, amount: int = 1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def frame(self):
+        """Records the time since the previous painted frame, unless the canvas was idle in between."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self._last_frame is not None and now - self._last_frame < FRAME_GAP:
+            self.record("frame", now - self._last_frame)
+        self._last_frame = now
+
+    def set_gauge(self, name: str, read):
+        """Registers read(), called whenever the metrics are summarized, as the current value of name."""
+        self.gauges[name] = read
+
+    def set_ratio(self, name: str, stage: str, counter: str):
+        """Reports the total time of stage divided by the count of counter as name, e.g. ms per segment."""
+        self.ratios[name] = (stage, counter)
+
+    def ratio(self, name: str) -> float:
+        stage, counter = self.ratios[name]
+        stats, count = self.stages.get(stage), self.counters.get(counter, 0)
+        return stats.total * 1000 / count if stats is not None and count else 0.0
+
+    def rate(self, name: str) -> float:
+        """Returns the recent rate of a counter in events per second."""
+        now, count = time.perf_counter(), self.counters.get(name, 0)
+        mark = self._rate_marks.get(name)
+        if mark is None:
+            self._rate_marks[name] = (now, count)
+        elif now - mark[0] >= 1.0:
+            self._rates[name] = (count - mark[1]) / (now - mark[0])
+            self._rate_marks[name] = (now, count)
+        return self._rates.get(name, 0.0)
+
+    def summary(self) -> dict:
+        elapsed = max(time.perf_counter() - self._clock, 1e-9)
+        gauges = {}
+        for name, read in self.gauges.items():
+            try:
+                gauges[name] = read()
+            except RuntimeError:
+                pass  # The object behind the gauge was deleted
+        with self._lock:
+            stages = {name: stats.summary() for name, stats in sorted(self.stages.items())}
+            counters = {name: {"count": count, "per_second": count / elapsed} for name, count in sorted(self.counters.items())}
+            ratios = {name: self.ratio(name) for name in sorted(self.ratios)}
+        return {
+            "version": TRACE_VERSION,
+            "started": self.started,
+            "duration_s": elapsed,
+            "stages": stages,
+            "counters": counters,
+            "ratios": ratios,
+            "gauges": gauges,
+        }
+
+    def export(self, filename: str):
+        """Writes the summary as JSON, or as CSV if filename ends in .csv, one row per metric."""
+        summary = self.summary()
+        if not filename.lower().endswith('.csv'):
+            with open(filename, 'w', encoding='utf-8') as file:
+                json.dump(summary, file, indent=2)
+            return
+        columns = ["kind", "name", "count", "total_ms", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms", "per_second", "value"]
+        with open(filename, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, columns, restval='')
+            writer.writeheader()
+            for name, stats in summary["stages"].items():
+                writer.writerow({"kind": "stage", "name": name, **stats})
+            for name, counter in summary["counters"].items():
+                writer.writerow({"kind": "counter", "name": name, **counter})
+            for name, value in summary["ratios"].items():
+                writer.writerow({"kind": "ratio", "name": name, "value": value})
+            for name, value in summary["gauges"].items():
+                writer.writerow({"kind": "gauge", "name": name, "value": value})
+
+    def summary_text(self) -> str:
+        """Returns a few lines for the on-canvas HUD."""
+        lines = []
+        with self._lock:
+            recent = {name: list(stats.samples)[-120:] for name, stats in sorted(self.stages.items()) if stats.samples}
+            ratios = {name: self.ratio(name) for name in sorted(self.ratios)}
+        frame = recent.pop("frame", None)
+        if frame:
+            lines.append(f"frame  {percentile(frame, 0.5) * 1000:6.1f} ms p50  {percentile(frame, 0.95) * 1000:6.1f} ms p95")
+        lines.append(f"input  {self.rate('input.events'):6.0f} events/s")
+        for name, samples in recent.items():
+            lines.append(f"{name:<16} {sum(samples) * 1000 / len(samples):7.2f} ms avg  {max(samples) * 1000:7.2f} max")
+        for name, value in ratios.items():
+            lines.append(f"{name:<16} {value:7.3f} ms")
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except RuntimeError:
+                continue
+            lines.append(f"{name:<16} {value / 1024 / 1024:7.2f} MB" if name.endswith("bytes") else f"{name:<16} {value}")
+        return "\n".join(lines)
+
+metrics = Metrics(enabled=RECORD_FROM_STARTUP)
+metrics.set_ratio("stroke.ms/segment", "stroke.draw", "stroke.segments")  # Drawing cost of the stroke filter output
+
+def timed(name: str):
+    """Decorator that records every call of a function as the stage name while metrics are enabled."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+class MetricsHud(QLabel):
+    """Translucent readout of the metrics, kept in the top left corner of its parent."""
+    def __init__(self, parent=None, interval: int = 250):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setFont(QFont("monospace", 8))
+        self.setStyleSheet("background: rgba(0, 0, 0, 160); color: #e0e0e0; padding: 4px;")
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.refresh)
+        self.hide()
+
+    def set_visible(self, visible: bool):
+        if visible:
+            metrics.enabled = True
+            self.refresh()
+            self.show()
+            self.raise_()
+            self.timer.start()
+        else:
+            # Recording stops with the HUD, unless it was asked for from startup
+            metrics.enabled = RECORD_FROM_STARTUP
+            self.timer.stop()
+            self.hide()
+
+    def refresh(self):
+        self.setText(metrics.summary_text() or "No samples yet")
+        self.adjustSize()
+        self.move(8, 8)
@@ -1,16 +1,123 @@
-from PyQt5.QtCore import Qt, QSize, QEvent, pyqtSignal
+import copy
+import math
+import os
+import uuid
+from contextlib import contextmanager
+from PyQt5.QtCore import (
+    Qt, QSize, QCoreApplication, QEvent, QPoint, QPointF, QRect, QRectF, QObject, QRunnable, QThreadPool,
+    QTimer, pyqtSignal
+)
 from PyQt5.QtGui import (
-    QFont, QPixmap, QColor, QPainter, QBrush, QConicalGradient,
-    QImageWriter
+    QImage, QColor, QPainter, QBrush,
+    QConicalGradient, QImageWriter, QPolygonF, QRegion, QTabletEvent, QTransform
 )
 from PyQt5.QtWidgets import (
-    QLabel, QPushButton, QScrollArea, QWidget, QVBoxLayout, QHBoxLayout,
+    QLabel, QPushButton, QScrollArea, QWidget, QVBoxLayout,
     QColorDialog, QMessageBox
 )
 
+from boardFormat import BoardReader, is_board_file, write_board
+from canvasLayers import LayerStack, parse_layers
+from canvasMetrics import metrics, timed
+from canvasSelection import Selection, draw_outline
+from strokeFilter import FILTER_PRESETS, StrokeFilter
+from strokeModel import SHAPE_TOOLS, Stroke, StrokeStore, StrokeTileCache
+from strokeOutline import LiveStroke
+from tiledPixmap import draw_area, painter_for, put_images
+from vectorExport import VectorPage, is_vector_file, write_vector
+from tilePyramid import TilePyramid
+from tileHistory import TileHistory
+
+GROW_MARGIN = 256  # Infinite canvases grow once drawing comes this close to an edge
+GROW_STEP = 1024  # and then by whole multiples of this, so growing stays rare
+HIT_TOLERANCE = 4  # Screen pixels a click may miss a stroke by
+
+def image_texts(color: str, app_name: str = None) -> dict:
+    """Returns the metadata saved with a board: its canvas color and, if app_name is set, an "is_*app_name*_image" tag."""
+    texts = {"canvas_color": color}
+    if app_name is not None:
+        texts[f"is_{app_name}_image"] = "yes"
+    return texts
+
+def parse_origin(text: str) -> QPoint:
+    """Returns the position of an infinite board's top left corner from its "origin" text, or None for fixed boards."""
+    try:
+        x, y = (int(value) for value in text.split(','))
+    except (ValueError, AttributeError):
+        return None
+    return QPoint(x, y)
+
+def png_quality(compression: int) -> int:
+    """Returns the QImageWriter quality for a PNG zlib level, Qt maps quality 100..0 onto levels 0..9."""
+    return 100 - math.ceil(min(max(compression, 0), 9) * 91 / 9)
+
+def write_image(image: QImage, filename: str, texts: dict = None, compression: int = 6) -> str:
+    """Writes image to filename through a temporary file that replaces the target once complete.
+
+    texts are stored as metadata, compression is the PNG zlib level from 0 (fastest) to 9 (smallest).
+    Returns an empty string on success or the error message. Safe to call from worker threads."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    image_format = os.path.splitext(filename)[1][1:].lower() or 'png'
+    # Let the writer create the file so it gets the usual permissions
+    temp_path = os.path.join(directory, f".{os.path.basename(filename)}.{uuid.uuid4().hex[:8]}.tmp")
+    writer = QImageWriter(temp_path, image_format.encode())
+    for key, value in (texts or {}).items():
+        writer.setText(key, value)
+    if image_format == 'png':
+        writer.setQuality(png_quality(compression))
+    ok = writer.write(image)
+    error = writer.errorString()
+    del writer  # Close the file before it is moved
+    try:
+        if not ok:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return error
+        os.replace(temp_path, filename)
+    except OSError as e:
+        return str(e)
+    return ""
+
+class ImageSaveSignals(QObject):
+    finished = pyqtSignal(str, str)  # filename, error message or empty on success
+
+class ImageSaveTask(QRunnable):
+    """Writes content to filename on a QThreadPool worker, with the writer its extension picks.
+
+    content is what that writer takes: a QImage snapshot for images, a board's layer images
+    for .bboard, and for .svg and .pdf a VectorPage, a board file name or any iterable of
+    those, like a PageExport."""
+    def __init__(self, content, filename: str, texts: dict = None, compression: int = 6):
+        super().__init__()
+        self.content = content
+        self.filename = filename
+        self.texts = texts
+        self.compression = compression
+        self.signals = ImageSaveSignals()
+
+    @timed("save.encode")
+    def run(self):
+        try:
+            writer = write_board if is_board_file(self.filename) else write_vector if is_vector_file(self.filename) else write_image
+            error = writer(self.content, self.filename, self.texts, self.compression)
+        except Exception as e:
+            error = str(e)
+        self.signals.finished.emit(self.filename, error)
+
 class JCanvas(QLabel):
     wheelScrolled = pyqtSignal(int, bool)
-    def __init__(self, width: int = 640, height: int = 480, color: str = '#1c1c1c', loadedImage: QPixmap = None):
+    panRequested = pyqtSignal(QPoint)
+    saveFinished = pyqtSignal(str, str)  # filename, error message or empty on success
+    pixelsChanged = pyqtSignal(QRect)  # Canvas area whose pixels were modified
+    strokeUpdated = pyqtSignal(object, int)  # Stroke being drawn, index of its first new point
+    strokeFinished = pyqtSignal(object)  # Completed pen, eraser or shape stroke
+    layerCleared = pyqtSignal(int)  # Layer index
+    areaFilled = pyqtSignal(int, int, QColor, int, int)  # x, y, color, tolerance, layer
+    selectionMoved = pyqtSignal(QPolygonF, QTransform, int)  # Outline before the move, transform, layer
+    areaRestored = pyqtSignal(QRect, int)  # Area of a layer an undo, a redo or a stroke erase put back
+    canvasGrown = pyqtSignal(QPoint)  # Widget pixels the old content moved right and down by
+    def __init__(self, width: int = 640, height: int = 480, color: str = '#1c1c1c', loadedImage: QImage = None, tile_source: BoardReader = None,
+                 infinite: bool = False):
         super().__init__()
         self.width = width
         self.height = height
@@ -18,57 +125,683 @@ class JCanvas(QLabel):
         self.tool = "pen"
         self.toolWidth = 4
         self.use_pressure = True  # Enable pressure sensitivity
-        self.history = []  # Stack to store undo history
-        self.redo_stack = []  # Stack to store redo history
-        self.max_history = 10  # Limit history size
+        self.pressure = 1.0
+        self.history = TileHistory()  # Undo/redo history of the tiles each change touched
+        self.strokes = StrokeStore()  # Vector model of everything drawn on the canvas
+        self.current_stroke = None
         self.saved_for_stroke = False
+        self.save_compression = 6  # zlib level for saved images, 0 is fastest and 9 smallest
+        self.pending_saves = []
+        self.pending_import = None  # Signals of the ImageImportTask still decoding the background
+
+        # Tiles of an opened board file that have not been decoded yet, they are
+        # loaded when they are first shown or drawn on.
+        self.tile_source = tile_source
+        self.pending_tiles = set()
+        self.tile_origin = QPoint()  # Canvas position of the board's top left corner
 
+        # Drawing goes into the active layer, self.pixmap is the cached composite of all
+        # layers, an RGB32 QImage that paintEvent draws the exposed area of, so
+        # neither the label nor the screen ever holds a copy of all of it. Infinite
+        # canvases keep only the tiles that were drawn on and grow as drawing nears their
+        # edges; their extent() can start at negative canvas coordinates.
         if loadedImage is not None and not loadedImage.isNull():
-            self.pixmap = loadedImage.copy()
-            self.width = self.pixmap.width()
-            self.height = self.pixmap.height()
+            self.width = loadedImage.width()
+            self.height = loadedImage.height()
+            self.layers = LayerStack(self.width, self.height, self.color)
+            self.layers.set_pixmap(0, loadedImage)
+        elif tile_source is not None:
+            self.width = tile_source.width
+            self.height = tile_source.height
+            layers = parse_layers(tile_source.text("layers"), tile_source.layer_count)
+            origin = parse_origin(tile_source.text("origin"))
+            if origin is None:
+                self.layers = LayerStack(self.width, self.height, self.color, [name for name, _ in layers])
+            else:
+                # Saved infinite boards only hold their content, leave room to draw around it
+                self.tile_origin = origin
+                rect = QRect(origin, QSize(self.width, self.height)).adjusted(-GROW_MARGIN, -GROW_MARGIN, GROW_MARGIN, GROW_MARGIN)
+                self.width, self.height = rect.width(), rect.height()
+                self.layers = LayerStack(self.width, self.height, self.color, [name for name, _ in layers], infinite=True, rect=rect)
+            for index, (_, visible) in enumerate(layers):
+                self.layers.set_visible(index, visible)
+            self.pending_tiles = {(layer, tx, ty) for layer in range(tile_source.layer_count)
+                                  for ty in range(tile_source.tiles_y) for tx in range(tile_source.tiles_x)
+                                  if tile_source.is_stored(tx, ty, layer)}
         else:
-            self.pixmap = QPixmap(width, height)
-            self.pixmap.fill(self.color)
-        self.setPixmap(self.pixmap)
+            self.layers = LayerStack(width, height, self.color, infinite=infinite)
+        self.active_layer = min(1, len(self.layers) - 1)  # Ink goes above the background by default
+        self.pixmap = self.layers.composite
+        self.pyramid = TilePyramid()  # Downsampled tiles for zoomed-out views
+        self.pyramid.set_source(self.pixmap)
+        self.stroke_cache = StrokeTileCache(self.strokes, self.layers)  # Strokes redrawn sharp for zoomed-in views
+        self.zoom = 1.0
+        self.setFixedSize(self.width, self.height)
 
         self.last_x, self.last_y = None, None
+        self.pan_origin = None
+
+        # Pen and eraser samples are queued, decimated and smoothed by the tool's
+        # StrokeFilter, and drawn once per frame as the new tail of the stroke's outline
+        self.filter_settings = copy.deepcopy(FILTER_PRESETS)  # Tool -> StrokeFilter arguments
+        self.stroke_filter = None
+        self.live_stroke = None  # Paints the stroke being drawn, see strokeOutline.py
+        self.pending_samples = []  # (x, y, pressure) in canvas coordinates
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setInterval(0)  # Fires once the queued input events are handled
+        self.frame_timer.timeout.connect(self.flush_samples)
+        self.shape_start = None
+        self.shape_end = None  # Current drag position while a shape is being previewed
         self.pen_color = QColor('#ffffff')
+        self.fill_tolerance = 32  # Largest per-channel difference the fill tool spreads over
+        self.selection = None  # Area outlined with the select or lasso tool
+        self.selection_points = []  # Outline being drawn, in canvas coordinates
+        self.selection_drag = None  # (mode, last position) while the selection is moved, scaled or rotated
 
     def save_state(self):
-        if len(self.history) >= self.max_history:
-            self.history.pop(0)
-        self.history.append(self.pixmap.copy())
-        self.redo_stack.clear()
+        """Starts recording an undo step. Areas must be passed to touch_state before they are painted."""
+        self.history.begin()
+
+    @timed("history.touch")
+    def touch_state(self, rect: QRect):
+        """Records rect of the active layer for the open undo step before it is painted."""
+        self.grow_to(rect)
+        self.load_tiles(rect)
+        self.layers.touch(self.active_layer, rect)
+        self.history.touch(self.layer().pixmap, rect, self.active_layer)
+
+    @contextmanager
+    def under_live_stroke(self, index: int, rect: QRect):
+        """Wraps a change to rect of layer index made while a stroke is being drawn, e.g. by a
+        collaborator. The stroke keeps the pixels it was drawn over, which would otherwise put
+        back what was there before the change."""
+        if self.live_stroke is None or index != self.active_layer:
+            yield
+            return
+        lifted = self.live_stroke.lift(rect)
+        self.layers.mark_dirty(lifted)
+        yield
+        if not lifted.isEmpty():
+            self.live_stroke.paint(lifted)
+            self.invalidate(lifted)
+
+    def extent(self) -> QRect:
+        """Returns the canvas area the widget shows, which only starts at (0, 0) if the canvas is not infinite."""
+        return self.layers.rect
+
+    def content_rect(self) -> QRect:
+        """Returns the area saving exports: everything drawn on an infinite canvas, or its extent
+        while it is empty, and the whole of other canvases."""
+        rect = self.layers.content_rect()
+        return rect if not rect.isEmpty() else self.extent()
+
+    def grow_to(self, rect: QRect):
+        """Grows an infinite canvas so that rect lies at least GROW_MARGIN inside its edges."""
+        extent = self.extent()
+        wanted = rect.adjusted(-GROW_MARGIN, -GROW_MARGIN, GROW_MARGIN, GROW_MARGIN)
+        if not self.layers.infinite or rect.isEmpty() or extent.contains(wanted):
+            return
+        left = min(extent.left(), extent.left() - math.ceil((extent.left() - wanted.left()) / GROW_STEP) * GROW_STEP)
+        top = min(extent.top(), extent.top() - math.ceil((extent.top() - wanted.top()) / GROW_STEP) * GROW_STEP)
+        right = max(extent.right(), extent.right() + math.ceil((wanted.right() - extent.right()) / GROW_STEP) * GROW_STEP)
+        bottom = max(extent.bottom(), extent.bottom() + math.ceil((wanted.bottom() - extent.bottom()) / GROW_STEP) * GROW_STEP)
+        grown = QRect(QPoint(left, top), QPoint(right, bottom))
+        self.layers.set_rect(grown)
+        self.width, self.height = grown.width(), grown.height()
+        self.pyramid.set_source(self.pixmap)
+        self.setFixedSize(max(1, round(self.width * self.zoom)), max(1, round(self.height * self.zoom)))
+        self.update()
+        shift = extent.topLeft() - grown.topLeft()
+        self.canvasGrown.emit(QPoint(round(shift.x() * self.zoom), round(shift.y() * self.zoom)))
+
+    def layer(self, index: int = None):
+        """Returns the layer at index, or the active one."""
+        return self.layers[self.active_layer if index is None else index]
+
+    def set_active_layer(self, index: int):
+        self.active_layer = min(max(index, 0), len(self.layers) - 1)
+
+    def set_layer_visible(self, index: int, visible: bool):
+        self.layers.set_visible(index, visible)
+        self.stroke_cache.invalidate(self.layers[index].bounds)
+        self.invalidate(self.layers[index].bounds)
+
+    def load_tiles(self, rect: QRect):
+        """Decodes the tiles of the opened board file that intersect rect and are not loaded yet."""
+        if not self.pending_tiles:
+            return
+        tiles = list(self.tile_source.tiles_in(rect.translated(-self.tile_origin)))
+        for layer in range(len(self.layers)):
+            for tx, ty in tiles:
+                if (layer, tx, ty) not in self.pending_tiles:
+                    continue
+                self.pending_tiles.discard((layer, tx, ty))
+                tile_rect = self.tile_source.tile_rect(tx, ty).translated(self.tile_origin)
+                put_images(self.layers[layer].pixmap, [(tile_rect.topLeft(), self.tile_source.read_tile(tx, ty, layer))])
+                self.layers.touch(layer, tile_rect)
+                self.layers.mark_raster(layer, tile_rect)
+                self.layers.mark_dirty(tile_rect)
+                self.pyramid.invalidate(tile_rect)
+        if not self.pending_tiles:
+            self.tile_source.close()
+            self.tile_source = None
+
+    def snapshot(self) -> QImage:
+        """Returns the complete canvas image with all visible layers flattened, loading any tiles that were not shown yet.
+        Infinite canvases are cropped to content_rect()."""
+        self.load_tiles(self.pixmap.rect())
+        if self.layers.infinite:
+            return self.layers.flatten(self.content_rect())
+        return self.layers.flatten()
+
+    def layer_images(self) -> list:
+        """Returns every layer as an image, bottom first, loading any tiles that were not shown yet.
+        Infinite canvases are cropped to content_rect()."""
+        self.load_tiles(self.pixmap.rect())
+        if self.layers.infinite:
+            return self.layers.images(self.content_rect())
+        return self.layers.images()
+
+    def commit_state(self):
+        self.history.commit()
 
+    @timed("history.undo")
     def undo(self):
-        if self.history:
-            self.redo_stack.append(self.pixmap.copy())
-            self.pixmap = self.history.pop()
-            self.setPixmap(self.pixmap)
-            self.update()
+        self.deselect()
+        self.prepare_step(self.history.peek())
+        delta = self.history.undo(self.layers.pixmaps())
+        if delta is not None:
+            self.apply_strokes(delta.removed, delta.added)
+            self.invalidate(delta.bounds())
+            self.emit_restored(delta)
 
+    @timed("history.redo")
     def redo(self):
-        if self.redo_stack:
-            self.history.append(self.pixmap.copy())
-            self.pixmap = self.redo_stack.pop()
-            self.setPixmap(self.pixmap)
-            self.update()
+        self.deselect()
+        self.prepare_step(self.history.peek(redo=True))
+        delta = self.history.redo(self.layers.pixmaps())
+        if delta is not None:
+            self.apply_strokes(delta.added, delta.removed)
+            self.invalidate(delta.bounds())
+            self.emit_restored(delta)
+
+    def emit_restored(self, delta):
+        for layer in sorted({key[0] for key in delta.tiles}):
+            area = QRect()
+            for key, (tile_rect, _) in delta.tiles.items():
+                if key[0] == layer:
+                    area = area.united(tile_rect)
+            self.areaRestored.emit(area, layer)
+
+    def prepare_step(self, delta):
+        """Makes sure the areas an undo or redo step restores are loaded and allocated. A canvas
+        that adopted the history of an earlier one may not have them yet."""
+        if delta is None:
+            return
+        bounds = delta.bounds()
+        self.grow_to(bounds)
+        # Tiles of a board file that load later would overwrite the restored pixels
+        self.load_tiles(bounds)
+        for layer, _, _ in delta.tiles:
+            self.layers.touch(layer, bounds)
+            self.layers[layer].pixmap  # Allocates the layer, the step writes into it
+
+    def adopt(self, history: TileHistory, strokes: StrokeStore):
+        """Takes over the undo history and vector strokes of an earlier canvas of the same board,
+        e.g. one that was written to a board file and dropped to save memory."""
+        self.history = history
+        self.strokes = strokes
+        self.stroke_cache = StrokeTileCache(self.strokes, self.layers)
+
+    def apply_strokes(self, added: list = (), removed: list = ()):
+        """Adds and removes strokes from the vector model and drops the cached tiles they cover."""
+        for stroke in removed:
+            self.strokes.remove(stroke)
+            self.stroke_cache.invalidate(stroke.bounds())
+        for stroke in added:
+            self.strokes.add(stroke)
+            self.stroke_cache.invalidate(stroke.bounds())
 
     def clear(self):
+        """Clears the active layer, the background layer goes back to the canvas color."""
         self.save_state()
-        self.pixmap.fill(QColor(self.color))
-        self.setPixmap(self.pixmap)
-        self.update()
+        # Tiles of an opened board that load later would bring back what was cleared
+        self.load_tiles(self.pixmap.rect())
+        bounds = self.layer().bounds
+        self.touch_state(bounds)
+        removed = [stroke for stroke in self.strokes if stroke.layer == self.active_layer]
+        self.history.record_strokes(removed=removed)
+        self.apply_strokes(removed=removed)
+        self.layer().pixmap.fill(self.color if self.active_layer == 0 else QColor(Qt.transparent))
+        self.commit_state()
+        self.invalidate(bounds)
+        self.layerCleared.emit(self.active_layer)
+
+    def paint_stroke(self, stroke: Stroke, start: int = 1, stop: int = None):
+        """Paints a stroke made elsewhere, e.g. by a collaborator, into its layer.
+
+        Pen and eraser strokes are limited to the segments ending at point indices start..stop-1.
+        This is not recorded in the undo history, and the undo steps that reach into it are dropped."""
+        stop = len(stroke) if stop is None else stop
+        if stroke.tool in SHAPE_TOOLS or len(stroke) == 1:
+            area = stroke.bounds()
+        else:
+            area = QRectF()
+            for i in range(max(start, 1), stop):
+                area = area.united(stroke.segment_bounds(i))
+        rect = area.toAlignedRect()
+        if rect.isEmpty():
+            return
+        index = min(stroke.layer, len(self.layers) - 1)
+        self.grow_to(rect)
+        self.load_tiles(rect)
+        self.layers.touch(index, rect)
+        with self.under_live_stroke(index, rect), painter_for(self.layers[index].pixmap, rect) as painter:
+            if stroke.tool not in SHAPE_TOOLS:
+                painter.setRenderHint(QPainter.Antialiasing)  # Like draw_segments, shapes are drawn aliased
+            stroke.render(painter, start, stop)
+        self.history.forget(rect, index)
+        self.stroke_cache.invalidate(area)
+        self.invalidate(rect)
+
+    @timed("erase.stroke")
+    def erase_stroke(self, x: float, y: float) -> bool:
+        """Erases the whole top-most stroke of the active layer under (x, y) by drawing its area again
+        from the other strokes there, as one undo step. Areas of the layer that hold pixels the
+        strokes do not account for, like fills, are left alone. Returns False if nothing was erased."""
+        stroke = self.strokes.hit_test(x, y, HIT_TOLERANCE / self.zoom, self.active_layer)
+        if stroke is None:
+            return False
+        layer = self.layer()
+        rect = stroke.bounds().toAlignedRect().intersected(self.pixmap.rect())
+        if rect.isEmpty() or layer.raster.intersects(rect):
+            return False
+        self.save_state()
+        self.touch_state(rect)
+        self.history.record_strokes(removed=[stroke])
+        self.apply_strokes(removed=[stroke])
+        with painter_for(layer.pixmap, rect) as painter:
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.fillRect(rect, layer.fill)
+            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+            self.strokes.render(painter, rect, self.active_layer)
+        self.commit_state()
+        self.invalidate(rect)
+        self.areaRestored.emit(rect, self.active_layer)
+        return True
+
+    def paint_clear(self, index: int):
+        """Clears a layer on behalf of a collaborator, outside of the undo history."""
+        index = min(index, len(self.layers) - 1)
+        self.load_tiles(self.pixmap.rect())
+        self.apply_strokes(removed=[stroke for stroke in self.strokes if stroke.layer == index])
+        with self.under_live_stroke(index, self.layers[index].bounds):
+            self.layers[index].pixmap.fill(self.color if index == 0 else QColor(Qt.transparent))
+        self.history.forget(self.layers[index].bounds, index)
+        self.invalidate(self.layers[index].bounds)
+
+    @timed("recolor")
+    def set_color(self, color: QColor):
+        """Changes the canvas color. The background layer takes it wherever it was the old color,
+        in the undo history too, so undoing an earlier step does not bring the old color back.
+        The change itself is not an undo step."""
+        color = QColor(color)
+        if color == self.color:
+            return
+        self.deselect()
+        # Tiles of an opened board that load later would still be the old color
+        self.load_tiles(self.pixmap.rect())
+        self.history.recolor(0, self.color, color)
+        self.layers.recolor(color)
+        self.color = color
+        self.stroke_cache.invalidate()
+        self.invalidate(self.pixmap.rect())
+
+    @timed("fill")
+    def fill(self, x: int, y: int):
+        """Fills the area of similar color around (x, y) with the pen color, on the active layer."""
+        self.save_state()
+        filled = self.fill_area(x, y, self.pen_color, self.fill_tolerance, self.active_layer, record=True)
+        self.commit_state()
+        if filled:
+            self.areaFilled.emit(x, y, self.pen_color, self.fill_tolerance, self.active_layer)
+
+    def fill_area(self, x: int, y: int, color: QColor, tolerance: int, index: int, record: bool = False) -> bool:
+        """Fills the area around (x, y) into a layer. The area is found on the visible canvas, so
+        outlines on other layers still bound it. With record, only the tiles the fill reaches
+        go into the open undo step, without it the undo steps that reach into the filled area
+        are dropped. Returns False if (x, y) is outside the canvas.
+
+        On infinite canvases the fill stays within GROW_MARGIN of the content and (x, y)."""
+        if not self.pixmap.rect().contains(x, y):
+            return False
+        index = min(index, len(self.layers) - 1)
+        self.load_tiles(self.pixmap.rect())
+        with self.under_live_stroke(index, self.layers[index].bounds):
+            return self._fill_area(x, y, color, tolerance, index, record)
+
+    def _fill_area(self, x: int, y: int, color: QColor, tolerance: int, index: int, record: bool) -> bool:
+        # NumPy takes longer to import than the rest of startup, it is loaded with the first fill
+        from floodFill import fill_mask, flood_fill_mask, image_array, pixel_array, mask_tiles
+        area = self.pixmap.rect()
+        if self.layers.infinite:
+            area = self.layers.content_rect().united(QRect(x, y, 1, 1))
+            area = area.adjusted(-GROW_MARGIN, -GROW_MARGIN, GROW_MARGIN, GROW_MARGIN).intersected(self.pixmap.rect())
+            self.layers.update(area)
+            # The view does not keep the copy alive
+            composite = self.pixmap.copy(area)
+            mask, found = flood_fill_mask(image_array(composite), x - area.x(), y - area.y(), tolerance)
+            del composite
+        else:
+            # Searched in place, the composite is only brought up to date where the search looks.
+            # The writable view detaches it first, so compositing does not move its pixels.
+            mask, found = flood_fill_mask(pixel_array(self.pixmap), x, y, tolerance, self.layers.update)
+        rect = found.translated(area.topLeft())
+        self.layers.touch(index, rect)
+        self.layers.mark_raster(index, rect)
+        layer = self.layers[index].pixmap
+        if record:
+            # Only the tiles the fill reaches
+            for tile in mask_tiles(mask, rect, self.history.tile_size):
+                self.history.touch(layer, tile, index)
+        else:
+            self.history.forget(rect, index)
+        fill_mask(layer, mask, rect, color.rgba())
+        self.invalidate(rect)
+        return True
+
+    def select(self, polygon: QPolygonF):
+        """Outlines an area to move, scale or rotate, replacing the current selection."""
+        self.deselect()
+        selection = Selection(polygon, self.active_layer)
+        if not selection.is_empty():
+            self.selection = selection
+            self.refresh(selection.bounds(self.zoom))
+
+    def deselect(self):
+        if self.selection is not None:
+            self.refresh(self.selection.bounds(self.zoom))
+            self.selection = None
+
+    def select_stroke(self, x: float, y: float) -> bool:
+        """Selects the top-most stroke of the active layer under (x, y). Returns False if there is none."""
+        stroke = self.strokes.hit_test(x, y, HIT_TOLERANCE / self.zoom, self.active_layer)
+        if stroke is None:
+            return False
+        # A pixel of room, selected_strokes() only takes strokes the outline contains
+        self.select(QPolygonF(stroke.bounds().adjusted(-1, -1, 1, 1)))
+        return True
+
+    def selection_polygon(self) -> QPolygonF:
+        """Returns the outline being drawn with the select or lasso tool."""
+        if self.tool == "select":
+            return QPolygonF(QRectF(self.selection_points[0], self.selection_points[-1]).normalized())
+        return QPolygonF(self.selection_points)
+
+    def selected_strokes(self, selection: Selection) -> list:
+        """Returns the vector strokes of the selection's layer that lie entirely inside its outline."""
+        return [stroke for stroke in self.strokes.query(selection.source)
+                if stroke.layer == selection.layer and selection.path.contains(stroke.bounds())]
+
+    @timed("selection.lift")
+    def lift_selection(self):
+        """Opens an undo step and moves the selected pixels of the active layer into the floating image."""
+        selection = self.selection
+        selection.layer = self.active_layer
+        self.save_state()
+        self.touch_state(selection.source)
+        self.layers.mark_raster(self.active_layer, selection.source)
+        selection.lift(self.layer().pixmap, self.color if self.active_layer == 0 else QColor(Qt.transparent))
+        self.invalidate(selection.source)
+
+    @timed("selection.put_down")
+    def put_down_selection(self):
+        """Paints the floating image where it was moved to, moves the strokes inside it along and
+        closes the undo step. The selection stays around the pixels at their new place."""
+        selection = self.selection
+        transform = selection.transform()
+        target = selection.target()
+        self.touch_state(target)
+        self.layers.mark_raster(self.active_layer, target)
+        selection.paint(self.layer().pixmap)
+        moved = self.selected_strokes(selection)
+        added = [stroke.transformed(transform) for stroke in moved]
+        self.history.record_strokes(added=added, removed=moved)
+        self.apply_strokes(added, moved)
+        self.commit_state()
+        self.invalidate(target)
+        self.refresh(selection.bounds(self.zoom))
+        self.selection = Selection(selection.outline(), selection.layer)
+        self.selectionMoved.emit(selection.polygon, transform, selection.layer)
+
+    def paint_move(self, polygon: QPolygonF, transform: QTransform, index: int):
+        """Moves an area of a layer on behalf of a collaborator, outside of the undo history."""
+        selection = Selection(polygon, min(index, len(self.layers) - 1))
+        area = selection.source.united(selection.target(transform))
+        self.grow_to(area)
+        self.load_tiles(area)
+        self.layers.touch(selection.layer, area)
+        self.layers.mark_raster(selection.layer, area)
+        pixmap = self.layers[selection.layer].pixmap
+        with self.under_live_stroke(selection.layer, area):
+            selection.lift(pixmap, self.color if selection.layer == 0 else QColor(Qt.transparent))
+            selection.paint(pixmap, transform)
+        self.history.forget(area, selection.layer)
+        moved = self.selected_strokes(selection)
+        self.apply_strokes([stroke.transformed(transform) for stroke in moved], moved)
+        self.invalidate(area)
+
+    def paint_pixels(self, image: QImage, position: QPoint, index: int):
+        """Replaces the pixels of a layer at position with image, premultiplied ARGB32, on behalf of a
+        collaborator who undid or redid a change there, outside of the undo history."""
+        index = min(index, len(self.layers) - 1)
+        rect = QRect(position, image.size())
+        self.grow_to(rect)
+        self.load_tiles(rect)
+        self.layers.touch(index, rect)
+        self.layers.mark_raster(index, rect)
+        with self.under_live_stroke(index, rect):
+            put_images(self.layers[index].pixmap, [(position, image)])
+        self.history.forget(rect, index)
+        self.invalidate(rect)
 
+    def drag_selection(self, e):
+        """Moves, scales or rotates the selection, or extends the outline being drawn."""
+        x, y = self.canvas_pos_f(e)
+        if self.selection_drag is not None:
+            mode, last = self.selection_drag
+            # Moves go by whole pixels so the pixels are put down unfiltered
+            position = QPointF(*self.canvas_pos(e)) if mode == "move" else QPointF(x, y)
+            if position == last:
+                return
+            if not self.selection.is_floating():
+                self.lift_selection()
+            dirty = self.selection.bounds(self.zoom)
+            self.selection.drag(mode, last, position)
+            self.selection_drag = (mode, position)
+            self.refresh(dirty.united(self.selection.bounds(self.zoom)))
+        elif self.selection_points:
+            dirty = self.selection_polygon().boundingRect()
+            if self.tool == "select":
+                self.selection_points[1:] = [QPointF(x, y)]
+            else:
+                self.selection_points.append(QPointF(x, y))
+            self.refresh(dirty.united(self.selection_polygon().boundingRect()).toAlignedRect().adjusted(-2, -2, 2, 2))
+
+    @timed("save.snapshot")
     def save(self, filename: str, app_name: str = None):
-        """If app_name is defined as a string, a metadata tag called "is_*your_app_name*_image" will be added with the value "yes" to the output file."""
-        writer = QImageWriter(filename)
-        writer.setText("canvas_color", self.color.name())
-        if app_name is not None:
-            writer.setText(f"is_{app_name}_image", "yes")
-        if not writer.write(self.pixmap.toImage()):
-            QMessageBox.critical(self, "Failed to save image", "An unexpected error occoured:\n" + writer.errorString())
+        """If app_name is defined as a string, a metadata tag called "is_*your_app_name*_image" will be added with the value "yes" to the output file.
+
+        .svg and .pdf files get the strokes as vector paths, see vectorExport.py. The canvas is
+        snapshotted and encoded on a worker thread, drawing can continue meanwhile.
+        saveFinished is emitted once the file is written."""
+        task = self.save_task(filename, app_name)
+        task.signals.finished.connect(self.on_save_finished)
+        self.pending_saves.append(task.signals)  # Keep the signals alive until the task reports back
+        QThreadPool.globalInstance().start(task)
+
+    def save_task(self, filename: str, app_name: str = None) -> ImageSaveTask:
+        """Returns a task that writes the canvas as it is now to filename, for a QThreadPool."""
+        texts = image_texts(self.color.name(), app_name)
+        if is_board_file(filename):
+            # Boards keep their layers, other formats get the flattened canvas
+            texts["layers"] = self.layers.describe()
+            images = self.layer_images()
+            if self.layers.infinite:
+                texts["origin"] = "%d,%d" % (self.content_rect().x(), self.content_rect().y())
+            return ImageSaveTask(images, filename, texts, self.save_compression)
+        if is_vector_file(filename):
+            return ImageSaveTask(VectorPage.from_canvas(self), filename, texts, self.save_compression)
+        return ImageSaveTask(self.snapshot(), filename, texts, self.save_compression)
+
+    def on_save_finished(self, filename: str, error: str):
+        signals = self.sender()
+        if signals in self.pending_saves:
+            self.pending_saves.remove(signals)
+        if error:
+            QMessageBox.critical(self, "Failed to save image", "An unexpected error occoured:\n" + error)
+        self.saveFinished.emit(filename, error)
+
+    def is_saving(self) -> bool:
+        return bool(self.pending_saves)
+
+    def follow_import(self, signals):
+        """Shows the preview of the image an ImageImportTask decodes as the background until
+        finish_import() gets the image. The canvas takes no input until then."""
+        self.pending_import = signals
+        self.setEnabled(False)
+        signals.previewReady.connect(self.set_background_image)
+
+    def finish_import(self, image: QImage = None):
+        """Ends an import, showing its image unless it failed."""
+        self.pending_import = None
+        self.setEnabled(True)
+        if image is not None:
+            self.set_background_image(image)
+
+    def is_importing(self) -> bool:
+        return self.pending_import is not None
+
+    def set_background_image(self, image: QImage):
+        """Replaces the bottom layer with image, which has the canvas size. Like an image the
+        canvas was made with, this is not a change that can be undone."""
+        self.layers.set_pixmap(0, image)
+        self.pyramid.invalidate(image.rect())
+        self.refresh(image.rect())
+
+    @timed("paint")
+    def paintEvent(self, event):
+        # Only the invalidated part of the composite is blitted to the screen.
+        rect = event.rect()
+        self.load_tiles(self.to_canvas_rect(rect))
+        # Zoomed-out views build pyramid tiles from beyond the exposed area
+        with metrics.stage("composite"):
+            self.layers.update(self.to_canvas_rect(rect) if self.zoom == 1 else None)
+        metrics.frame()
+        origin = self.extent().topLeft()
+        painter = QPainter(self)
+        painter.setClipRect(rect)
+        if self.zoom == 1:
+            draw_area(painter, rect, self.pixmap, self.to_canvas_rect(rect))
+        else:
+            painter.translate(-origin.x() * self.zoom, -origin.y() * self.zoom)
+            area = self.to_canvas_rect(rect)
+            # Zoomed in, the strokes are drawn again sharp, the pixels only fill in the rest
+            pixels = QRegion(area) - self.draw_strokes(painter, area) if self.zoom > 1 else QRegion(area)
+            if not pixels.isEmpty():
+                painter.save()
+                painter.setClipRegion(QTransform.fromScale(self.zoom, self.zoom).map(pixels), Qt.IntersectClip)
+                self.pyramid.render(painter, pixels.boundingRect(), self.zoom)
+                painter.restore()
+        # Shape previews and selections live on an overlay above the committed pixmap
+        painter.setTransform(QTransform.fromScale(self.zoom, self.zoom).translate(-origin.x(), -origin.y()))
+        if self.shape_start and self.shape_end:
+            self.draw_shape(painter, self.shape_start, self.shape_end)
+        if self.selection is not None or len(self.selection_points) > 1:
+            if self.selection is not None:
+                self.selection.render(painter, self.zoom)
+            if len(self.selection_points) > 1:
+                draw_outline(painter, self.selection_polygon())
+        painter.end()
+
+    def draw_strokes(self, painter: QPainter, rect: QRect) -> QRegion:
+        """Draws the canvas area rect sharp from the vector strokes, at zoom, wherever the strokes
+        account for every pixel of the visible layers, and returns that part of it. painter is in
+        scaled canvas coordinates."""
+        vector = QRegion(rect)
+        for layer in self.layers:
+            if layer.visible:
+                vector -= layer.raster
+        if vector.isEmpty():
+            return vector
+        scale = QTransform.fromScale(self.zoom, self.zoom)
+        painter.save()
+        painter.setClipRegion(scale.map(vector), Qt.IntersectClip)
+        self.stroke_cache.render(painter, scale.mapRect(QRectF(rect)).toAlignedRect(), self.zoom)
+        painter.restore()
+        return vector
+
+    def set_zoom(self, zoom: float):
+        """Sets the display scale, between 1/64 and 8. Drawing still happens at full resolution."""
+        self.zoom = min(max(zoom, 1 / 64), 8.0)
+        self.setFixedSize(max(1, round(self.width * self.zoom)), max(1, round(self.height * self.zoom)))
+        self.update()
+
+    def canvas_pos(self, e) -> tuple:
+        """Maps an event position from widget to canvas coordinates."""
+        origin = self.extent().topLeft()
+        return int(e.x() / self.zoom) + origin.x(), int(e.y() / self.zoom) + origin.y()
+
+    def canvas_pos_f(self, e) -> tuple:
+        """Maps an event position from widget to canvas coordinates, keeping sub-pixel precision."""
+        pos = e.posF() if isinstance(e, QTabletEvent) else e.localPos()
+        origin = self.extent().topLeft()
+        return pos.x() / self.zoom + origin.x(), pos.y() / self.zoom + origin.y()
+
+    def to_canvas_rect(self, rect: QRect) -> QRect:
+        rect = QRectF(rect.x() / self.zoom, rect.y() / self.zoom, rect.width() / self.zoom, rect.height() / self.zoom).toAlignedRect()
+        return rect.translated(self.extent().topLeft())
+
+    def refresh(self, rect: QRect):
+        """Schedules a repaint of a canvas area."""
+        rect = rect.translated(-self.extent().topLeft())
+        if self.zoom == 1:
+            self.update(rect)
+        else:
+            self.update(QRectF(rect.x() * self.zoom, rect.y() * self.zoom, rect.width() * self.zoom, rect.height() * self.zoom).toAlignedRect().adjusted(-1, -1, 1, 1))
+
+    def invalidate(self, rect: QRect):
+        """Marks a canvas area whose pixels changed as stale and schedules its repaint."""
+        self.layers.mark_dirty(rect)
+        self.pyramid.invalidate(rect)
+        self.refresh(rect)
+        self.pixelsChanged.emit(rect)
+
+    def shape_rect(self, x1: int, y1: int, x2: int, y2: int) -> QRect:
+        """Returns the area covered by a rectangle, ellipse or line spanning the two points."""
+        # Miter joins can reach past the corners, so allow for the full pen width
+        margin = self.toolWidth + 2
+        return QRect(QPoint(x1, y1), QPoint(x2, y2)).normalized().adjusted(-margin, -margin, margin, margin)
+
+    def draw_shape(self, painter: QPainter, start: tuple, end: tuple):
+        """Draws the current shape tool's outline from start to end with painter."""
+        p = painter.pen()
+        p.setColor(self.pen_color)
+        p.setWidth(self.toolWidth)
+        p.setJoinStyle(Qt.MiterJoin)
+        painter.setPen(p)
+
+        start_x, start_y = start
+        end_x, end_y = end
+        if self.tool == "rectangle":
+            painter.drawRect(min(start_x, end_x), min(start_y, end_y),
+                             abs(end_x - start_x), abs(end_y - start_y))
+        elif self.tool == "ellipse":
+            painter.drawEllipse(min(start_x, end_x), min(start_y, end_y),
+                                abs(end_x - start_x), abs(end_y - start_y))
+        elif self.tool == "line":
+            painter.drawLine(start_x, start_y, end_x, end_y)
 
     def wheelEvent(self, event):
         scroll_direction = 1 if event.angleDelta().y() > 0 else -1
@@ -88,115 +821,201 @@ class JCanvas(QLabel):
         self.toolWidth = width
 
     def set_tool(self, tool: str = "pen"):
-        """Valid Tools: "pen", "eraser" """
+        """Valid Tools: "pen", "eraser", "rectangle", "ellipse", "line", "fill", "select", "lasso" """
+        if tool not in ("select", "lasso"):
+            self.deselect()
         self.tool = tool
 
     def mousePressEvent(self, e):
-        self.last_x, self.last_y = e.x(), e.y()
+        if e.button() == Qt.MiddleButton:
+            self.pan_origin = e.globalPos()
+            return
+        if self.tool == "fill":
+            self.fill(*self.canvas_pos(e))
+            return
+        if self.tool in ["select", "lasso"]:
+            x, y = self.canvas_pos_f(e)
+            mode = self.selection.handle_at(x, y, self.zoom) if self.selection is not None else None
+            if mode is not None:
+                self.selection_drag = (mode, QPointF(*self.canvas_pos(e)) if mode == "move" else QPointF(x, y))
+            else:
+                self.deselect()
+                self.selection_points = [QPointF(x, y)]
+            return
+        if self.tool in ["pen", "eraser"]:
+            self.last_x, self.last_y = self.canvas_pos_f(e)
+            self.stroke_filter = StrokeFilter(**self.filter_settings[self.tool])
+            self.stroke_filter.begin(self.last_x, self.last_y, self.pressure if isinstance(e, QTabletEvent) else 1.0)
+            return
+        self.last_x, self.last_y = self.canvas_pos(e)
         if self.tool in ["rectangle", "ellipse", "line"]:
             self.shape_start = (self.last_x, self.last_y)
 
-    def mouseMoveEvent(self, e, dynamic_width: int = None):
-        if self.last_x is None or (self.last_x, self.last_y) == (e.x(), e.y()):
+    def mouseMoveEvent(self, e, pressure: float = 1.0):
+        metrics.count("input.events")
+        if self.pan_origin is not None:
+            self.panRequested.emit(self.pan_origin - e.globalPos())
+            self.pan_origin = e.globalPos()
+            return
+
+        if self.tool in ["select", "lasso"]:
+            self.drag_selection(e)
             return
-        
+
+        if self.tool in ["pen", "eraser"]:
+            if self.stroke_filter is not None:
+                self.queue_sample(*self.canvas_pos_f(e), pressure)
+            return
+
+        x, y = self.canvas_pos(e)
+        if self.last_x is None or (self.last_x, self.last_y) == (x, y):
+            return
+
         if not self.saved_for_stroke:
             self.save_state()
             self.saved_for_stroke = True
 
-        if dynamic_width == None:
-            dynamic_width = self.toolWidth
+        if self.tool in ["rectangle", "ellipse", "line"] and self.shape_start:
+            # Only the union of the old and new preview bounds needs repainting
+            dirty = self.shape_rect(*self.shape_start, x, y)
+            if self.shape_end:
+                dirty = dirty.united(self.shape_rect(*self.shape_start, *self.shape_end))
+            self.shape_end = (x, y)
+            self.refresh(dirty)
 
-        if self.tool in ["pen", "eraser"]:
+    def record_point(self, x: float, y: float, pressure: float = 1.0):
+        """Appends a point to the vector stroke being drawn, starting one if needed."""
+        if self.current_stroke is None:
+            smooth = self.stroke_filter is not None and self.stroke_filter.smoothing == "catmull-rom"
+            self.current_stroke = Stroke(self.tool, self.pen_color, self.toolWidth, smooth, self.active_layer)
+            self.current_stroke.add_point(self.last_x, self.last_y, pressure)
+            self.strokes.add(self.current_stroke)
+            self.history.record_strokes(added=[self.current_stroke])
+        self.strokes.add_point(self.current_stroke, x, y, pressure)
+        self.stroke_cache.invalidate(self.current_stroke.segment_bounds(len(self.current_stroke) - 1))
 
-            pixmap = self.pixmap.copy()
-            painter = QPainter(pixmap)
-            p = painter.pen()
+    def mouseReleaseEvent(self, e):
+        if self.pan_origin is not None:
+            self.pan_origin = None
+            return
 
-            if self.tool == 'pen':
-                p.setColor(self.pen_color)
-                p.setWidth(dynamic_width)
-                p.setCapStyle(Qt.RoundCap)
-            elif self.tool == 'eraser':
-                p.setColor(self.color)
-                p.setWidth(round(dynamic_width * 1.5))
-                p.setCapStyle(Qt.RoundCap)
+        if self.tool in ["select", "lasso"]:
+            if self.selection_drag is not None:
+                self.selection_drag = None
+                if self.selection.is_floating():
+                    self.put_down_selection()
+            elif len(self.selection_points) == 1:
+                # A click selects the stroke under it
+                self.selection_points = []
+                self.select_stroke(*self.canvas_pos_f(e))
+            elif self.selection_points:
+                polygon = self.selection_polygon()
+                self.refresh(polygon.boundingRect().toAlignedRect().adjusted(-2, -2, 2, 2))
+                self.selection_points = []
+                if len(polygon) > 2:
+                    self.select(polygon)
+            return
 
-            painter.setPen(p)
-            painter.drawLine(self.last_x, self.last_y, e.x(), e.y())
-            painter.end()
+        if self.tool == "eraser" and self.stroke_filter is not None and self.stroke_filter.points_in == 1 and not self.pending_samples:
+            # A click with the eraser erases the whole stroke under it
+            self.stroke_filter = None
+            self.erase_stroke(*self.canvas_pos_f(e))
+        elif self.stroke_filter is not None:
+            # Draw the samples still queued and the segments the filter held back
+            self.flush_samples()
+            self.draw_segments(self.stroke_filter.finish())
+            self.stroke_filter = None
+            self.live_stroke = None
+        elif self.tool in ["rectangle", "ellipse", "line"] and self.shape_start:
+            # Finalize the shape drawing
+            end = self.canvas_pos(e)
+            rect = self.shape_rect(*self.shape_start, *end)
+            self.save_state()
+            self.touch_state(rect)
 
-            self.setPixmap(pixmap)
-            self.pixmap = pixmap.copy()
-            self.update()
+            with painter_for(self.layer().pixmap, rect) as painter:
+                self.draw_shape(painter, self.shape_start, end)
 
-            self.last_x, self.last_y = e.x(), e.y()
-        elif self.tool in ["rectangle", "ellipse", "line"] and self.shape_start:
-            pixmap = self.pixmap.copy()
-            painter = QPainter(pixmap)
-            p = painter.pen()
-            p.setColor(self.pen_color)
-            p.setWidth(self.toolWidth)
-            p.setJoinStyle(Qt.MiterJoin)
-            painter.setPen(p)
-    
-            current_x, current_y = e.x(), e.y()
-            start_x, start_y = self.shape_start
-            if self.tool == "rectangle":
-                painter.drawRect(min(start_x, current_x), min(start_y, current_y),
-                                 abs(current_x - start_x), abs(current_y - start_y))
-            elif self.tool == "ellipse":
-                painter.drawEllipse(min(start_x, current_x), min(start_y, current_y),
-                                    abs(current_x - start_x), abs(current_y - start_y))
-            elif self.tool == "line":
-                painter.drawLine(start_x, start_y, current_x, current_y)
-
-            painter.end()
-            self.setPixmap(pixmap)
-            self.update()
+            shape = Stroke(self.tool, self.pen_color, self.toolWidth, layer=self.active_layer)
+            shape.add_point(*self.shape_start)
+            shape.add_point(*end)
+            self.history.record_strokes(added=[shape])
+            self.apply_strokes(added=[shape])
+            self.strokeFinished.emit(shape)
 
-    def mouseReleaseEvent(self, e):
-        if self.tool in ["rectangle", "ellipse", "line"] and self.shape_start:
-            # Finalize the shape drawing
-            pixmap = self.pixmap.copy()
-            painter = QPainter(pixmap)
-            p = painter.pen()
-            p.setColor(self.pen_color)
-            p.setWidth(self.toolWidth)
-            p.setJoinStyle(Qt.MiterJoin)
-            painter.setPen(p)
-
-            start_x, start_y = self.shape_start
-            end_x, end_y = e.x(), e.y()
-            if self.tool == "rectangle":
-                painter.drawRect(min(start_x, end_x), min(start_y, end_y),
-                                 abs(end_x - start_x), abs(end_y - start_y))
-            elif self.tool == "ellipse":
-                painter.drawEllipse(min(start_x, end_x), min(start_y, end_y),
-                                    abs(end_x - start_x), abs(end_y - start_y))
-            elif self.tool == "line":
-                painter.drawLine(start_x, start_y, end_x, end_y)
-
-            painter.end()
-            self.setPixmap(pixmap)
-            self.pixmap = pixmap.copy()
-            self.update()
+            # The last preview may reach past the committed shape
+            if self.shape_end:
+                rect = rect.united(self.shape_rect(*self.shape_start, *self.shape_end))
+            self.invalidate(rect)
 
+        self.commit_state()
+        if self.current_stroke is not None:
+            self.strokeFinished.emit(self.current_stroke)
+        self.current_stroke = None
         self.last_x = None
         self.last_y = None
         self.shape_start = None
+        self.shape_end = None
         self.saved_for_stroke = False
 
+    def queue_sample(self, x: float, y: float, pressure: float = 1.0):
+        """Queues a pen or eraser sample to be drawn with the next frame."""
+        self.pending_samples.append((x, y, pressure))
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+
+    @timed("stroke.flush")
+    def flush_samples(self):
+        """Feeds the queued samples through the stroke filter and draws the finished segments."""
+        samples, self.pending_samples = self.pending_samples, []
+        if not samples or self.stroke_filter is None:
+            return
+        segments = []
+        for x, y, pressure in samples:
+            segments += self.stroke_filter.push(x, y, pressure)
+        self.draw_segments(segments)
+
+    @timed("stroke.draw")
+    def draw_segments(self, segments: list):
+        """Draws StrokeFilter segments as the tail of the stroke's filled outline and records their end points."""
+        if not segments:
+            return
+        metrics.count("stroke.segments", len(segments))
+        if not self.saved_for_stroke:
+            self.save_state()
+            self.saved_for_stroke = True
+
+        # The outline is tapered by the pressure at each end of a segment, a frame only adds its new tail
+        if self.live_stroke is None:
+            self.live_stroke = LiveStroke(self.layer().pixmap, self.pen_color, self.tool == 'eraser')
+        scale = 1.5 if self.tool == 'eraser' else 1.0
+        rect = self.live_stroke.add([segment[:8] + (self.toolWidth * segment[8] * scale / 2,) for segment in segments])
+        self.touch_state(rect)
+        self.live_stroke.paint(rect)
+
+        first = len(self.current_stroke) if self.current_stroke is not None else 0
+        for segment in segments:
+            self.record_point(segment[6], segment[7], segment[8])
+            self.last_x, self.last_y = segment[6], segment[7]
+        self.invalidate(rect)
+        self.strokeUpdated.emit(self.current_stroke, first)
+
     def tabletEvent(self, event):
         self.pressure = event.pressure() if hasattr(event, 'pressure') and self.use_pressure else 0.01
-        dynamic_width = max(1, round(self.toolWidth * self.pressure))
         if event.type() == QEvent.TabletPress:
             self.use_pressure = True
             self.mousePressEvent(event)
         elif event.type() == QEvent.TabletMove:
             self.use_pressure = True
-            self.mouseMoveEvent(event, dynamic_width)
-        
+            if self.stroke_filter is not None and self.pan_origin is None:
+                # Coalesce samples until the event queue is drained
+                metrics.count("input.events")
+                self.queue_sample(*self.canvas_pos_f(event), self.pressure)
+            else:
+                self.mouseMoveEvent(event, self.pressure)
+        elif event.type() == QEvent.TabletRelease:
+            self.mouseReleaseEvent(event)
+
         event.accept()
 
 class JPaletteButton(QPushButton):
@@ -249,13 +1068,29 @@ class JCanvasContainer(QScrollArea):
         self.layout.addWidget(canvas, alignment=Qt.AlignCenter)
         self.container.setLayout(self.layout)
         self.setWidget(self.container)
+        canvas.canvasGrown.connect(self.on_canvas_grown)
 
     def setBackgroundColor(self, color: str = '#0c0c0c'):
         self.container.setStyleSheet(f'background-color: {color}')
 
     def set_canvas(self, new_canvas):
+        """Shows new_canvas instead of the current one. The old canvas is only taken out, it
+        belongs to whoever created it, like the pages of a BoardSession."""
         while self.layout.count():
             widget = self.layout.takeAt(0).widget()
             if widget is not None:
-                widget.deleteLater()
+                widget.canvasGrown.disconnect(self.on_canvas_grown)
+                widget.setParent(None)
         self.layout.addWidget(new_canvas, alignment=Qt.AlignCenter)
+        new_canvas.show()
+        new_canvas.canvasGrown.connect(self.on_canvas_grown)
+
+    def on_canvas_grown(self, shift: QPoint):
+        """Scrolls along when an infinite canvas grows to the left or top, so the view stays put."""
+        if shift.isNull():
+            return
+        # Resize the container and the scroll ranges right away, the next input event maps through them
+        self.layout.activate()
+        QCoreApplication.sendPostedEvents(None, QEvent.LayoutRequest)
+        self.horizontalScrollBar().setValue(self.horizontalScrollBar().value() + shift.x())
+        self.verticalScrollBar().setValue(self.verticalScrollBar().value() + shift.y())
@@ -0,0 +1,162 @@
+import math
+from PyQt5.QtCore import Qt, QPoint, QPointF, QRect, QRectF
+from PyQt5.QtGui import QColor, QImage, QPainter, QPainterPath, QPen, QPixmap, QPolygonF, QTransform
+
+from tiledPixmap import draw_area, painter_for
+
+HANDLE_SIZE = 8  # Screen pixels
+ROTATE_DISTANCE = 24  # Screen pixels between the top edge and the rotate handle
+SMOOTH_PREVIEW_PIXELS = 1024 * 1024  # Larger floating images are previewed without filtering
+
+class Selection:
+    """An outlined area of one layer that can be lifted, transformed and put down again.
+
+    polygon is the outline in canvas coordinates. lift() moves the pixels inside it into a
+    floating image and leaves the area empty; transform() places that image on the canvas
+    as a move plus a scale and rotation about the outline's center, and paint() puts it down."""
+    def __init__(self, polygon: QPolygonF, layer: int):
+        self.polygon = QPolygonF(polygon)
+        self.layer = layer
+        self.path = QPainterPath()
+        self.path.addPolygon(self.polygon)
+        self.path.closeSubpath()
+        self.source = self.path.boundingRect().toAlignedRect()
+        self.image = None
+        self.pixmap = None  # Floating image for the preview, blits faster than the QImage
+        self.offset = QPointF()
+        self.scale_x = 1.0
+        self.scale_y = 1.0
+        self.angle = 0.0
+
+    def is_empty(self) -> bool:
+        return self.source.width() < 2 or self.source.height() < 2
+
+    def is_floating(self) -> bool:
+        return self.image is not None
+
+    def is_moved(self) -> bool:
+        return not self.transform().isIdentity()
+
+    def lift(self, pixmap: QImage, fill: QColor):
+        """Copies the pixels inside the outline into the floating image and fills the outline in the layer."""
+        self.image = QImage(self.source.size(), QImage.Format_ARGB32_Premultiplied)
+        self.image.fill(Qt.transparent)
+        painter = QPainter(self.image)
+        painter.setClipPath(self.path.translated(-self.source.x(), -self.source.y()))
+        draw_area(painter, QRect(QPoint(0, 0), self.source.size()), pixmap, self.source)
+        painter.end()
+        with painter_for(pixmap, self.source) as painter:
+            painter.setClipPath(self.path)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.fillRect(self.source, fill)
+        self.pixmap = QPixmap.fromImage(self.image)
+
+    def transform(self) -> QTransform:
+        center = QRectF(self.source).center()
+        if self.angle == 0 and self.scale_x == self.scale_y == 1:
+            return QTransform.fromTranslate(self.offset.x(), self.offset.y())
+        return (QTransform().translate(center.x() + self.offset.x(), center.y() + self.offset.y())
+                .rotate(self.angle).scale(self.scale_x, self.scale_y).translate(-center.x(), -center.y()))
+
+    def center(self) -> QPointF:
+        return self.transform().map(QRectF(self.source).center())
+
+    def outline(self) -> QPolygonF:
+        """Returns the outline where the floating image currently is."""
+        return self.transform().map(self.polygon)
+
+    def corners(self) -> list:
+        return [self.transform().map(QPointF(point)) for point in (
+            self.source.topLeft(), QPointF(self.source.right() + 1, self.source.top()),
+            QPointF(self.source.right() + 1, self.source.bottom() + 1), QPointF(self.source.left(), self.source.bottom() + 1))]
+
+    def rotate_handle(self, zoom: float = 1.0) -> QPointF:
+        """Returns the position of the rotate handle, above the middle of the top edge."""
+        top_left, top_right = self.corners()[:2]
+        top = (top_left + top_right) / 2
+        center = self.center()
+        direction = top - center
+        length = math.hypot(direction.x(), direction.y()) or 1.0
+        return top + direction * (ROTATE_DISTANCE / zoom / length)
+
+    def target(self, transform: QTransform = None) -> QRect:
+        """Returns the canvas area the floating image covers at transform or the selection's own."""
+        transform = self.transform() if transform is None else transform
+        return transform.mapRect(QRectF(self.source)).toAlignedRect().adjusted(-1, -1, 1, 1)
+
+    def bounds(self, zoom: float = 1.0) -> QRect:
+        """Returns the canvas area covered by the transformed image, outline and handles."""
+        margin = (ROTATE_DISTANCE + HANDLE_SIZE) / zoom + 2
+        rect = self.transform().mapRect(QRectF(self.source)).adjusted(-margin, -margin, margin, margin)
+        return rect.toAlignedRect()
+
+    def handle_at(self, x: float, y: float, zoom: float = 1.0) -> str:
+        """Returns "rotate", "scale" or "move" for a press at (x, y), or None outside the selection."""
+        reach = HANDLE_SIZE / zoom
+        point = QPointF(x, y)
+        handle = self.rotate_handle(zoom)
+        if abs(handle.x() - x) <= reach and abs(handle.y() - y) <= reach:
+            return "rotate"
+        for corner in self.corners():
+            if abs(corner.x() - x) <= reach and abs(corner.y() - y) <= reach:
+                return "scale"
+        if self.outline().containsPoint(point, Qt.OddEvenFill):
+            return "move"
+        return None
+
+    def drag(self, mode: str, start: QPointF, end: QPointF):
+        """Applies one step of a move, scale or rotate drag from start to end, in canvas coordinates."""
+        if mode == "move":
+            self.offset += end - start
+            return
+        center = self.center()
+        if mode == "rotate":
+            self.angle = math.degrees(math.atan2(end.y() - center.y(), end.x() - center.x())) + 90
+        elif mode == "scale":
+            # Scales about the center, measured along the selection's own axes
+            local = QTransform().rotate(-self.angle).map(end - center)
+            half_width, half_height = max(self.source.width() / 2, 1), max(self.source.height() / 2, 1)
+            self.scale_x = max(abs(local.x()) / half_width, 0.02)
+            self.scale_y = max(abs(local.y()) / half_height, 0.02)
+
+    def paint(self, pixmap: QImage, transform: QTransform = None):
+        """Draws the floating image into pixmap, at transform or the selection's own."""
+        transform = self.transform() if transform is None else transform
+        with painter_for(pixmap, self.target(transform)) as painter:
+            if not transform.type() <= QTransform.TxTranslate or transform.dx() != int(transform.dx()) or transform.dy() != int(transform.dy()):
+                painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.setTransform(transform, True)
+            painter.drawImage(self.source.topLeft(), self.image)
+
+    def render(self, painter: QPainter, zoom: float = 1.0):
+        """Draws the floating image, the outline and the handles as an overlay in canvas coordinates."""
+        painter.save()
+        if self.pixmap is not None:
+            painter.save()
+            if self.image.width() * self.image.height() <= SMOOTH_PREVIEW_PIXELS:
+                painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.setTransform(self.transform(), True)
+            painter.drawPixmap(self.source.topLeft(), self.pixmap)
+            painter.restore()
+        draw_outline(painter, self.outline())
+        painter.setPen(QPen(QColor('#000000'), 0))
+        painter.setBrush(QColor('#ffffff'))
+        size = HANDLE_SIZE / zoom
+        for corner in self.corners():
+            painter.drawRect(QRectF(corner.x() - size / 2, corner.y() - size / 2, size, size))
+        handle = self.rotate_handle(zoom)
+        painter.drawEllipse(handle, size / 2, size / 2)
+        painter.restore()
+
+def draw_outline(painter: QPainter, polygon: QPolygonF):
+    """Draws a selection outline as a one pixel wide black and white dashed line at any zoom."""
+    painter.save()
+    pen = QPen(QColor('#ffffff'), 0)
+    painter.setPen(pen)
+    painter.setBrush(Qt.NoBrush)
+    painter.drawPolygon(polygon)
+    pen.setColor(QColor('#000000'))
+    pen.setDashPattern([4, 4])
+    painter.setPen(pen)
+    painter.drawPolygon(polygon)
+    painter.restore()
@@ -0,0 +1,150 @@
+"""Load benchmark for the collaboration server.
+
+Starts a CollabServer and connects simulated clients that each draw a pen stroke the way
+CollabClient sends one, one batch of points per 16 ms frame, and answer snapshot requests
+right away. Reports the round trip of a client's own batches, which is how long a stroke
+takes to reach the others plus one tick, the bandwidth per client and of the server, and
+the length of the server's operation log, which snapshots keep bounded.
+
+    python collabBench.py
+    python collabBench.py --clients 100 --seconds 30
+"""
+import argparse
+import asyncio
+import math
+import random
+import sys
+import time
+
+from collabProtocol import (
+    BROADCAST_ENTRY, MSG_BROADCAST, MSG_HELLO, MSG_OPS, MSG_SNAPSHOT, MSG_SNAPSHOT_REQUEST, MSG_WELCOME,
+    SNAPSHOT, WELCOME, OpEncoder, frame, read_frames
+)
+from collabServer import CollabServer
+
+FRAME_INTERVAL = 1 / 60
+POINTS_PER_FRAME = 4  # Tablet samples arrive at about 240 Hz
+STROKE_FRAMES = 60  # A new stroke every second
+
+class SimulatedClient:
+    def __init__(self, index: int):
+        self.index = index
+        self.client_id = None
+        self.last_seq = 0
+        self.sent = []  # Send times of the batches the server has not broadcast back yet
+        self.latencies = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.snapshots = 0
+
+    async def run(self, port: int, seconds: float):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(frame(MSG_HELLO, f'client {self.index}'.encode()))
+        receiving = asyncio.ensure_future(self.receive(reader, writer))
+        while self.client_id is None:
+            await asyncio.sleep(0.01)
+        encoder = OpEncoder()
+        rng = random.Random(self.index)
+        x, y = rng.uniform(0, 3840), rng.uniform(0, 2160)
+        key, ops, step = 0, encoder.begin(0, 'pen', 1, 0xffffffff, 4, True, x, y), 0
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            points = []
+            for _ in range(POINTS_PER_FRAME):
+                step += 1
+                x, y = x + 6 * math.cos(step / 30), y + 6 * math.sin(step / 45)
+                points.append((x, y, 0.5 + 0.5 * math.sin(step / 10)))
+            ops += encoder.points(key, points)
+            if step % (STROKE_FRAMES * POINTS_PER_FRAME) == 0:
+                ops += encoder.end(key)
+                key = (key + 1) % 65536
+                ops += encoder.begin(key, 'pen', 1, 0xffffffff, 4, True, x, y)
+            data = frame(MSG_OPS, ops)
+            ops = b''
+            self.sent.append(time.perf_counter())
+            self.bytes_out += len(data)
+            writer.write(data)
+            await asyncio.sleep(FRAME_INTERVAL)
+        await asyncio.sleep(0.5)  # Lets the last batches come back
+        receiving.cancel()
+        writer.close()
+
+    async def receive(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        buffer = bytearray()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            now = time.perf_counter()
+            self.bytes_in += len(data)
+            buffer += data
+            for message_type, payload in read_frames(buffer):
+                if message_type == MSG_WELCOME:
+                    self.client_id, self.last_seq = WELCOME.unpack_from(payload)
+                elif message_type == MSG_SNAPSHOT_REQUEST:
+                    # Stands in for the PNG a real client would send
+                    writer.write(frame(MSG_SNAPSHOT, SNAPSHOT.pack(self.last_seq) + bytes(64 * 1024)))
+                    self.snapshots += 1
+                elif message_type == MSG_BROADCAST:
+                    self.on_broadcast(payload, now)
+
+    def on_broadcast(self, payload: bytes, now: float):
+        offset = 0
+        while offset < len(payload):
+            seq, origin, length = BROADCAST_ENTRY.unpack_from(payload, offset)
+            offset += BROADCAST_ENTRY.size + length
+            if seq <= self.last_seq:
+                continue
+            self.last_seq = seq
+            if origin == self.client_id and self.sent:
+                self.latencies.append(now - self.sent.pop(0))
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+async def bench(clients: int, seconds: float, snapshot_every: int) -> int:
+    server = CollabServer(snapshot_every=snapshot_every)
+    port = await server.start('127.0.0.1', 0)
+    simulated = [SimulatedClient(index) for index in range(clients)]
+    longest_log = 0
+
+    async def watch_log():
+        nonlocal longest_log
+        while True:
+            longest_log = max(longest_log, len(server.log))
+            await asyncio.sleep(0.05)
+
+    watching = asyncio.ensure_future(watch_log())
+    try:
+        await asyncio.gather(*(client.run(port, seconds) for client in simulated))
+        while server.sessions:
+            await asyncio.sleep(0.01)  # Until the server has seen every client leave
+    finally:
+        watching.cancel()
+        await server.close()
+
+    latencies = sorted(latency for client in simulated for latency in client.latencies)
+    if not latencies:
+        print("no batches came back")
+        return 1
+    lost = sum(len(client.sent) for client in simulated)
+    print(f"{clients} clients for {seconds:.0f} s: {len(latencies)} batches, {lost} not broadcast back")
+    print(f"  round trip  p50 {percentile(latencies, 0.5) * 1000:6.1f} ms  p95 {percentile(latencies, 0.95) * 1000:6.1f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:6.1f} ms  max {latencies[-1] * 1000:6.1f} ms")
+    print(f"  per client  up {sum(client.bytes_out for client in simulated) / clients / seconds / 1024:6.1f} KiB/s  "
+          f"down {sum(client.bytes_in for client in simulated) / clients / seconds / 1024:6.1f} KiB/s")
+    print(f"  server      in {server.bytes_in / seconds / 1024 / 1024:6.2f} MiB/s  out {server.bytes_out / seconds / 1024 / 1024:6.2f} MiB/s")
+    print(f"  op log      {sum(client.snapshots for client in simulated)} snapshots, longest {longest_log} batches, "
+          f"{len(server.log)} at the end")
+    return 0
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measures latency and bandwidth of the collaboration server under load.")
+    parser.add_argument('--clients', type=int, default=50, help="Simulated clients drawing at the same time")
+    parser.add_argument('--seconds', type=float, default=10, help="How long every client draws")
+    parser.add_argument('--snapshot-every', type=int, default=2000, help="Log length after which a snapshot is requested")
+    args = parser.parse_args(argv)
+    return asyncio.run(bench(args.clients, args.seconds, args.snapshot_every))
+
+if __name__ == '__main__':
+    sys.exit(main())
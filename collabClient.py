@@ -0,0 +1,235 @@
+from PyQt5.QtCore import QObject, QPoint, QPointF, QRect, QTimer, QBuffer, QByteArray, QIODevice, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QImageReader, QImageWriter, QPolygonF, QTransform
+from PyQt5.QtNetwork import QAbstractSocket, QTcpSocket
+
+from canvasObjects import png_quality
+from collabProtocol import (
+    BROADCAST_ENTRY, MSG_BROADCAST, MSG_HELLO, MSG_OPS, MSG_SNAPSHOT, MSG_SNAPSHOT_REQUEST,
+    MSG_WELCOME, SNAPSHOT, WELCOME, OpDecoder, OpEncoder, frame, read_frames
+)
+from strokeModel import SHAPE_TOOLS, Stroke
+
+class CollabClient(QObject):
+    """Shares the strokes of a JCanvas with a collaboration server and paints everyone else's.
+
+    Local operations are collected from the canvas signals and sent as one batch per frame.
+    Remote operations are applied in the server's sequence order and bypass the undo history,
+    dropping the local undo steps they reach into. Local undo and redo are shared as the pixels
+    they put back. Joining a board that already has content replaces the canvas through snapshotReceived."""
+    connected = pyqtSignal()
+    disconnected = pyqtSignal(str)  # Error message, empty when closed normally
+    snapshotReceived = pyqtSignal(QImage, str)  # Shared board, canvas color
+
+    def __init__(self, name: str = '', frame_interval: int = 16):
+        super().__init__()
+        self.name = name
+        self.canvas = None
+        self.client_id = None
+        self.last_seq = 0  # Highest sequence number applied
+        self.snapshot_requested = False
+        self.encoder = OpEncoder()
+        self.decoders = {}  # Origin client id -> OpDecoder
+        self.local_keys = {}  # Stroke -> key on the wire
+        self.remote = {}  # (origin, key) -> [Stroke, first segment not painted yet]
+        self.next_key = 0
+        self.outbox = []
+        self.buffer = bytearray()
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setInterval(frame_interval)
+        self.frame_timer.timeout.connect(self.send_batch)
+        self.socket = QTcpSocket(self)
+        self.socket.connected.connect(self.on_connected)
+        self.socket.disconnected.connect(self.on_disconnected)
+        self.socket.errorOccurred.connect(self.on_error)
+        self.socket.readyRead.connect(self.on_ready_read)
+
+    def connect_to(self, host: str, port: int):
+        self.socket.connectToHost(host, port)
+
+    def close(self):
+        self.socket.disconnectFromHost()
+
+    def is_connected(self) -> bool:
+        return self.client_id is not None and self.socket.state() == QAbstractSocket.ConnectedState
+
+    def attach(self, canvas):
+        """Starts sharing canvas, replacing any previously attached canvas."""
+        if self.canvas is not None:
+            self.canvas.strokeUpdated.disconnect(self.on_stroke_updated)
+            self.canvas.strokeFinished.disconnect(self.on_stroke_finished)
+            self.canvas.layerCleared.disconnect(self.on_layer_cleared)
+            self.canvas.areaFilled.disconnect(self.on_area_filled)
+            self.canvas.selectionMoved.disconnect(self.on_selection_moved)
+            self.canvas.areaRestored.disconnect(self.on_area_restored)
+        self.canvas = canvas
+        self.local_keys.clear()
+        self.remote.clear()
+        canvas.strokeUpdated.connect(self.on_stroke_updated)
+        canvas.strokeFinished.connect(self.on_stroke_finished)
+        canvas.layerCleared.connect(self.on_layer_cleared)
+        canvas.areaFilled.connect(self.on_area_filled)
+        canvas.selectionMoved.connect(self.on_selection_moved)
+        canvas.areaRestored.connect(self.on_area_restored)
+
+    def on_connected(self):
+        self.socket.write(frame(MSG_HELLO, self.name.encode('utf-8')))
+
+    def on_disconnected(self):
+        self.client_id = None
+        self.disconnected.emit("")
+
+    def on_error(self, error):
+        if error != QAbstractSocket.RemoteHostClosedError:
+            self.disconnected.emit(self.socket.errorString())
+
+    def on_stroke_updated(self, stroke: Stroke, first: int):
+        key = self.local_keys.get(stroke)
+        if key is None:
+            key = self.local_keys[stroke] = self.next_key
+            self.next_key = (self.next_key + 1) % 65536
+            self.queue(self.encoder.begin(key, stroke.tool, stroke.layer, stroke.color, stroke.width, stroke.smooth,
+                                          stroke.xs[0], stroke.ys[0], stroke.pressures[0]))
+        points = [(stroke.xs[i], stroke.ys[i], stroke.pressures[i]) for i in range(max(first, 1), len(stroke))]
+        if points:
+            self.queue(self.encoder.points(key, points))
+
+    def on_stroke_finished(self, stroke: Stroke):
+        key = self.local_keys.pop(stroke, None)
+        if stroke.tool in SHAPE_TOOLS:
+            self.queue(self.encoder.shape(stroke.tool, stroke.layer, stroke.color, stroke.width,
+                                          stroke.xs[0], stroke.ys[0], stroke.xs[-1], stroke.ys[-1]))
+        elif key is not None:
+            self.queue(self.encoder.end(key))
+        if self.snapshot_requested:
+            self.send_snapshot()
+
+    def on_layer_cleared(self, layer: int):
+        self.queue(self.encoder.clear(layer))
+
+    def on_area_filled(self, x: int, y: int, color: QColor, tolerance: int, layer: int):
+        self.queue(self.encoder.fill(layer, color.rgba(), tolerance, x, y))
+
+    def on_selection_moved(self, outline: QPolygonF, transform: QTransform, layer: int):
+        matrix = (transform.m11(), transform.m12(), transform.m21(), transform.m22(), transform.dx(), transform.dy())
+        self.queue(self.encoder.move(layer, [(point.x(), point.y()) for point in outline], matrix))
+
+    def on_area_restored(self, rect: QRect, layer: int):
+        image = self.canvas.layers[layer].pixmap.copy(rect).convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        self.queue(self.encoder.pixels(layer, rect.x(), rect.y(), rect.width(), rect.height(), bytes(bits)))
+
+    def queue(self, data: bytes):
+        self.outbox.append(data)
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+
+    def send_batch(self):
+        """Sends everything queued during the last frame as one message."""
+        batch, self.outbox = b''.join(self.outbox), []
+        if not batch or not self.is_connected():
+            return
+        self.socket.write(frame(MSG_OPS, batch))
+
+    def on_ready_read(self):
+        self.buffer += bytes(self.socket.readAll())
+        for message_type, payload in read_frames(self.buffer):
+            if message_type == MSG_WELCOME:
+                self.on_welcome(payload)
+            elif message_type == MSG_BROADCAST:
+                self.on_broadcast(payload)
+            elif message_type == MSG_SNAPSHOT_REQUEST:
+                self.snapshot_requested = True
+                self.send_snapshot()
+
+    def on_welcome(self, payload: bytes):
+        self.client_id, self.last_seq = WELCOME.unpack_from(payload)
+        snapshot = payload[WELCOME.size:]
+        if snapshot:
+            buffer = QBuffer()
+            buffer.setData(QByteArray(snapshot))
+            reader = QImageReader(buffer, b'png')
+            color = reader.text("canvas_color") or "#1c1c1c"
+            image = reader.read()
+            if not image.isNull():
+                self.snapshotReceived.emit(image, color)
+        self.connected.emit()
+
+    def on_broadcast(self, payload: bytes):
+        offset = 0
+        while offset < len(payload):
+            seq, origin, length = BROADCAST_ENTRY.unpack_from(payload, offset)
+            offset += BROADCAST_ENTRY.size
+            ops = payload[offset:offset + length]
+            offset += length
+            if seq <= self.last_seq:
+                continue  # Already part of the snapshot or seen before
+            self.last_seq = seq
+            # Our own batches come back too, they were drawn locally already
+            if origin != self.client_id and self.canvas is not None:
+                self.apply(origin, ops)
+
+    def apply(self, origin: int, ops: bytes):
+        """Paints a batch of operations from another client."""
+        decoder = self.decoders.setdefault(origin, OpDecoder())
+        for op in decoder.decode(ops):
+            kind = op[0]
+            if kind == "begin":
+                _, key, tool, layer, rgba, width, smooth, x, y, pressure = op
+                stroke = Stroke(tool, QColor.fromRgba(rgba), width, smooth, layer)
+                stroke.add_point(x, y, pressure)
+                self.canvas.apply_strokes(added=[stroke])
+                self.remote[(origin, key)] = [stroke, 1]
+            elif kind == "points":
+                entry = self.remote.get((origin, op[1]))
+                if entry is None:
+                    continue
+                stroke = entry[0]
+                for x, y, pressure in op[2]:
+                    self.canvas.strokes.add_point(stroke, x, y, pressure)
+                # Spline segments need the point after them, so they are painted one point late
+                stop = len(stroke) - 1 if stroke.smooth else len(stroke)
+                if stop > entry[1]:
+                    self.canvas.paint_stroke(stroke, entry[1], stop)
+                    entry[1] = stop
+            elif kind == "end":
+                entry = self.remote.pop((origin, op[1]), None)
+                if entry is not None and len(entry[0]) > entry[1]:
+                    self.canvas.paint_stroke(entry[0], entry[1])
+            elif kind == "shape":
+                _, tool, layer, rgba, width, x1, y1, x2, y2 = op
+                stroke = Stroke(tool, QColor.fromRgba(rgba), width, layer=layer)
+                stroke.add_point(x1, y1)
+                stroke.add_point(x2, y2)
+                self.canvas.apply_strokes(added=[stroke])
+                self.canvas.paint_stroke(stroke)
+            elif kind == "clear":
+                self.canvas.paint_clear(op[1])
+            elif kind == "fill":
+                _, layer, rgba, tolerance, x, y = op
+                self.canvas.fill_area(x, y, QColor.fromRgba(rgba), tolerance, layer)
+            elif kind == "move":
+                _, layer, outline, matrix = op
+                self.canvas.paint_move(QPolygonF([QPointF(x, y) for x, y in outline]), QTransform(*matrix), layer)
+            elif kind == "pixels":
+                _, layer, x, y, width, height, data = op
+                image = QImage(data, width, height, width * 4, QImage.Format_ARGB32_Premultiplied).copy()
+                self.canvas.paint_pixels(image, QPoint(x, y), layer)
+
+    def send_snapshot(self):
+        """Uploads the board as of last_seq. It also shows our batches the server has not broadcast
+        back yet, which it knows because they were sent before the snapshot, so the queued ones are
+        sent first. A stroke being drawn would be cut in two, the snapshot waits until it ends."""
+        if self.local_keys or self.canvas is None or not self.is_connected():
+            return
+        self.snapshot_requested = False
+        self.frame_timer.stop()
+        self.send_batch()
+        buffer = QBuffer()
+        buffer.open(QIODevice.WriteOnly)
+        writer = QImageWriter(buffer, b'png')
+        writer.setText("canvas_color", self.canvas.color.name())
+        writer.setQuality(png_quality(1))  # Fast, the snapshot is only kept by the server
+        writer.write(self.canvas.snapshot())
+        self.socket.write(frame(MSG_SNAPSHOT, SNAPSHOT.pack(self.last_seq) + bytes(buffer.data())))
@@ -0,0 +1,182 @@
+"""Binary wire format shared by the collaboration server and clients.
+
+Every message is a FRAME header (payload length, message type) followed by the payload.
+Stroke operations travel in batches; point coordinates are sent as deltas in 1/64 pixel
+steps from the previous point of the same stroke, so a point costs 5 bytes.
+
+    HELLO              client -> server   utf-8 name
+    WELCOME            server -> client   client id, snapshot sequence, snapshot PNG (may be empty)
+    OPS                client -> server   one batch of operations
+    BROADCAST          server -> clients  BROADCAST_ENTRY records, in sequence order
+    SNAPSHOT_REQUEST   server -> client   ask for the current board as a PNG
+    SNAPSHOT           client -> server   sequence the image includes, PNG bytes; the image also
+                                          includes every batch the client sent before it
+"""
+import struct
+import zlib
+
+DEFAULT_PORT = 8765
+
+FRAME = struct.Struct('<IB')  # payload length, message type
+MSG_HELLO = 1
+MSG_WELCOME = 2
+MSG_OPS = 3
+MSG_BROADCAST = 4
+MSG_SNAPSHOT_REQUEST = 5
+MSG_SNAPSHOT = 6
+
+WELCOME = struct.Struct('<HI')  # client id, sequence the snapshot includes
+BROADCAST_ENTRY = struct.Struct('<IHI')  # sequence, origin client id, ops length
+SNAPSHOT = struct.Struct('<I')  # sequence the snapshot includes
+
+OP_HEADER = struct.Struct('<BH')  # op type, stroke key (per client)
+OP_BEGIN = 1
+OP_POINTS = 2
+OP_END = 3
+OP_SHAPE = 4
+OP_CLEAR = 5
+OP_FILL = 6
+OP_MOVE = 7
+OP_PIXELS = 8
+BEGIN = struct.Struct('<BBIfBffB')  # tool, layer, rgba, width, smooth, x, y, pressure
+POINTS = struct.Struct('<H')  # point count
+POINT = struct.Struct('<hhB')  # dx, dy in 1/64 px, pressure
+SHAPE = struct.Struct('<BBIfffff')  # tool, layer, rgba, width, x1, y1, x2, y2
+CLEAR = struct.Struct('<B')  # layer
+FILL = struct.Struct('<BIBii')  # layer, rgba, tolerance, x, y
+MOVE = struct.Struct('<BH6d')  # layer, outline point count, m11, m12, m21, m22, dx, dy
+MOVE_POINT = struct.Struct('<dd')  # x, y of the outline before the move
+PIXELS = struct.Struct('<BiiIII')  # layer, x, y, width, height, length of the zlib compressed pixels
+
+TOOLS = ("pen", "eraser", "rectangle", "ellipse", "line")
+SUBPIXEL = 64
+MAX_STEP = 32767
+
+def frame(message_type: int, payload: bytes = b'') -> bytes:
+    return FRAME.pack(len(payload), message_type) + payload
+
+def read_frames(buffer: bytearray):
+    """Yields (message type, payload) for every complete frame and removes them from buffer."""
+    offset = 0
+    while len(buffer) - offset >= FRAME.size:
+        length, message_type = FRAME.unpack_from(buffer, offset)
+        if len(buffer) - offset - FRAME.size < length:
+            break
+        start = offset + FRAME.size
+        yield message_type, bytes(buffer[start:start + length])
+        offset = start + length
+    del buffer[:offset]
+
+def _pressure(value: float) -> int:
+    return min(max(round(value * 255), 0), 255)
+
+class OpEncoder:
+    """Packs operations for one client, tracking the last sent point of each stroke."""
+    def __init__(self):
+        self.positions = {}  # stroke key -> (x, y) in 1/64 px
+
+    def begin(self, key: int, tool: str, layer: int, rgba: int, width: float, smooth: bool, x: float, y: float, pressure: float = 1.0) -> bytes:
+        qx, qy = round(x * SUBPIXEL), round(y * SUBPIXEL)
+        self.positions[key] = (qx, qy)
+        return OP_HEADER.pack(OP_BEGIN, key) + BEGIN.pack(TOOLS.index(tool), layer, rgba, width, int(smooth), qx / SUBPIXEL, qy / SUBPIXEL, _pressure(pressure))
+
+    def points(self, key: int, points: list) -> bytes:
+        """points is a list of (x, y, pressure). Jumps too long for one delta are split up."""
+        qx, qy = self.positions[key]
+        packed = []
+        for x, y, pressure in points:
+            tx, ty = round(x * SUBPIXEL), round(y * SUBPIXEL)
+            steps = max(1, -(-max(abs(tx - qx), abs(ty - qy)) // MAX_STEP))
+            for step in range(1, steps + 1):
+                nx, ny = qx + (tx - qx) * step // steps, qy + (ty - qy) * step // steps
+                packed.append(POINT.pack(nx - qx, ny - qy, _pressure(pressure)))
+                qx, qy = nx, ny
+        self.positions[key] = (qx, qy)
+        return b''.join(OP_HEADER.pack(OP_POINTS, key) + POINTS.pack(len(chunk)) + b''.join(chunk)
+                        for chunk in (packed[i:i + 65535] for i in range(0, len(packed), 65535)))
+
+    def end(self, key: int) -> bytes:
+        self.positions.pop(key, None)
+        return OP_HEADER.pack(OP_END, key)
+
+    def shape(self, tool: str, layer: int, rgba: int, width: float, x1: float, y1: float, x2: float, y2: float) -> bytes:
+        return OP_HEADER.pack(OP_SHAPE, 0) + SHAPE.pack(TOOLS.index(tool), layer, rgba, width, x1, y1, x2, y2)
+
+    def clear(self, layer: int) -> bytes:
+        return OP_HEADER.pack(OP_CLEAR, 0) + CLEAR.pack(layer)
+
+    def fill(self, layer: int, rgba: int, tolerance: int, x: int, y: int) -> bytes:
+        return OP_HEADER.pack(OP_FILL, 0) + FILL.pack(layer, rgba, tolerance, x, y)
+
+    def move(self, layer: int, outline: list, matrix: tuple) -> bytes:
+        """outline is a list of (x, y), matrix the six affine terms of the transform."""
+        outline = outline[:65535]
+        return (OP_HEADER.pack(OP_MOVE, 0) + MOVE.pack(layer, len(outline), *matrix)
+                + b''.join(MOVE_POINT.pack(x, y) for x, y in outline))
+
+    def pixels(self, layer: int, x: int, y: int, width: int, height: int, data: bytes) -> bytes:
+        """data is the area's premultiplied ARGB32 pixels, e.g. as an undo left them."""
+        data = zlib.compress(data, 1)
+        return OP_HEADER.pack(OP_PIXELS, 0) + PIXELS.pack(layer, x, y, width, height, len(data)) + data
+
+class OpDecoder:
+    """Unpacks operation batches from one client back into absolute coordinates.
+
+    Yields ("begin", key, tool, layer, rgba, width, smooth, x, y, pressure),
+    ("points", key, [(x, y, pressure)]), ("end", key),
+    ("shape", tool, layer, rgba, width, x1, y1, x2, y2), ("clear", layer),
+    ("fill", layer, rgba, tolerance, x, y), ("move", layer, [(x, y)], matrix) and
+    ("pixels", layer, x, y, width, height, premultiplied ARGB32 bytes)."""
+    def __init__(self):
+        self.positions = {}
+
+    def decode(self, data: bytes):
+        offset = 0
+        while offset < len(data):
+            op, key = OP_HEADER.unpack_from(data, offset)
+            offset += OP_HEADER.size
+            if op == OP_BEGIN:
+                tool, layer, rgba, width, smooth, x, y, pressure = BEGIN.unpack_from(data, offset)
+                offset += BEGIN.size
+                self.positions[key] = (round(x * SUBPIXEL), round(y * SUBPIXEL))
+                yield ("begin", key, TOOLS[tool], layer, rgba, width, bool(smooth), x, y, pressure / 255)
+            elif op == OP_POINTS:
+                count, = POINTS.unpack_from(data, offset)
+                offset += POINTS.size
+                qx, qy = self.positions.get(key, (0, 0))
+                points = []
+                for dx, dy, pressure in POINT.iter_unpack(data[offset:offset + count * POINT.size]):
+                    qx, qy = qx + dx, qy + dy
+                    points.append((qx / SUBPIXEL, qy / SUBPIXEL, pressure / 255))
+                offset += count * POINT.size
+                self.positions[key] = (qx, qy)
+                yield ("points", key, points)
+            elif op == OP_END:
+                self.positions.pop(key, None)
+                yield ("end", key)
+            elif op == OP_SHAPE:
+                tool, layer, rgba, width, x1, y1, x2, y2 = SHAPE.unpack_from(data, offset)
+                offset += SHAPE.size
+                yield ("shape", TOOLS[tool], layer, rgba, width, x1, y1, x2, y2)
+            elif op == OP_CLEAR:
+                layer, = CLEAR.unpack_from(data, offset)
+                offset += CLEAR.size
+                yield ("clear", layer)
+            elif op == OP_FILL:
+                layer, rgba, tolerance, x, y = FILL.unpack_from(data, offset)
+                offset += FILL.size
+                yield ("fill", layer, rgba, tolerance, x, y)
+            elif op == OP_MOVE:
+                layer, count, *matrix = MOVE.unpack_from(data, offset)
+                offset += MOVE.size
+                outline = list(MOVE_POINT.iter_unpack(data[offset:offset + count * MOVE_POINT.size]))
+                offset += count * MOVE_POINT.size
+                yield ("move", layer, outline, tuple(matrix))
+            elif op == OP_PIXELS:
+                layer, x, y, width, height, length = PIXELS.unpack_from(data, offset)
+                offset += PIXELS.size
+                pixels = zlib.decompress(data[offset:offset + length])
+                offset += length
+                yield ("pixels", layer, x, y, width, height, pixels)
+            else:
+                raise ValueError(f"unknown operation {op}")
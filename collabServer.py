@@ -0,0 +1,162 @@
+"""Relay server for collaborative boards.
+
+Clients send batches of stroke operations; the server numbers every batch, appends it to
+an operation log and forwards everything received during one tick as a single BROADCAST
+frame to all clients, the senders included, which treat their own entries as
+acknowledgements. Late joiners get the latest snapshot plus the log after it. Snapshots are
+PNGs taken by a client on request, once the log grows long or when the first client joins.
+A client answers right away, so the image also holds its own batches that are not broadcast
+yet; they are left out of the log kept after the snapshot.
+
+    python collabServer.py --host 127.0.0.1 --port 8765
+"""
+import argparse
+import asyncio
+import struct
+import sys
+
+from collabProtocol import (
+    DEFAULT_PORT, BROADCAST_ENTRY, MSG_BROADCAST, MSG_HELLO, MSG_OPS, MSG_SNAPSHOT, MSG_SNAPSHOT_REQUEST,
+    MSG_WELCOME, SNAPSHOT, WELCOME, frame, read_frames
+)
+
+class Session:
+    __slots__ = ('id', 'name', 'writer', 'since')
+
+    def __init__(self, session_id: int, writer: asyncio.StreamWriter):
+        self.id = session_id
+        self.name = ''
+        self.writer = writer
+        self.since = 0  # Sequence the client had when it joined, later batches are broadcast to it
+
+class CollabServer:
+    """One shared board. tick is the broadcast interval in seconds, snapshot_every the log
+    length after which a client is asked for a new snapshot."""
+    def __init__(self, tick: float = 1 / 60, snapshot_every: int = 2000):
+        self.tick = tick
+        self.snapshot_every = snapshot_every
+        self.sessions = {}  # id -> Session
+        self.seq = 0
+        self.log = []  # (seq, origin, packed BROADCAST_ENTRY with ops) after the snapshot
+        self.outgoing = []  # (seq, entry) received since the last broadcast
+        self.snapshot = b''
+        self.snapshot_seq = 0
+        self.snapshot_pending = None  # Session asked for a snapshot that has not arrived yet
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._next_id = 1
+        self._server = None
+        self._ticker = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self._ticker = asyncio.ensure_future(self._broadcast_loop())
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._ticker.cancel()
+        self._server.close()
+        for session in list(self.sessions.values()):
+            session.writer.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session(self._next_id, writer)
+        self._next_id = self._next_id % 65535 + 1
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                self.bytes_in += len(data)
+                buffer += data
+                for message_type, payload in read_frames(buffer):
+                    self._handle(session, message_type, payload)
+        except (ConnectionError, ValueError, struct.error):
+            pass
+        finally:
+            self.sessions.pop(session.id, None)
+            if self.snapshot_pending is session:
+                self.snapshot_pending = None
+            writer.close()
+
+    def _handle(self, session: Session, message_type: int, payload: bytes):
+        if message_type == MSG_HELLO:
+            session.name = payload.decode('utf-8', 'replace')
+            self.sessions[session.id] = session
+            # The log is sent as one frame after the snapshot it builds on
+            self._send(session, frame(MSG_WELCOME, WELCOME.pack(session.id, self.snapshot_seq) + self.snapshot))
+            if self.log:
+                self._send(session, frame(MSG_BROADCAST, b''.join(entry for _, _, entry in self.log)))
+            session.since = self.seq
+            if not self.snapshot and not self.log and self.snapshot_pending is None:
+                # The first client's board becomes the shared one
+                self._request_snapshot(session)
+        elif message_type == MSG_OPS and session.id in self.sessions:
+            self.seq += 1
+            entry = BROADCAST_ENTRY.pack(self.seq, session.id, len(payload)) + payload
+            self.log.append((self.seq, session.id, entry))
+            self.outgoing.append((self.seq, entry))
+            if len(self.log) >= self.snapshot_every and self.snapshot_pending is None:
+                self._request_snapshot(min(self.sessions.values(), key=lambda s: s.id))
+        elif message_type == MSG_SNAPSHOT:
+            seq, = SNAPSHOT.unpack_from(payload)
+            self.snapshot_pending = None
+            if seq >= self.snapshot_seq:
+                # The sender's batches in the log arrived before the snapshot, so they are drawn in it
+                self.snapshot, self.snapshot_seq = payload[SNAPSHOT.size:], seq
+                self.log = [(entry_seq, origin, entry) for entry_seq, origin, entry in self.log
+                            if entry_seq > seq and origin != session.id]
+
+    def _request_snapshot(self, session: Session):
+        self.snapshot_pending = session
+        self._send(session, frame(MSG_SNAPSHOT_REQUEST))
+
+    def _send(self, session: Session, data: bytes):
+        self.bytes_out += len(data)
+        session.writer.write(data)
+
+    async def _broadcast_loop(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            if not self.outgoing:
+                continue
+            first = self.outgoing[0][0]
+            data = frame(MSG_BROADCAST, b''.join(entry for _, entry in self.outgoing))
+            for session in list(self.sessions.values()):
+                if session.since < first:
+                    self._send(session, data)
+                else:
+                    # Joined during this tick, the log it got has part of the entries or left them out
+                    entries = [entry for seq, entry in self.outgoing if seq > session.since]
+                    if entries:
+                        self._send(session, frame(MSG_BROADCAST, b''.join(entries)))
+            self.outgoing.clear()
+            await asyncio.gather(*(self._drain(session) for session in list(self.sessions.values())))
+
+    async def _drain(self, session: Session):
+        try:
+            await session.writer.drain()
+        except ConnectionError:
+            self.sessions.pop(session.id, None)
+
+async def serve(host: str, port: int):
+    server = CollabServer()
+    port = await server.start(host, port)
+    print(f"Serving board on {host}:{port}", flush=True)
+    await asyncio.Event().wait()
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Relay server for collaborative Blackboard sessions.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
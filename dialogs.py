@@ -1,14 +1,14 @@
 from PyQt5.QtGui import QIntValidator
 from PyQt5.QtWidgets import (
     QDialog, QDialogButtonBox, QLineEdit, QVBoxLayout, QHBoxLayout, QFormLayout,
-    QColorDialog, QComboBox, QPushButton
+    QColorDialog, QComboBox, QPushButton, QCheckBox
 )
 
 from StylesheetMixin import StylesheetMixin
 
 class NewCanvasDialog(QDialog, StylesheetMixin):
-    def __init__(self, width: int = 640, height: int = 480):
-        super().__init__()
+    def __init__(self, width: int = 640, height: int = 480, parent=None):
+        super().__init__(parent)
         self.apply_stylesheet('bb')
         self.setWindowTitle('New Canvas')
         self.layout = QVBoxLayout()
@@ -38,6 +38,10 @@ class NewCanvasDialog(QDialog, StylesheetMixin):
         self.color_picker_button.setEnabled(False)
         form_layout.addRow("", self.color_picker_button)
 
+        # Width and height are then only the starting size
+        self.infinite_checkbox = QCheckBox("Grow as you draw")
+        form_layout.addRow("Infinite", self.infinite_checkbox)
+
         self.color_mode_dropdown.currentIndexChanged.connect(self.on_color_mode_change)
         self.color_picker_button.clicked.connect(self.select_custom_color)
         
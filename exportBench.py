@@ -0,0 +1,128 @@
+"""Export benchmark: time and size of the file formats a board can be written to.
+
+Draws a stroke-heavy board on the offscreen Qt platform, with a few fills and eraser
+strokes for the parts that have to be embedded as pixels, and saves it as .png, .bboard,
+.svg and .pdf the way the application does, reporting the time until each file is written
+and its size. Then the board is written as a number of .bboard files and exported as one
+PDF with a page per board, in a fresh process that holds no canvas, so its peak memory
+is that of the export alone.
+
+    python exportBench.py
+    python exportBench.py --strokes 2000 --pages 100
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PyQt5.QtCore import QEventLoop
+from PyQt5.QtGui import QColor
+
+from headless import application
+from replayBench import peak_rss
+
+FORMATS = ('.png', '.bboard', '.svg', '.pdf')
+SIZE = (3840, 2160)
+
+def build_canvas(count: int):
+    """Returns a canvas with count pen strokes, some shapes, fills and eraser strokes."""
+    from canvasObjects import JCanvas
+    from strokeModel import Stroke
+    canvas = JCanvas(*SIZE, '#1c1c1c')
+    strokes = []
+    for k in range(count):
+        tool = ("rectangle", "ellipse", "line")[k % 3] if k % 10 == 9 else "pen"
+        stroke = Stroke(tool, QColor.fromHsv(k * 37 % 360, 160, 255), 3 + k % 6, layer=1)
+        x, y = 80 + k * 97 % (SIZE[0] - 600), 60 + k * 53 % (SIZE[1] - 200)
+        if tool == "pen":
+            for i in range(120):
+                stroke.add_point(x + i * 4, y + 40 * math.sin(i / 12 + k), 0.4 + 0.6 * abs(math.sin(i / 30)))
+        else:
+            stroke.add_point(x, y)
+            stroke.add_point(x + 180, y + 120)
+        strokes.append(stroke)
+    for k in range(4):
+        eraser = Stroke("eraser", canvas.color, 40, layer=1)
+        for i in range(60):
+            eraser.add_point(400 + k * 800 + i * 5, 300 + i * 20)
+        strokes.append(eraser)
+    boxes = []
+    for k in range(3):
+        box = Stroke("rectangle", QColor('#ffffff'), 4, layer=1)
+        box.add_point(200 + k * 1200, 1850)
+        box.add_point(700 + k * 1200, 2100)
+        boxes.append(box)
+    strokes += boxes
+    canvas.apply_strokes(added=strokes)
+    for stroke in strokes:
+        canvas.paint_stroke(stroke)
+    for box in boxes:
+        canvas.fill_area(int(box.xs[0]) + 20, int(box.ys[0]) + 20, QColor('#3060a0'), 32, 0)
+    return canvas
+
+def save(app, canvas, filename: str) -> float:
+    """Saves canvas like the application does and returns the seconds until the file is written."""
+    start = time.perf_counter()
+    canvas.save(filename, "blackboard")
+    while canvas.is_saving():
+        app.processEvents(QEventLoop.WaitForMoreEvents)
+    return time.perf_counter() - start
+
+def export_pages(boards: list, filename: str) -> dict:
+    """Exports the board files as one PDF and returns the time, size and peak memory of doing so."""
+    application()
+    from vectorExport import write_pdf
+    rss_start = peak_rss()
+    start = time.perf_counter()
+    error = write_pdf(boards, filename)
+    if error:
+        raise RuntimeError(error)
+    return {
+        "seconds": time.perf_counter() - start,
+        "bytes": os.path.getsize(filename),
+        "peak_rss_mb": peak_rss() / 1024 / 1024,
+        "peak_growth_mb": (peak_rss() - rss_start) / 1024 / 1024,
+    }
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measures the time and size of Blackboard's export formats.")
+    parser.add_argument('--strokes', type=int, default=1000, help="Strokes drawn on the board")
+    parser.add_argument('--repeat', type=int, default=3, help="Saves per format, the fastest is kept")
+    parser.add_argument('--pages', type=int, default=50, help="Boards in the multi-page PDF, 0 to skip it")
+    args = parser.parse_args(argv)
+
+    # The worker starts before the board is drawn, a process started later would inherit its peak memory
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    pool.submit(peak_rss).result()
+    app = application()
+    from vectorExport import VectorPage
+    canvas = build_canvas(args.strokes)
+    page = VectorPage.from_canvas(canvas)
+    print(f"board {SIZE[0]}x{SIZE[1]}, {len(canvas.strokes)} strokes: {len(page.strokes)} exported as paths, "
+          f"{sum(image.width() * image.height() for _, image in page.images) / (SIZE[0] * SIZE[1]) * 100:.1f}% of the area as pixels")
+    directory = tempfile.mkdtemp(prefix='blackboard-export-')
+    try:
+        for extension in FORMATS:
+            filename = os.path.join(directory, 'board' + extension)
+            seconds = min(save(app, canvas, filename) for _ in range(max(1, args.repeat)))
+            print(f"  {extension:<8} {seconds * 1000:8.0f} ms  {os.path.getsize(filename) / 1024:10.0f} KiB", flush=True)
+        if args.pages:
+            boards = []
+            for index in range(args.pages):
+                boards.append(os.path.join(directory, f'board-{index}.bboard'))
+                shutil.copyfile(os.path.join(directory, 'board.bboard'), boards[-1])
+            result = pool.submit(export_pages, boards, os.path.join(directory, 'boards.pdf')).result()
+            print(f"{args.pages} boards as one PDF: {result['seconds']:.2f} s, {result['bytes'] / 1024 / 1024:.1f} MiB, "
+                  f"peak memory {result['peak_rss_mb']:.0f} MB, +{result['peak_growth_mb']:.0f} MB while writing")
+    finally:
+        pool.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Flood fill benchmark: the fill tool on an 8K canvas over regions of several shapes.
+
+Each shape is drawn onto a fresh canvas and filled from a seed inside it the way the fill
+tool does, undo step included; the fill is undone between runs. Open regions cost one run
+per row, the comb, spiral and speckled regions have many short runs per row that the fill
+has to join up. The undo step holds only the tiles the fill reached. Every fill is reported
+against TARGET_MS and the bench exits with status 1 when one takes longer.
+
+    python fillBench.py
+    python fillBench.py --size 3840x2160 --shape ring --shape spiral
+"""
+import argparse
+import math
+import random
+import sys
+import time
+
+from PyQt5.QtCore import QPointF
+from PyQt5.QtGui import QColor, QImage, QPainter, QPainterPath, QPen
+
+from headless import application
+
+REPEAT = 3  # Fills timed per shape, the fastest counts
+TARGET_MS = 100  # Longest a fill may take
+BACKGROUND = '#1c1c1c'
+
+def empty(painter: QPainter, width: int, height: int) -> tuple:
+    return width // 2, height // 2
+
+def half(painter: QPainter, width: int, height: int) -> tuple:
+    painter.drawLine(width // 2, 0, width // 2, height)
+    return width // 4, height // 2
+
+def ring(painter: QPainter, width: int, height: int) -> tuple:
+    radius = min(width, height) * 0.45
+    painter.drawEllipse(QPointF(width / 2, height / 2), radius, radius)
+    return width // 2, height // 2
+
+def spiral(painter: QPainter, width: int, height: int) -> tuple:
+    """A spiral wall whose channel winds from the centre to the edge."""
+    path = QPainterPath(QPointF(width / 2, height / 2))
+    gap, angle = 40, 0.0
+    while True:
+        radius = gap * angle / (2 * math.pi)
+        x, y = width / 2 + radius * math.cos(angle), height / 2 + radius * math.sin(angle)
+        if radius > max(width, height):
+            break
+        path.lineTo(x, y)
+        angle += 0.05
+    painter.drawPath(path)
+    return width // 2 + gap // 2, height // 2
+
+def comb(painter: QPainter, width: int, height: int) -> tuple:
+    """Teeth every 40 pixels, open at alternating ends, so the region snakes across the canvas."""
+    for k, x in enumerate(range(40, width, 40)):
+        if k % 2:
+            painter.drawLine(x, 40, x, height)
+        else:
+            painter.drawLine(x, 0, x, height - 40)
+    return 20, height // 2
+
+def speckle(painter: QPainter, width: int, height: int) -> tuple:
+    """Scattered dots, one per 400 pixels, that the fill has to go around."""
+    rng = random.Random(1)
+    painter.drawPoints(*(QPointF(rng.randrange(width), rng.randrange(height)) for _ in range(width * height // 400)))
+    return 0, 0
+
+def small(painter: QPainter, width: int, height: int) -> tuple:
+    painter.drawRect(width // 2 - 100, height // 2 - 100, 200, 200)
+    return width // 2, height // 2
+
+SHAPES = {
+    "empty": empty,
+    "half": half,
+    "ring": ring,
+    "spiral": spiral,
+    "comb": comb,
+    "speckle": speckle,
+    "small-box": small,
+}
+
+def build_canvas(shape, width: int, height: int):
+    """Returns a canvas with shape drawn on it in white, and the seed to fill from."""
+    from canvasObjects import JCanvas
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(QColor(BACKGROUND))
+    painter = QPainter(image)
+    painter.setPen(QPen(QColor('#ffffff'), 3))
+    seed = shape(painter, width, height)
+    painter.end()
+    canvas = JCanvas(loadedImage=image, color=BACKGROUND)
+    canvas.set_pen_color('#3060a0')
+    return canvas, seed
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measures the fill tool over regions of several shapes.")
+    parser.add_argument('--size', default='7680x4320', help="Canvas size, WIDTHxHEIGHT")
+    parser.add_argument('--shape', action='append', choices=list(SHAPES), help="Shape to fill, may be repeated")
+    args = parser.parse_args(argv)
+    width, height = (int(value) for value in args.size.lower().split('x'))
+
+    app = application()
+    import floodFill  # Loaded with the first fill in the application, not timed here
+    print(f"canvas {width}x{height}, target {TARGET_MS} ms")
+    over = []
+    for name in args.shape or SHAPES:
+        canvas, (x, y) = build_canvas(SHAPES[name], width, height)
+        times = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            canvas.fill(x, y)
+            times.append(time.perf_counter() - start)
+            step = canvas.history.undo_stack[-1]
+            canvas.undo()
+        ms = min(times) * 1000
+        if ms > TARGET_MS:
+            over.append(name)
+        print(f"  {name:<10} {ms:8.1f} ms  {'over' if ms > TARGET_MS else 'ok':<4}  undo step {len(step.tiles):5d} tiles  "
+              f"{step.nbytes() / 1024 / 1024:6.2f} MiB", flush=True)
+        canvas.deleteLater()
+        app.processEvents()
+    if over:
+        print(f"over {TARGET_MS} ms: {', '.join(over)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
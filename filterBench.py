@@ -0,0 +1,122 @@
+"""Stroke filter benchmark: points in against points out, and the time to draw what is left.
+
+Feeds synthetic mouse and tablet strokes through StrokeFilter with the tool presets and with
+no decimation at all, then draws the segments the way JCanvas does while a stroke is drawn,
+one LiveStroke frame per 16 ms of input. Decimation should keep a small fraction of the
+samples and make drawing correspondingly cheaper, without the stroke leaving its path.
+
+    python filterBench.py
+    python filterBench.py --samples 50000
+"""
+import argparse
+import math
+import random
+import sys
+import time
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QColor, QImage
+
+from headless import application
+
+FRAME_MS = 16
+CANVAS = (3840, 2160)
+WIDTH = 8  # Pen width the segments are drawn with
+STROKE_SAMPLES = 1000
+RAW = {"min_distance": 0.0, "max_distance": 0.0, "min_angle": 0.0, "tolerance": 0.0, "smoothing": None}
+
+def inputs(samples: int) -> dict:
+    """Returns strokes of samples (t in seconds, x, y, pressure) for every kind of input."""
+    rng = random.Random(1)
+
+    def strokes(rate: int, speed: float, jitter: float, rounded: bool) -> list:
+        result = []
+        for k in range(max(1, samples // STROKE_SAMPLES)):
+            stroke = []
+            for i in range(STROKE_SAMPLES):
+                t = i / rate
+                x = 200 + (speed * t) % 3400 + rng.gauss(0, jitter)
+                y = 150 + k * 180 % 1800 + 120 * math.sin(speed * t / 300 + k) + rng.gauss(0, jitter)
+                if rounded:
+                    x, y = round(x), round(y)
+                stroke.append((t, x, y, 0.3 + 0.7 * abs(math.sin(t * 2 + k))))
+            result.append(stroke)
+        return result
+
+    return {
+        "mouse-125hz": strokes(125, 1200, 0.0, True),
+        "tablet-240hz": strokes(240, 1200, 0.1, False),
+        "tablet-1000hz-jitter": strokes(1000, 1200, 0.4, False),
+    }
+
+def filters() -> dict:
+    from strokeFilter import FILTER_PRESETS
+    return {
+        "none": RAW,
+        "pen": FILTER_PRESETS["pen"],
+        "pen+one-euro": dict(FILTER_PRESETS["pen"], one_euro=True),
+        "eraser": FILTER_PRESETS["eraser"],
+    }
+
+def run(strokes: list, settings: dict) -> dict:
+    """Filters and draws strokes, returning the point counts and the seconds each stage took."""
+    from strokeFilter import StrokeFilter
+    from strokeOutline import LiveStroke
+    image = QImage(*CANVAS, QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.transparent)
+    points_in = points_out = segments_out = 0
+    filtering = drawing = 0.0
+    frames = []
+    for stroke in strokes:
+        stroke_filter = StrokeFilter(**settings)
+        live = LiveStroke(image, QColor('#ffffff'))
+        t, x, y, pressure = stroke[0]
+        stroke_filter.begin(x, y, pressure, t)
+        frame_end = FRAME_MS / 1000
+        batch = []
+        for index, (t, x, y, pressure) in enumerate(stroke[1:], 1):
+            start = time.perf_counter()
+            batch += stroke_filter.push(x, y, pressure, t)
+            if index == len(stroke) - 1:
+                batch += stroke_filter.finish()
+            filtering += time.perf_counter() - start
+            if t < frame_end and index < len(stroke) - 1:
+                continue
+            frame_end += FRAME_MS / 1000
+            if batch:
+                start = time.perf_counter()
+                rect = live.add([segment[:8] + (WIDTH * segment[8] / 2,) for segment in batch])
+                live.paint(rect)
+                frames.append(time.perf_counter() - start)
+                drawing += frames[-1]
+                segments_out += len(batch)
+                batch = []
+        points_in += stroke_filter.points_in
+        points_out += stroke_filter.points_out
+    frames.sort()
+    return {
+        "points_in": points_in,
+        "points_out": points_out,
+        "segments": segments_out,
+        "filter_s": filtering,
+        "draw_s": drawing,
+        "frame_p95_s": frames[min(len(frames) - 1, int(0.95 * len(frames)))] if frames else 0.0,
+    }
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measures how far the stroke filter decimates input and what drawing the rest costs.")
+    parser.add_argument('--samples', type=int, default=10000, help="Samples of every kind of input")
+    args = parser.parse_args(argv)
+
+    app = application()
+    for kind, strokes in inputs(args.samples).items():
+        print(f"{kind}: {len(strokes)} strokes")
+        for name, settings in filters().items():
+            result = run(strokes, settings)
+            print(f"  {name:<13} in {result['points_in']:7d}  out {result['points_out']:7d}  "
+                  f"({result['points_in'] / max(1, result['points_out']):5.1f}x)  filter {result['filter_s'] * 1000:7.1f} ms  "
+                  f"draw {result['draw_s'] * 1000:7.1f} ms  frame p95 {result['frame_p95_s'] * 1000:6.2f} ms", flush=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import numpy as np
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QImage
+
+from pixelKernels import image_array, pixel_array, premultiplied
+
+FIRST_WINDOW = 512  # Side of the first area searched around the seed, each next one is 4 times as wide
+SAMPLE_STEP = 16  # Every this many rows and columns are compared to pick the direction of the runs
+
+def different_mask(pixels: np.ndarray, seed: int, tolerance: int = 0) -> np.ndarray:
+    """Returns where pixels differ from seed by more than tolerance in some channel."""
+    different = pixels != np.uint32(seed)
+    if tolerance > 0:
+        # The other pixels are usually few, only those are compared channel by channel
+        values = pixels[different]
+        close = np.ones(len(values), bool)
+        for shift in (0, 8, 16, 24):
+            channel = (values >> shift & 0xff).astype(np.int16)
+            close &= np.abs(channel - (seed >> shift & 0xff)) <= tolerance
+        if close.any():
+            different[different] = ~close
+    return different
+
+def run_bounds(different: np.ndarray, vertical: bool = False) -> np.ndarray:
+    """Returns the starts and ends of the runs of similar pixels along the rows, or the columns if
+    vertical, alternately and in order, each as line * (line length + 1) + position."""
+    height, width = different.shape
+    if vertical:
+        rows, columns = np.divmod(np.flatnonzero(different[1:] != different[:-1]), width)
+        inner = np.sort(columns * (height + 1) + rows + 1)
+        first, last, length, lines = different[0], different[-1], height, width
+    else:
+        rows, columns = np.divmod(np.flatnonzero(different[:, 1:] != different[:, :-1]), max(width - 1, 1))
+        inner = rows * (width + 1) + columns + 1
+        first, last, length, lines = different[:, 0], different[:, -1], width, height
+    # Lines that start or end similar have a run from or to their end
+    lines = np.arange(lines) * (length + 1)
+    border = np.concatenate((lines[~first], lines[~last] + length))
+    border.sort()
+    return np.insert(inner, np.searchsorted(inner, border), border)
+
+def connected_runs(starts: np.ndarray, ends: np.ndarray, stride: int, seed: int) -> np.ndarray:
+    """Returns which runs are connected to run seed through runs that overlap them in the next or
+    previous line. Runs are given by their start and end keys from run_bounds(), stride per line."""
+    count = len(starts)
+    # Every run is paired with the range of runs of the next line that overlap it
+    first = np.searchsorted(ends, starts + stride, 'right')
+    counts = np.maximum(np.searchsorted(starts, ends + stride, 'left') - first, 0)
+    runs = np.repeat(np.arange(count), counts)
+    below = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()))
+    # Union-find over all pairs at once: the larger root of every pair that is still apart is
+    # hooked onto the smaller one, then every run is pointed straight at its root
+    parent = np.arange(count)
+    while runs.size:
+        a, b = parent[runs], parent[below]
+        apart = a != b
+        if not apart.any():
+            break
+        runs, below, a, b = runs[apart], below[apart], a[apart], b[apart]
+        np.minimum.at(parent, np.maximum(a, b), np.minimum(a, b))
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    return parent == parent[seed]
+
+def flood_fill_mask(pixels: np.ndarray, x: int, y: int, tolerance: int = 0, prepare=None) -> tuple:
+    """Returns (mask, QRect) of the 4-connected area around (x, y) that is similar to its pixel,
+    with the mask covering only the QRect.
+
+    The area is searched in a window around (x, y) that grows 4 times wider and higher for as
+    long as the area reaches its edge, so small fills only look at the pixels near them.
+    prepare, if given, is called with each window before its pixels are read."""
+    height, width = pixels.shape
+    bounds = QRect(0, 0, width, height)
+    seed = int(pixels[y, x])
+    size = FIRST_WINDOW
+    while True:
+        window = QRect(x - size // 2, y - size // 2, size, size).intersected(bounds)
+        if prepare is not None:
+            prepare(window)
+        mask, found = _window_mask(pixels[_slices(window)], x - window.x(), y - window.y(), seed, tolerance)
+        found.translate(window.topLeft())
+        # The area may go on past edges of the window that are not edges of the pixels
+        inside = window.adjusted(int(window.left() > 0), int(window.top() > 0),
+                                 -int(window.right() < width - 1), -int(window.bottom() < height - 1))
+        if window == bounds or inside.contains(found):
+            return mask, found
+        size *= 4
+
+def _window_mask(pixels: np.ndarray, x: int, y: int, seed: int, tolerance: int) -> tuple:
+    """flood_fill_mask() within pixels. Runs of similar pixels are found with NumPy along the rows,
+    or along the columns if fewer edges cross them, and joined with connected_runs()."""
+    different = different_mask(pixels, seed, tolerance)
+    height, width = different.shape
+    step = SAMPLE_STEP
+    across_rows = np.count_nonzero(different[::step, 1:] != different[::step, :-1])
+    across_columns = np.count_nonzero(different[1:, ::step] != different[:-1, ::step])
+    # Columns need their edges sorted, they are taken only when clearly fewer
+    vertical = across_columns * 2 < across_rows
+    keys = run_bounds(different, vertical)
+    starts, ends = keys[0::2], keys[1::2]
+    length, line, position = (height, x, y) if vertical else (width, y, x)
+    stride = length + 1
+    selected = connected_runs(starts, ends, stride, np.searchsorted(starts, line * stride + position, 'right') - 1)
+    lines, run_starts = np.divmod(starts[selected], stride)
+    run_ends = ends[selected] % stride
+    low, high, near, far = int(lines[0]), int(lines[-1]) + 1, int(run_starts.min()), int(run_ends.max())
+    rect = QRect(low, near, high - low, far - near) if vertical else QRect(near, low, far - near, high - low)
+    if selected.all():
+        # Every similar pixel of the window is part of the area
+        return ~different[_slices(rect)], rect
+    # Runs are drawn as +1 at their start and -1 at their end, summed along the line
+    edges = np.zeros((high - low, far - near + 1), np.int8)
+    edges[lines - low, run_starts - near] = 1
+    edges[lines - low, run_ends - near] = -1
+    mask = np.cumsum(edges[:, :-1], axis=1, dtype=np.int8).view(bool)
+    return (mask.T if vertical else mask), rect
+
+def _slices(rect: QRect) -> tuple:
+    return slice(rect.top(), rect.bottom() + 1), slice(rect.left(), rect.right() + 1)
+
+def mask_tiles(mask: np.ndarray, rect: QRect, tile_size: int):
+    """Yields the rects of the tile_size grid cells that contain part of mask, which covers rect."""
+    left, top = rect.left() // tile_size * tile_size, rect.top() // tile_size * tile_size
+    rows = [0] + list(range(top + tile_size - rect.top(), rect.height(), tile_size))
+    columns = [0] + list(range(left + tile_size - rect.left(), rect.width(), tile_size))
+    reached = np.logical_or.reduceat(np.logical_or.reduceat(mask, rows, axis=0), columns, axis=1)
+    for ty, tx in zip(*np.nonzero(reached)):
+        yield QRect(left + int(tx) * tile_size, top + int(ty) * tile_size, tile_size, tile_size)
+
+def fill_mask(target, mask: np.ndarray, rect: QRect, color: int):
+    """Sets the pixels of target, a premultiplied 32-bit QImage or a TiledPixmap, where mask, which
+    covers rect, is set to color, given as ARGB. The pixels are changed in place."""
+    value = np.uint32(premultiplied(color))
+    if isinstance(target, QImage):
+        pixels = pixel_array(target)[_slices(rect)]
+        if mask.all():
+            pixels.fill(value)  # Writes without reading the mask, twice as fast
+        else:
+            np.copyto(pixels, value, where=mask)
+        return
+    with target.tile_images(rect) as tiles:
+        for tile_rect, tile in tiles:
+            part = tile_rect.intersected(rect)
+            np.copyto(pixel_array(tile)[_slices(part.translated(-tile_rect.topLeft()))], value,
+                      where=mask[_slices(part.translated(-rect.topLeft()))])
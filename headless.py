@@ -0,0 +1,15 @@
+"""Qt without a display server, for the benchmarks, the tests and bbcli.py."""
+import os
+import sys
+
+def application(widgets: bool = True):
+    """Returns the running Qt application, or starts one. It runs on the offscreen platform
+    unless QT_QPA_PLATFORM names another; without widgets a QGuiApplication is enough."""
+    # The platform is picked when the application starts, importing Qt is fine before this
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtGui import QGuiApplication
+    app = QGuiApplication.instance()
+    if app is None:
+        from PyQt5.QtWidgets import QApplication
+        app = (QApplication if widgets else QGuiApplication)([sys.argv[0]])
+    return app
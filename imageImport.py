@@ -0,0 +1,91 @@
+"""Opening images as canvases in bounded memory, decoded on a QThreadPool worker.
+
+QImageReader scales JPEG and PNG images while it decodes them and only holds the scaled
+pixels, so an image whose canvas would not fit the memory limit is decoded straight to a
+size that does, instead of at full size and scaled afterwards. The task reports the size
+first, so the page can be shown right away, then a low-resolution preview where that is
+cheaper than the full decode, then the image itself.
+"""
+import math
+from PyQt5.QtCore import Qt, QObject, QRunnable, QSize, pyqtSignal
+from PyQt5.QtGui import QImage, QImageIOHandler, QImageReader
+
+IMPORT_MEMORY_LIMIT = 1024 * 1024 * 1024  # Bytes of canvas pixels an opened image may take
+IMPORT_PIXEL_BYTES = 18  # Canvas layer, composite and zoomed-out tiles, and up to twice the image while it is scaled
+PREVIEW_SIZE = 1024  # Longest side of a preview
+# Decoders that skip detail when they scale down, a preview from the others costs a full decode
+PREVIEW_FORMATS = (b'jpeg', b'jpg')
+DEFAULT_CANVAS_COLOR = "#1c1c1c"
+
+def import_size(size: QSize, memory_limit: int = IMPORT_MEMORY_LIMIT) -> QSize:
+    """Returns size, or size scaled down with the same aspect ratio so that its canvas fits memory_limit."""
+    pixels = memory_limit // IMPORT_PIXEL_BYTES
+    if size.width() * size.height() <= pixels:
+        return QSize(size)
+    scale = math.sqrt(pixels / (size.width() * size.height()))
+    return QSize(max(1, int(size.width() * scale)), max(1, int(size.height() * scale)))
+
+def layer_image(image: QImage) -> QImage:
+    """Returns image as the premultiplied ARGB32 image of a canvas layer."""
+    if image.format() == QImage.Format_RGB32:
+        # Its pixels are 0xffRRGGBB, already opaque premultiplied ARGB
+        image.reinterpretAsFormat(QImage.Format_ARGB32_Premultiplied)
+        return image
+    return image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+
+class ImageImportSignals(QObject):
+    sized = pyqtSignal(QSize, QSize, str)  # Canvas size, size of the image, canvas color
+    previewReady = pyqtSignal(object)  # QImage of the canvas size, upscaled from a preview
+    finished = pyqtSignal(object, str)  # QImage of the canvas size or None, error message or empty on success
+
+class ImageImportTask(QRunnable):
+    """Decodes an image file for a canvas that fits memory_limit, see the module docstring."""
+    def __init__(self, filename: str, memory_limit: int = IMPORT_MEMORY_LIMIT):
+        super().__init__()
+        self.filename = filename
+        self.memory_limit = memory_limit
+        self.signals = ImageImportSignals()
+
+    def run(self):
+        try:
+            image = self.read()
+        except Exception as e:
+            self.signals.finished.emit(None, str(e))
+            return
+        self.signals.finished.emit(layer_image(image), "")
+
+    def read(self) -> QImage:
+        reader = QImageReader(self.filename)
+        color = reader.text("canvas_color") or DEFAULT_CANVAS_COLOR
+        size = reader.size()
+        if not size.isValid():
+            # Formats that do not tell their size up front are decoded whole
+            image = reader.read()
+            if image.isNull():
+                raise IOError(reader.errorString())
+            size = import_size(image.size(), self.memory_limit)
+            self.signals.sized.emit(size, image.size(), color)
+            return image if size == image.size() else image.scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+        target = import_size(size, self.memory_limit)
+        scaled_on_decode = reader.supportsOption(QImageIOHandler.ScaledSize)
+        if target != size and not scaled_on_decode and size.width() * size.height() * 4 > self.memory_limit:
+            raise MemoryError(f"A {size.width()}x{size.height()} {bytes(reader.format()).decode()} image cannot be opened "
+                              f"in {self.memory_limit // (1024 * 1024)} MiB of memory")
+        self.signals.sized.emit(target, size, color)
+
+        if scaled_on_decode and bytes(reader.format()) in PREVIEW_FORMATS and max(target.width(), target.height()) > PREVIEW_SIZE:
+            preview = QImageReader(self.filename)
+            preview.setScaledSize(target.scaled(PREVIEW_SIZE, PREVIEW_SIZE, Qt.KeepAspectRatio))
+            image = preview.read()
+            if not image.isNull():
+                self.signals.previewReady.emit(layer_image(image.scaled(target, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)))
+            del image
+
+        if target != size:
+            # Handlers that cannot scale while decoding get scaled afterwards by QImageReader
+            reader.setScaledSize(target)
+        image = reader.read()
+        if image.isNull():
+            raise IOError(reader.errorString())
+        return image
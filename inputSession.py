@@ -0,0 +1,116 @@
+"""Recorded input sessions for replaying drawing work on a JCanvas.
+
+A session is a JSON object:
+
+    {"version": 1, "canvas": [width, height, color], "events": [[time_ms, kind, *args], ...]}
+
+time_ms counts from the start of the recording. Positions are in canvas coordinates, so a
+session replays the same at any zoom. The kinds are
+
+    press, move, release                 x, y                mouse with the left button
+    tablet_press, tablet_move,           x, y, pressure      stylus
+    tablet_release
+    tool, width, color, layer            value               canvas settings before a press
+    undo, redo
+    save                                 extension           ".png" or ".bboard"
+    canvas                               width, height, color   a new canvas replaces the current one
+"""
+import json
+import time
+from PyQt5.QtCore import Qt, QEvent, QObject, QPointF
+from PyQt5.QtGui import QMouseEvent, QTabletEvent
+
+SESSION_VERSION = 1
+
+MOUSE_KINDS = {
+    "press": QEvent.MouseButtonPress,
+    "move": QEvent.MouseMove,
+    "release": QEvent.MouseButtonRelease,
+}
+TABLET_KINDS = {
+    "tablet_press": QEvent.TabletPress,
+    "tablet_move": QEvent.TabletMove,
+    "tablet_release": QEvent.TabletRelease,
+}
+EVENT_KINDS = {event_type: kind for kind, event_type in {**MOUSE_KINDS, **TABLET_KINDS}.items()}
+
+def new_session(width: int, height: int, color: str = '#1c1c1c') -> dict:
+    return {"version": SESSION_VERSION, "canvas": [width, height, color], "events": []}
+
+def load_session(filename: str) -> dict:
+    with open(filename, encoding='utf-8') as file:
+        session = json.load(file)
+    if session.get("version") != SESSION_VERSION:
+        raise ValueError(f"{filename}: unsupported session version {session.get('version')}")
+    return session
+
+def write_session(session: dict, filename: str):
+    with open(filename, 'w', encoding='utf-8') as file:
+        # One event per line keeps recordings diffable
+        file.write('{"version": %d, "canvas": %s, "events": [\n' % (session["version"], json.dumps(session["canvas"])))
+        file.write(',\n'.join(json.dumps(event) for event in session["events"]))
+        file.write('\n]}\n')
+
+def input_event(kind: str, x: float, y: float, pressure: float = 1.0):
+    """Returns the QMouseEvent or QTabletEvent for a recorded press, move or release."""
+    if kind in MOUSE_KINDS:
+        buttons = Qt.NoButton if kind == "release" else Qt.LeftButton
+        return QMouseEvent(MOUSE_KINDS[kind], QPointF(x, y), Qt.LeftButton, buttons, Qt.NoModifier)
+    buttons = Qt.NoButton if kind == "tablet_release" else Qt.LeftButton
+    return QTabletEvent(TABLET_KINDS[kind], QPointF(x, y), QPointF(x, y), QTabletEvent.Stylus, QTabletEvent.Pen,
+                        pressure, 0, 0, 0.0, 0.0, 0, Qt.NoModifier, 1, Qt.LeftButton, buttons)
+
+class SessionRecorder(QObject):
+    """Records the drawing input a JCanvas receives, for replaying it with replayBench.py.
+
+    Mouse and tablet events are picked up with an event filter on the canvas. Actions that do
+    not arrive as canvas input, like undo, are added with note()."""
+    def __init__(self, filename: str):
+        super().__init__()
+        self.filename = filename
+        self.session = None
+        self.canvas = None
+        self.settings = {}  # Last recorded tool, width, color and layer
+        self.start = time.perf_counter()
+
+    def attach(self, canvas):
+        """Starts recording canvas, replacing any previously attached canvas."""
+        if self.canvas is not None:
+            self.canvas.removeEventFilter(self)
+        self.canvas = canvas
+        canvas.installEventFilter(self)
+        self.settings = {}
+        if self.session is None:
+            self.session = new_session(canvas.width, canvas.height, canvas.color.name())
+        else:
+            self.note("canvas", canvas.width, canvas.height, canvas.color.name())
+
+    def note(self, kind: str, *args):
+        self.session["events"].append([round((time.perf_counter() - self.start) * 1000, 2), kind, *args])
+
+    def eventFilter(self, watched, event):
+        kind = EVENT_KINDS.get(event.type())
+        if kind is None or watched is not self.canvas:
+            return False
+        if kind in MOUSE_KINDS and (event.button() | event.buttons()) & Qt.LeftButton == 0:
+            return False  # Panning and other buttons do not draw
+        if kind in ("press", "tablet_press"):
+            self._note_settings()
+        x, y = self.canvas.canvas_pos_f(event)
+        if kind in TABLET_KINDS:
+            self.note(kind, round(x, 2), round(y, 2), round(event.pressure(), 3))
+        else:
+            self.note(kind, round(x, 2), round(y, 2))
+        return False
+
+    def _note_settings(self):
+        canvas = self.canvas
+        settings = {"tool": canvas.tool, "width": canvas.toolWidth, "color": canvas.pen_color.name(), "layer": canvas.active_layer}
+        for kind, value in settings.items():
+            if self.settings.get(kind) != value:
+                self.note(kind, value)
+        self.settings = settings
+
+    def write(self):
+        if self.session is not None:
+            write_session(self.session, self.filename)
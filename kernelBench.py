@@ -0,0 +1,157 @@
+"""Pixel kernel microbenchmark: the per-pixel operations of the canvas backing store.
+
+Times each operation on premultiplied ARGB32 images of a canvas size, both the way the
+canvas does it and the alternative, and reports milliseconds and megapixels per second:
+
+  recolor    canvas color change, NumPy (pixelKernels) vs QPainter drawing a color mask
+  history    recoloring a layer's worth of compressed undo tiles
+  clear      filling an area with the canvas color, QPainter vs a NumPy slice
+  composite  one layer source-over onto another, QPainter vs a NumPy kernel
+  present    drawing a dirty rect of the composite to the screen vs the whole frame
+
+The NumPy versions of clear and composite are here as the yardstick for QPainter, which
+the canvas keeps using for them while it is faster.
+
+    python kernelBench.py
+    python kernelBench.py --size 3840x2160 --repeat 20
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+from PyQt5.QtCore import Qt, QRect
+from PyQt5.QtGui import QBitmap, QColor, QImage, QPainter
+
+from headless import application
+from pixelKernels import image_array, pixel_array, premultiplied, recolor_image
+
+BACKGROUND = QColor('#1c1c1c')
+RECOLORED = QColor('#f0f0e0')
+DIRTY_RECT = QRect(640, 360, 256, 256)  # A few pen segments' worth of repaint
+
+def test_image(width: int, height: int, fill: QColor) -> QImage:
+    """Returns a premultiplied image of fill with translucent antialiased lines over it."""
+    image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+    image.fill(fill)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(QColor(200, 100, 50, 180))
+    for k in range(0, width, 8):
+        painter.drawLine(k, 0, width - k // 2, height)
+    painter.end()
+    return image
+
+def timed(function, repeat: int) -> float:
+    """Returns the fastest of repeat runs of function, in milliseconds, after one warm-up run."""
+    function()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def qt_recolor(image: QImage, old: QColor, new: QColor):
+    # The set bits of a bitmap are drawn in the pen color, the others are left alone
+    mask = QBitmap.fromImage(image.createMaskFromColor(old.rgba(), Qt.MaskOutColor))
+    painter = QPainter(image)
+    painter.setPen(new)
+    painter.setBackgroundMode(Qt.TransparentMode)
+    painter.drawPixmap(0, 0, mask)
+    painter.end()
+
+def qt_clear(image: QImage, rect: QRect, color: QColor):
+    painter = QPainter(image)
+    painter.setCompositionMode(QPainter.CompositionMode_Source)
+    painter.fillRect(rect, color)
+    painter.end()
+
+def numpy_clear(image: QImage, rect: QRect, color: QColor):
+    pixel_array(image)[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1] = premultiplied(color)
+
+def qt_composite(target: QImage, source: QImage):
+    painter = QPainter(target)
+    painter.drawImage(0, 0, source)
+    painter.end()
+
+def numpy_composite(target: QImage, source: QImage):
+    """Premultiplied source-over, dst = src + dst * (255 - src alpha) / 255, per channel."""
+    src = image_array(source).view(np.uint8).reshape(source.height(), source.width(), 4)
+    dst = pixel_array(target).view(np.uint8).reshape(target.height(), target.width(), 4)
+    inverse = 255 - src[..., 3:4].astype(np.uint16)
+    blended = dst * inverse + 128
+    dst[...] = ((blended + (blended >> 8)) >> 8) + src
+
+def qt_present(screen: QImage, composite: QImage, rect: QRect):
+    painter = QPainter(screen)
+    painter.setClipRect(rect)
+    painter.drawImage(rect, composite, rect)
+    painter.end()
+
+def history_recolor(width: int, height: int):
+    """Returns a function that recolors a history holding one step with every tile of a layer."""
+    from tileHistory import TileHistory
+    history = TileHistory()
+    image = test_image(width, height, BACKGROUND)
+    history.begin()
+    history.touch(image, image.rect(), 0)
+    history.commit()
+    colors = [BACKGROUND, RECOLORED]
+
+    def run():
+        history.recolor(0, colors[0], colors[1])
+        colors.reverse()
+    return run, len(history.undo_stack[0].tiles)
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measures the per-pixel kernels of Blackboard's canvas.")
+    parser.add_argument('--size', default='1920x1080', help="Canvas size, WIDTHxHEIGHT")
+    parser.add_argument('--repeat', type=int, default=10, help="Runs per kernel, the fastest is kept")
+    args = parser.parse_args(argv)
+    width, height = (int(value) for value in args.size.lower().split('x'))
+    app = application()
+    pixels = width * height
+    print(f"{width}x{height}, fastest of {args.repeat} runs")
+
+    def report(name: str, ms: float, area: int, other: str = None, other_ms: float = None):
+        line = f"  {name:<28} {ms:8.2f} ms  {area / ms / 1000:8.0f} Mpx/s"
+        if other is not None:
+            line += f"   {other} {other_ms:.2f} ms ({other_ms / ms:.1f}x as long)"
+        print(line, flush=True)
+
+    image = test_image(width, height, BACKGROUND)
+    colors = [BACKGROUND, RECOLORED]
+
+    def numpy_recolor():
+        recolor_image(image, colors[0], colors[1])
+        colors.reverse()
+
+    def painter_recolor():
+        qt_recolor(image, colors[0], colors[1])
+        colors.reverse()
+    report("recolor numpy", timed(numpy_recolor, args.repeat), pixels, "qpainter mask", timed(painter_recolor, args.repeat))
+
+    run, tiles = history_recolor(width, height)
+    report(f"history recolor ({tiles} tiles)", timed(run, args.repeat), pixels)
+
+    clear_rect = QRect(width // 8, height // 8, width * 3 // 4, height * 3 // 4)
+    clear_area = clear_rect.width() * clear_rect.height()
+    report("clear qpainter", timed(lambda: qt_clear(image, clear_rect, BACKGROUND), args.repeat), clear_area,
+           "numpy", timed(lambda: numpy_clear(image, clear_rect, BACKGROUND), args.repeat))
+
+    target = test_image(width, height, BACKGROUND)
+    layer = test_image(width, height, QColor(Qt.transparent))
+    report("composite qpainter", timed(lambda: qt_composite(target, layer), args.repeat), pixels,
+           "numpy", timed(lambda: numpy_composite(target, layer), args.repeat))
+
+    # The canvas composite is opaque and kept as RGB32
+    composite = target.convertToFormat(QImage.Format_RGB32)
+    screen = QImage(width, height, QImage.Format_RGB32)
+    rect = DIRTY_RECT.intersected(composite.rect())
+    report(f"present {rect.width()}x{rect.height()} dirty", timed(lambda: qt_present(screen, composite, rect), args.repeat),
+           rect.width() * rect.height(), "whole frame", timed(lambda: qt_present(screen, composite, composite.rect()), args.repeat))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""NumPy kernels on the pixels of 32-bit QImages, which are viewed in place without copying.
+
+Canvas layers are premultiplied ARGB32 images, so a pixel is one uint32 and the kernels
+work on (height, width) uint32 arrays. Like floodFill.py this module loads NumPy, so it
+is only imported when a kernel is first needed.
+"""
+import numpy as np
+from PyQt5.QtGui import QColor, QImage
+
+def image_array(image: QImage) -> np.ndarray:
+    """Returns a read-only (height, width) uint32 view of the pixels of a 32-bit image, without copying."""
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    return np.frombuffer(bits, np.uint32).reshape(image.height(), image.bytesPerLine() // 4)[:, :image.width()]
+
+def pixel_array(image: QImage) -> np.ndarray:
+    """Returns a writable (height, width) uint32 view of the pixels of a 32-bit image, without copying.
+
+    Taking it detaches image from any copies that share its pixels. The view is only valid
+    while image is alive and is not reassigned or painted into a different size."""
+    bits = image.bits()
+    bits.setsize(image.sizeInBytes())
+    return np.frombuffer(bits, np.uint32).reshape(image.height(), image.bytesPerLine() // 4)[:, :image.width()]
+
+def premultiplied(color) -> int:
+    """Returns a QColor or ARGB value as the premultiplied ARGB value of its pixels."""
+    argb = QColor(color).rgba() if isinstance(color, QColor) else color
+    alpha = argb >> 24
+    return (alpha << 24) | sum(((argb >> shift) & 0xff) * alpha // 255 << shift for shift in (0, 8, 16))
+
+def recolor(pixels: np.ndarray, old: int, new: int) -> bool:
+    """Sets the pixels that are exactly old to new, both premultiplied ARGB. Returns whether any were."""
+    mask = pixels == np.uint32(old)
+    if not mask.any():
+        return False
+    np.copyto(pixels, np.uint32(new), where=mask)
+    return True
+
+def recolor_image(image: QImage, old: QColor, new: QColor) -> bool:
+    """Recolors a premultiplied 32-bit image in place, see recolor()."""
+    return recolor(pixel_array(image), premultiplied(old), premultiplied(new))
+
+def recolor_bytes(data: bytes, old: QColor, new: QColor) -> bytes:
+    """Returns raw premultiplied ARGB32 pixel data with the old pixels set to new, or data itself if none were."""
+    pixels = np.frombuffer(data, np.uint32).copy()
+    return pixels.tobytes() if recolor(pixels, premultiplied(old), premultiplied(new)) else data
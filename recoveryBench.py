@@ -0,0 +1,93 @@
+"""Recovery benchmark: time to rebuild a page from its autosave snapshot and journal.
+
+Draws strokes on a canvas journaled by an AutosaveJournal, flushing after every stroke so
+each one adds its dirty tiles to the journal, and leaves the session behind as a crash
+would. recover_session() is then timed for journals of increasing length. Compaction is
+turned off, so the journal grows as long as asked; in the application it is compacted
+into a new snapshot once it passes 32 MiB.
+
+    python recoveryBench.py
+    python recoveryBench.py --size 7680x4320 --flushes 0 100 1000
+"""
+import argparse
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from PyQt5.QtGui import QColor
+
+from headless import application
+
+FLUSHES = (0, 10, 50, 200, 1000)
+REPEAT = 3  # Recoveries timed per journal, the fastest counts
+
+def write_session(root: str, width: int, height: int, flushes: int) -> str:
+    """Journals flushes strokes on a width x height canvas and returns the session directory."""
+    from autosave import AutosaveJournal
+    from canvasObjects import JCanvas
+    from strokeModel import Stroke
+    canvas = JCanvas(width, height, '#1c1c1c')
+    journal = AutosaveJournal(root, interval=24 * 3600 * 1000, compact_size=2 ** 62)
+    journal.attach(canvas, snapshot=True)
+    for k in range(flushes):
+        stroke = Stroke("pen", QColor.fromHsv(k * 37 % 360, 160, 255), 4 + k % 12, layer=0)
+        x, y = k * 7919 % width, k * 104729 % height
+        for i in range(60):
+            stroke.add_point(x + i * 8, y + 60 * math.sin(i / 8 + k), 0.4 + 0.6 * abs(math.sin(i / 20)))
+        canvas.apply_strokes(added=[stroke])
+        canvas.paint_stroke(stroke)
+        journal.flush()
+    journal.close(discard=False)
+    canvas.deleteLater()
+    return journal.directory
+
+def journal_records(directory: str) -> tuple:
+    """Returns the number of records and the bytes in the journals of a session."""
+    from autosave import JOURNAL_HEADER, RECORD_HEADER, session_pages
+    records = size = 0
+    for page in session_pages(directory):
+        with open(os.path.join(page, 'journal.bin'), 'rb') as file:
+            data = file.read()
+        size += len(data)
+        offset = JOURNAL_HEADER.size
+        while offset + RECORD_HEADER.size <= len(data):
+            offset += RECORD_HEADER.size + RECORD_HEADER.unpack_from(data, offset)[4]
+            records += 1
+    return records, size
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measures autosave recovery time against journal length.")
+    parser.add_argument('--size', default='3840x2160', help="Canvas size, WIDTHxHEIGHT")
+    parser.add_argument('--flushes', type=int, nargs='+', default=FLUSHES, help="Journal lengths, in flushes of one stroke each")
+    args = parser.parse_args(argv)
+    width, height = (int(value) for value in args.size.lower().split('x'))
+
+    app = application()
+    from autosave import recover_session
+    root = tempfile.mkdtemp(prefix='blackboard-recovery-')
+    try:
+        print(f"canvas {width}x{height}")
+        for flushes in args.flushes:
+            directory = write_session(root, width, height, flushes)
+            app.processEvents()
+            records, size = journal_records(directory)
+            times = []
+            for _ in range(REPEAT):
+                start = time.perf_counter()
+                pages = recover_session(directory)
+                times.append(time.perf_counter() - start)
+            if len(pages) != 1:
+                print(f"  {flushes} flushes: the page was not recovered")
+                return 1
+            print(f"  {flushes:6d} flushes  {records:7d} records  journal {size / 1024 / 1024:8.2f} MiB  "
+                  f"recovery {min(times) * 1000:8.1f} ms", flush=True)
+            shutil.rmtree(directory, ignore_errors=True)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+"""Headless replay benchmark for the drawing path.
+
+Replays recorded input sessions (see inputSession.py) against a JCanvas on the offscreen Qt
+platform and reports latency percentiles and memory for each. Without session files the
+built-in scenarios run: long pen strokes, pressure strokes, shape drags, rapid undo/redo,
+saving a large canvas, one 10k-sample stroke across canvases of growing size, whose
+per-sample latency should not grow with the canvas, and 10k tablet samples at rates from
+240 to 1000 Hz on an 8K canvas. Every scenario runs in a fresh process, so its peak memory is its own.
+
+Each input event is followed by a pass of the event loop, which flushes the queued stroke
+samples and repaints like an idle application would, so replay.input is the time from an
+event to its drawn frame. With --frame-ms the input events of every frame are posted together
+instead, the way a busy GUI thread finds them, and replay.frame is the time from a frame's
+events to its drawn ink; coalesced tablet samples keep it about the same at any sample rate.
+Results written with --out can be passed back as --baseline to flag slowdowns and memory growth.
+
+    python replayBench.py --out baseline.json
+    python replayBench.py --baseline baseline.json --repeat 3
+    BLACKBOARD_RECORD=session.json python blackboard.py
+    python replayBench.py session.json --baseline baseline.json
+    python replayBench.py --scenario tablet-240hz --scenario tablet-1000hz --frame-ms 16
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PyQt5.QtCore import QCoreApplication, QEventLoop, QT_VERSION_STR
+
+from canvasMetrics import metrics
+from headless import application
+from inputSession import MOUSE_KINDS, TABLET_KINDS, input_event, load_session, new_session
+
+RESULTS_VERSION = 1
+VIEWPORT = (3840, 2160)  # Size of the scroll area the canvas is shown in, a 4K screen
+MOUSE_RATE = 125  # Events per second of the built-in mouse strokes
+TABLET_RATE = 240
+TABLET_SPEED = 1500  # Canvas pixels per second the pen of the tablet rate scenarios moves
+KEY_REPEAT = 30  # Milliseconds between the built-in undo and redo presses
+THRESHOLD = 0.2  # Slowdown against the baseline that counts as a regression
+NOISE_FLOOR_MS = 0.5  # Smaller latency differences never count
+NOISE_FLOOR_MB = 16  # Smaller memory differences never count
+COMPARED = ("p50_ms", "p95_ms")
+
+class SessionBuilder:
+    """Writes a scripted session with timestamps as a real one would have them."""
+    def __init__(self, width: int, height: int, color: str = '#1c1c1c'):
+        self.session = new_session(width, height, color)
+        self.time = 0.0
+
+    def add(self, kind: str, *args, gap: float = 0.0):
+        self.time += gap
+        self.session["events"].append([round(self.time, 2), kind, *args])
+
+    def stroke(self, points: list, rate: int = MOUSE_RATE, tablet: bool = False):
+        """points are (x, y) for the mouse or (x, y, pressure) for the tablet."""
+        prefix = "tablet_" if tablet else ""
+        self.add(prefix + "press", *points[0], gap=300)
+        for point in points[1:]:
+            self.add(prefix + "move", *point, gap=1000 / rate)
+        self.add(prefix + "release", *points[-1], gap=1000 / rate)
+
+def pen_strokes() -> dict:
+    builder = SessionBuilder(3840, 2160)
+    builder.add("tool", "pen")
+    builder.add("width", 6)
+    for k in range(12):
+        builder.stroke([(200 + i * 2.8, 150 + k * 160 + 60 * math.sin(i / 40 + k)) for i in range(1200)])
+    return builder.session
+
+def tablet_strokes() -> dict:
+    builder = SessionBuilder(3840, 2160)
+    builder.add("tool", "pen")
+    builder.add("width", 12)
+    for k in range(12):
+        builder.stroke([(200 + i * 1.4, 150 + k * 160 + 40 * math.sin(i / 30), 0.2 + 0.8 * abs(math.sin(i / 90 + k)))
+                        for i in range(2400)], TABLET_RATE, tablet=True)
+    return builder.session
+
+def long_stroke(width: int, height: int):
+    """Returns a scenario of a single 10k-sample pen stroke zigzagging across a width x height canvas."""
+    def build() -> dict:
+        builder = SessionBuilder(width, height)
+        builder.add("tool", "pen")
+        builder.add("width", 8)
+        builder.stroke([(width * (0.05 + 0.9 * i / 10000), height * (0.5 + 0.4 * math.sin(i / 400))) for i in range(10000)])
+        return builder.session
+    return build
+
+def tablet_rate(rate: int):
+    """Returns a scenario of 10k pressure samples from a pen sampling at rate Hz on an 8K canvas.
+    The pen moves at the same speed at every rate, faster pens only send more samples."""
+    def build() -> dict:
+        builder = SessionBuilder(7680, 4320)
+        builder.add("tool", "pen")
+        builder.add("width", 12)
+        step = TABLET_SPEED / rate
+        for k in range(5):
+            builder.stroke([(400 + (i * step) % 6800, 400 + k * 800 + 300 * math.sin(i * step / 500),
+                             0.2 + 0.8 * abs(math.sin(i / rate * 3 + k))) for i in range(2000)], rate, tablet=True)
+        return builder.session
+    return build
+
+def shape_drags() -> dict:
+    builder = SessionBuilder(3840, 2160)
+    builder.add("width", 4)
+    for k in range(48):
+        builder.add("tool", ("rectangle", "ellipse", "line")[k % 3])
+        x, y = 100 + (k % 8) * 450, 100 + (k // 8) * 340
+        builder.stroke([(x + i * 6, y + i * 4) for i in range(61)])
+    return builder.session
+
+def undo_redo() -> dict:
+    builder = SessionBuilder(2560, 1440)
+    builder.add("tool", "pen")
+    builder.add("width", 8)
+    for k in range(40):
+        builder.stroke([(100 + i * 11, 60 + k * 34 + 20 * math.sin(i / 9)) for i in range(200)])
+    for _ in range(4):
+        for kind in ("undo", "redo"):
+            for _ in range(40):
+                builder.add(kind, gap=KEY_REPEAT)
+    return builder.session
+
+def save_large() -> dict:
+    builder = SessionBuilder(7680, 4320)
+    builder.add("tool", "pen")
+    builder.add("width", 12)
+    for k in range(16):
+        builder.stroke([(200 + i * 18, 200 + k * 250 + 120 * math.sin(i / 25)) for i in range(400)])
+    for _ in range(2):
+        builder.add("save", ".png", gap=500)
+        builder.add("save", ".bboard", gap=500)
+        builder.stroke([(400 + i * 10, 4000 - i * 5) for i in range(300)])
+    return builder.session
+
+SCENARIOS = {
+    "pen-strokes": pen_strokes,
+    "tablet-strokes": tablet_strokes,
+    "shape-drags": shape_drags,
+    "undo-redo": undo_redo,
+    "save-large": save_large,
+    "long-stroke-4k": long_stroke(3840, 2160),
+    "long-stroke-8k": long_stroke(7680, 4320),
+    "long-stroke-16k": long_stroke(15360, 8640),
+    "tablet-240hz": tablet_rate(240),
+    "tablet-500hz": tablet_rate(500),
+    "tablet-1000hz": tablet_rate(1000),
+}
+
+def peak_rss() -> int:
+    """Returns the peak resident memory of this process in bytes, or 0 where it is not available."""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def frames(events: list, frame_ms: float) -> list:
+    """Returns the events in steps to replay together: the input events that fall into the same
+    frame_ms window, or every event on its own if frame_ms is 0."""
+    steps, last = [], None  # Window of the input events in the last step
+    for event in events:
+        window = None
+        if frame_ms and (event[1] in MOUSE_KINDS or event[1] in TABLET_KINDS):
+            window = int(event[0] // frame_ms)
+        if window is not None and window == last:
+            steps[-1].append(event)
+        else:
+            steps.append([event])
+        last = window
+    return steps
+
+def replay(session: dict, realtime: bool = False, frame_ms: float = 0) -> dict:
+    """Replays session on a new canvas and returns its stage statistics and memory use.
+
+    Events are replayed back to back unless realtime is set, then they keep their recorded
+    timing. With frame_ms the input events of every frame_ms window are posted together."""
+    app = application()
+    from canvasObjects import JCanvas, JCanvasContainer
+    directory = tempfile.mkdtemp(prefix='blackboard-replay-')
+    saves = 0
+
+    def new_canvas(width: int, height: int, color: str):
+        canvas = JCanvas(width, height, color)
+        canvas.set_pen_color('#ffffff' if canvas.color.getHsl()[2] < 128 else '#000000')
+        return canvas
+
+    canvas = new_canvas(*session["canvas"])
+    container = JCanvasContainer(canvas)
+    container.resize(*VIEWPORT)
+    container.show()
+    app.processEvents()
+    metrics.enabled = True
+    metrics.reset()
+    rss_start = peak_rss()
+    start = time.perf_counter()
+    try:
+        for step in frames(session["events"], frame_ms):
+            at, kind, *args = step[0]
+            if realtime:
+                # A frame is handled once its last event has arrived
+                while time.perf_counter() - start < step[-1][0] / 1000:
+                    app.processEvents(QEventLoop.AllEvents, 1)
+            begin = time.perf_counter()
+            if frame_ms and (kind in MOUSE_KINDS or kind in TABLET_KINDS):
+                for _, kind, *args in step:
+                    QCoreApplication.postEvent(canvas, input_event(kind, *args))
+                app.processEvents()
+                while canvas.pending_samples:
+                    app.processEvents()  # The samples are drawn by a timer that may wait for the next pass
+                metrics.record("replay.frame", time.perf_counter() - begin)
+                metrics.count("replay.frame_events", len(step))
+            elif kind in MOUSE_KINDS or kind in TABLET_KINDS:
+                QCoreApplication.sendEvent(canvas, input_event(kind, *args))
+                app.processEvents()
+                metrics.record("replay.input", time.perf_counter() - begin)
+            elif kind in ("undo", "redo"):
+                getattr(canvas, kind)()
+                app.processEvents()
+                metrics.record("replay." + kind, time.perf_counter() - begin)
+            elif kind == "save":
+                saves += 1
+                canvas.save(os.path.join(directory, f"replay-{saves}{args[0]}"), "blackboard")
+                metrics.record("replay.save", time.perf_counter() - begin)
+                while canvas.is_saving():
+                    app.processEvents(QEventLoop.WaitForMoreEvents)
+                metrics.record("replay.save_written", time.perf_counter() - begin)
+            elif kind == "tool":
+                canvas.set_tool(args[0])
+            elif kind == "width":
+                canvas.set_tool_width(args[0])
+            elif kind == "color":
+                canvas.set_pen_color(args[0])
+            elif kind == "layer":
+                canvas.set_active_layer(args[0])
+            elif kind == "canvas":
+                canvas = new_canvas(*args)
+                container.set_canvas(canvas)
+                app.processEvents()
+            else:
+                raise ValueError(f"unknown session event {kind}")
+        seconds = time.perf_counter() - start
+        summary = metrics.summary()
+        return {
+            "events": len(session["events"]),
+            "seconds": seconds,
+            "stages": summary["stages"],
+            "counters": summary["counters"],
+            "memory": {
+                "peak_rss_mb": peak_rss() / 1024 / 1024,
+                "peak_growth_mb": (peak_rss() - rss_start) / 1024 / 1024,
+                "history_mb": canvas.history.memory_usage() / 1024 / 1024,
+                "strokes_mb": canvas.strokes.nbytes() / 1024 / 1024,
+            },
+        }
+    finally:
+        metrics.enabled = False
+        container.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def run_isolated(session: dict, realtime: bool = False, frame_ms: float = 0) -> dict:
+    """Replays session in a fresh process."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(replay, session, realtime, frame_ms).result()
+
+def compare(result: dict, baseline: dict, threshold: float = THRESHOLD) -> list:
+    """Returns a line for every stage percentile or memory figure that regressed against baseline."""
+    regressions = []
+    for name, stats in result["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            continue
+        for key in COMPARED:
+            if stats[key] > before[key] * (1 + threshold) and stats[key] - before[key] > NOISE_FLOOR_MS:
+                regressions.append(f"{name} {key} {before[key]:.2f} -> {stats[key]:.2f} ms")
+    before, after = baseline["memory"]["peak_growth_mb"], result["memory"]["peak_growth_mb"]
+    if after > before * (1 + threshold) and after - before > NOISE_FLOOR_MB:
+        regressions.append(f"peak memory growth {before:.0f} -> {after:.0f} MB")
+    return regressions
+
+def report(name: str, result: dict, baseline: dict = None, out=sys.stdout):
+    print(f"{name}: {result['events']} events in {result['seconds']:.2f} s", file=out)
+    for stage, stats in result["stages"].items():
+        line = (f"  {stage:<20} {stats['count']:6d}  p50 {stats['p50_ms']:8.2f}  p95 {stats['p95_ms']:8.2f}  "
+                f"p99 {stats['p99_ms']:8.2f}  max {stats['max_ms']:8.2f} ms")
+        before = baseline["stages"].get(stage) if baseline else None
+        if before and before["p50_ms"]:
+            line += f"  p50 {(stats['p50_ms'] / before['p50_ms'] - 1) * 100:+.0f}%"
+        print(line, file=out)
+    memory = result["memory"]
+    print(f"  memory  peak {memory['peak_rss_mb']:.0f} MB, +{memory['peak_growth_mb']:.0f} MB during replay, "
+          f"history {memory['history_mb']:.1f} MB, strokes {memory['strokes_mb']:.1f} MB", file=out, flush=True)
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Replays drawing sessions headlessly and reports latency and memory.")
+    parser.add_argument('sessions', nargs='*', help="Recorded session files (defaults to the built-in scenarios)")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="Built-in scenario to run, may be repeated")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per scenario, the fastest is kept")
+    parser.add_argument('--realtime', action='store_true', help="Keep the recorded timing between events")
+    parser.add_argument('--frame-ms', type=float, default=0, help="Post the input events of every frame of this length together")
+    parser.add_argument('--out', help="Write the results as JSON, for use as a baseline")
+    parser.add_argument('--baseline', help="Results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help="Slowdown that counts as a regression, 0.2 is 20%%")
+    parser.add_argument('--write-sessions', metavar='DIR', help="Write the built-in scenarios as session files and exit")
+    args = parser.parse_args(argv)
+
+    if args.write_sessions:
+        from inputSession import write_session
+        os.makedirs(args.write_sessions, exist_ok=True)
+        for name, build in SCENARIOS.items():
+            write_session(build(), os.path.join(args.write_sessions, name + '.json'))
+        return 0
+
+    if args.sessions:
+        sessions = {os.path.splitext(os.path.basename(path))[0]: (lambda path=path: load_session(path)) for path in args.sessions}
+    else:
+        sessions = {name: SCENARIOS[name] for name in (args.scenario or SCENARIOS)}
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)["scenarios"]
+
+    results, regressions = {}, []
+    for name, build in sessions.items():
+        session = build()
+        runs = [run_isolated(session, args.realtime, args.frame_ms) for _ in range(max(1, args.repeat))]
+        result = results[name] = min(runs, key=lambda run: run["seconds"])
+        report(name, result, baseline.get(name))
+        if name in baseline:
+            regressions += [f"{name}: {line}" for line in compare(result, baseline[name], args.threshold)]
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as file:
+            json.dump({
+                "version": RESULTS_VERSION,
+                "python": platform.python_version(),
+                "qt": QT_VERSION_STR,
+                "machine": platform.machine(),
+                "scenarios": results,
+            }, file, indent=2)
+    for line in regressions:
+        print("REGRESSION " + line)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Startup benchmark: time from launching Blackboard to its first painted canvas.
+
+Launches the source build (python blackboard.py) and optionally a frozen one, such as the
+Nuitka --onefile binary from build-linux.sh, a number of times with BLACKBOARD_STARTUP_TRACE
+set. That makes the window print a line and close itself once the canvas is painted for the
+first time; the wall time from launch to that line is the time to first paint, including
+interpreter startup and onefile unpacking. Runs use the offscreen platform and an empty
+data directory, so no display is needed and no autosave recovery prompt can block them.
+
+    python startupBench.py --runs 10
+    python startupBench.py --frozen dist/blackboard.bin --runs 10 --imports
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from PyQt5.QtCore import QEvent, QObject, QTimer
+
+MARKER = "first-paint"
+
+class FirstPaintProbe(QObject):
+    """Prints MARKER and closes window once its canvas has been painted for the first time."""
+    def __init__(self, window):
+        super().__init__(window)
+        self.window = window
+        window.canvas.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint:
+            watched.removeEventFilter(self)
+            # Reported once the paint event is handled
+            QTimer.singleShot(0, self.report)
+        return False
+
+    def report(self):
+        print(MARKER, flush=True)
+        self.window.close()
+
+def launch(command: list, environment: dict, timeout: float = 60) -> float:
+    """Runs command until it prints MARKER and returns the seconds that took."""
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    painted = []
+
+    def watch():
+        for line in process.stdout:
+            if line.strip() == MARKER:
+                painted.append(time.perf_counter() - start)
+
+    reader = threading.Thread(target=watch, daemon=True)
+    reader.start()
+    reader.join(timeout)
+    if not painted:
+        process.kill()
+        raise RuntimeError(f"{command[-1]} did not paint within {timeout} s: {process.stderr.read()[-2000:]}")
+    try:
+        process.wait(10)  # Closing the window ends the process
+    except subprocess.TimeoutExpired:
+        process.kill()
+    return painted[0]
+
+def slowest_imports(environment: dict, count: int = 12) -> list:
+    """Returns (milliseconds, module) of the slowest modules imported by the source build, slowest first."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import sys; sys.path.insert(0, {directory!r}); import blackboard"],
+                            env=environment, capture_output=True, text=True, timeout=60)
+    imports, children = [], []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # A module is listed after everything it imports, one level less indented
+        if not name.startswith('  '):
+            if name.strip() == 'blackboard':
+                imports = children
+            children = []
+        elif not name.startswith('    '):
+            children.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measures Blackboard's time to first paint.")
+    parser.add_argument('--runs', type=int, default=5, help="Launches per build")
+    parser.add_argument('--frozen', metavar='EXECUTABLE', help="Frozen build to measure as well")
+    parser.add_argument('--skip-source', action='store_true', help="Only measure the frozen build")
+    parser.add_argument('--imports', action='store_true', help="List the slowest imports of the source build")
+    parser.add_argument('--display', action='store_true', help="Use the default Qt platform instead of offscreen")
+    args = parser.parse_args(argv)
+
+    data = tempfile.mkdtemp(prefix='blackboard-startup-')
+    environment = {**os.environ, 'BLACKBOARD_STARTUP_TRACE': '1', 'XDG_DATA_HOME': data}
+    environment.pop('BLACKBOARD_RECORD', None)
+    if not args.display:
+        environment['QT_QPA_PLATFORM'] = 'offscreen'
+    builds = []
+    if not args.skip_source:
+        builds.append(('source', [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blackboard.py')]))
+    if args.frozen:
+        builds.append(('frozen', [os.path.abspath(args.frozen)]))
+    if not builds:
+        parser.error("nothing to measure")
+
+    for name, command in builds:
+        launch(command, environment)  # Warms the file cache, the first launch after a build is an outlier
+        times = [launch(command, environment) * 1000 for _ in range(max(1, args.runs))]
+        print(f"{name}: first paint after {statistics.median(times):.0f} ms median, "
+              f"{min(times):.0f} ms min, {max(times):.0f} ms max over {len(times)} runs", flush=True)
+    if args.imports and not args.skip_source:
+        print("slowest imports of blackboard.py:")
+        for milliseconds, module in slowest_imports(environment):
+            print(f"  {milliseconds:7.1f} ms  {module}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
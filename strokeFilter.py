@@ -0,0 +1,148 @@
+import math
+import time
+
+# Default input processing per tool, JCanvas copies these so they can be tuned at runtime
+FILTER_PRESETS = {
+    "pen": {"min_distance": 1.5, "max_distance": 16.0, "min_angle": 6.0, "tolerance": 0.75, "smoothing": "catmull-rom", "one_euro": False},
+    "eraser": {"min_distance": 2.0, "max_distance": 24.0, "min_angle": 12.0, "tolerance": 1.0, "smoothing": None, "one_euro": False},
+}
+
+def catmull_rom_controls(p0: tuple, p1: tuple, p2: tuple, p3: tuple) -> tuple:
+    """Returns the two cubic Bezier control points of the Catmull-Rom segment from p1 to p2."""
+    return (
+        (p1[0] + (p2[0] - p0[0]) / 6, p1[1] + (p2[1] - p0[1]) / 6),
+        (p2[0] - (p3[0] - p1[0]) / 6, p2[1] - (p3[1] - p1[1]) / 6),
+    )
+
+class OneEuroFilter:
+    """Speed-adaptive low-pass filter for one coordinate, see Casiez et al., CHI 2012."""
+    def __init__(self, min_cutoff: float = 1.0, beta: float = 0.02, d_cutoff: float = 1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.value = None
+        self.speed = 0.0
+        self.time = None
+
+    def __call__(self, value: float, t: float) -> float:
+        if self.value is None:
+            self.value, self.time = value, t
+            return value
+        dt = max(t - self.time, 1e-4)
+        self.time = t
+        speed = (value - self.value) / dt
+        self.speed += self._alpha(self.d_cutoff, dt) * (speed - self.speed)
+        cutoff = self.min_cutoff + self.beta * abs(self.speed)
+        self.value += self._alpha(cutoff, dt) * (value - self.value)
+        return self.value
+
+    @staticmethod
+    def _alpha(cutoff: float, dt: float) -> float:
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+class StrokeFilter:
+    """Streaming decimation and smoothing of pen samples.
+
+    Samples closer than min_distance to the last kept point are dropped, and samples that
+    continue in the same direction extend the pending point instead of adding one, up to
+    max_distance. A sample continues the direction if, seen from the last kept point, it is
+    within min_angle degrees of the pending point, or the pending point lies within
+    tolerance pixels of the chord to it, which absorbs jitter close to the kept point. Kept points are emitted as segments
+    (x1, y1, cx1, cy1, cx2, cy2, x2, y2, pressure): Catmull-Rom splines converted to cubic
+    Beziers, or straight lines with the control points on the ends when smoothing is None.
+    Splines need one kept point of lookahead, finish() emits what is still held back."""
+    def __init__(self, min_distance: float = 1.5, max_distance: float = 16.0, min_angle: float = 6.0, tolerance: float = 0.75,
+                 smoothing: str = "catmull-rom", one_euro: bool = False, min_cutoff: float = 1.0, beta: float = 0.02):
+        self.min_distance = min_distance
+        self.max_distance = max_distance
+        self.min_angle = math.radians(min_angle)
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.one_euro = one_euro
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.kept = []  # Kept points still needed as spline context
+        self.candidate = None
+        self.filters = None
+        self.points_in = 0  # Samples fed in since begin()
+        self.points_out = 0  # Points kept since begin()
+
+    def begin(self, x: float, y: float, pressure: float = 1.0, t: float = None):
+        """Starts a new stroke at the given point."""
+        self.kept = [(x, y, pressure)]
+        self.candidate = None
+        self.filters = (OneEuroFilter(self.min_cutoff, self.beta), OneEuroFilter(self.min_cutoff, self.beta))
+        if self.one_euro:
+            t = time.monotonic() if t is None else t
+            self.filters[0](x, t)
+            self.filters[1](y, t)
+        self.points_in = self.points_out = 1
+
+    def push(self, x: float, y: float, pressure: float = 1.0, t: float = None) -> list:
+        """Feeds one sample and returns the segments that became final."""
+        self.points_in += 1
+        if self.one_euro:
+            t = time.monotonic() if t is None else t
+            x, y = self.filters[0](x, t), self.filters[1](y, t)
+        point = (x, y, pressure)
+        last = self.kept[-1]
+        candidate = self.candidate
+        if candidate is None or _distance(last, candidate) < self.min_distance:
+            self.candidate = point
+            return []
+        if _distance(last, point) <= self.max_distance and (
+                _spread(last, candidate, point) < self.min_angle or _deviation(last, point, candidate) < self.tolerance):
+            self.candidate = point
+            return []
+        self.candidate = point
+        return self._keep(candidate)
+
+    def finish(self) -> list:
+        """Ends the stroke and returns the remaining segments."""
+        segments = []
+        if self.candidate is not None and _distance(self.kept[-1], self.candidate) > 0:
+            segments += self._keep(self.candidate)
+        self.candidate = None
+        if self.smoothing == "catmull-rom" and len(self.kept) >= 2:
+            # The last segment has no lookahead, so its end point doubles as the next one
+            segments.append(self._segment(-2, -1, -1))
+        return segments
+
+    def _keep(self, point: tuple) -> list:
+        self.kept.append(point)
+        self.points_out += 1
+        if self.smoothing != "catmull-rom":
+            return [self._segment(-2, -1, -1, straight=True)]
+        if len(self.kept) < 3:
+            return []
+        segment = self._segment(-3, -2, -1)
+        del self.kept[:-3]  # Only the lookahead window is needed
+        return [segment]
+
+    def _segment(self, start: int, end: int, after: int, straight: bool = False) -> tuple:
+        p1, p2, p3 = self.kept[start], self.kept[end], self.kept[after]
+        if straight:
+            c1, c2 = p1, p2
+        else:
+            p0 = self.kept[start - 1] if len(self.kept) >= -start + 1 else p1
+            c1, c2 = catmull_rom_controls(p0, p1, p2, p3)
+        return (p1[0], p1[1], c1[0], c1[1], c2[0], c2[1], p2[0], p2[1], p2[2])
+
+def _distance(a: tuple, b: tuple) -> float:
+    return math.hypot(b[0] - a[0], b[1] - a[1])
+
+def _spread(a: tuple, b: tuple, c: tuple) -> float:
+    """Returns the angle at a, in radians, between the directions to b and to c."""
+    ux, uy = b[0] - a[0], b[1] - a[1]
+    vx, vy = c[0] - a[0], c[1] - a[1]
+    if (ux == 0 and uy == 0) or (vx == 0 and vy == 0):
+        return 0.0
+    return abs(math.atan2(ux * vy - uy * vx, ux * vx + uy * vy))
+
+def _deviation(a: tuple, b: tuple, p: tuple) -> float:
+    """Returns the distance of p from the line through a and b."""
+    length = _distance(a, b)
+    if length == 0:
+        return _distance(a, p)
+    return abs((b[0] - a[0]) * (a[1] - p[1]) - (a[0] - p[0]) * (b[1] - a[1])) / length
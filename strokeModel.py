@@ -0,0 +1,338 @@
+import math
+from array import array
+from collections import OrderedDict
+from PyQt5.QtCore import Qt, QRect, QRectF, QPointF
+from PyQt5.QtGui import QColor, QImage, QPainter, QPainterPath, QPen, QTransform
+
+from strokeFilter import catmull_rom_controls
+from strokeOutline import StrokeOutline
+
+SHAPE_TOOLS = ("rectangle", "ellipse", "line")
+
+class Stroke:
+    """A pen, eraser or shape stroke kept as vector data.
+
+    Points are stored in flat float arrays with one pressure value per point. Shapes keep
+    their start and end point. The width is the tool width at pressure 1.0. Smooth strokes
+    are drawn as a Catmull-Rom spline through their points instead of a polyline. layer is
+    the index of the canvas layer the stroke was drawn on."""
+    __slots__ = ('id', 'tool', 'color', 'width', 'smooth', 'layer', 'xs', 'ys', 'pressures', '_bounds')
+
+    def __init__(self, tool: str, color: QColor, width: float, smooth: bool = False, layer: int = 0):
+        self.id = None  # Assigned by the StrokeStore, doubles as the z-order
+        self.tool = tool
+        self.color = QColor(color).rgba()
+        self.width = float(width)
+        self.smooth = smooth
+        self.layer = layer
+        self.xs = array('f')
+        self.ys = array('f')
+        self.pressures = array('f')
+        self._bounds = None
+
+    def __len__(self):
+        return len(self.xs)
+
+    def add_point(self, x: float, y: float, pressure: float = 1.0):
+        self.xs.append(x)
+        self.ys.append(y)
+        self.pressures.append(pressure)
+        self._bounds = None
+
+    def pen_width(self, pressure: float = 1.0) -> float:
+        width = self.width * pressure
+        return width * 1.5 if self.tool == "eraser" else width
+
+    def segment_bounds(self, index: int) -> QRectF:
+        """Returns the area covered by the segment ending at point index.
+
+        For smooth strokes this includes the segment before it, whose curve depends on the point."""
+        i = max(index - (2 if self.smooth else 1), 0)
+        xs, ys = self.xs[i:index + 1], self.ys[i:index + 1]
+        margin = self.pen_width(max(self.pressures[i:index + 1])) / 2 + 1
+        if self.smooth:
+            # Control points can overshoot the points by a sixth of the neighbouring chords
+            margin += max(max(xs) - min(xs), max(ys) - min(ys)) / 6
+        return QRectF(QPointF(min(xs), min(ys)), QPointF(max(xs), max(ys))).adjusted(-margin, -margin, margin, margin)
+
+    def bounds(self) -> QRectF:
+        if self._bounds is None:
+            if not self.xs:
+                return QRectF()
+            if self.tool in SHAPE_TOOLS:
+                margin = self.width + 1  # Miter joins can reach past the corners
+            else:
+                margin = self.pen_width(max(self.pressures)) / 2 + 1
+                if self.smooth:
+                    margin += max(max(self.xs) - min(self.xs), max(self.ys) - min(self.ys)) / 6
+            self._bounds = QRectF(QPointF(min(self.xs), min(self.ys)), QPointF(max(self.xs), max(self.ys))).adjusted(-margin, -margin, margin, margin)
+        return self._bounds
+
+    def transformed(self, transform: QTransform) -> 'Stroke':
+        """Returns a copy of the stroke mapped by transform, with the width scaled by its average scale.
+
+        Rectangles and ellipses that would no longer be axis-aligned become closed pen outlines."""
+        tool, points = self.tool, list(zip(self.xs, self.ys, self.pressures))
+        if tool in ("rectangle", "ellipse") and (transform.m12() or transform.m21()):
+            rect = QRectF(QPointF(self.xs[0], self.ys[0]), QPointF(self.xs[-1], self.ys[-1])).normalized()
+            if tool == "rectangle":
+                corners = [rect.topLeft(), rect.topRight(), rect.bottomRight(), rect.bottomLeft()]
+                points = [(p.x(), p.y(), 1.0) for p in corners + corners[:1]]
+            else:
+                center, steps = rect.center(), 64
+                points = [(center.x() + rect.width() / 2 * math.cos(2 * math.pi * i / steps),
+                           center.y() + rect.height() / 2 * math.sin(2 * math.pi * i / steps), 1.0) for i in range(steps + 1)]
+            tool = "pen"
+        stroke = Stroke(tool, QColor.fromRgba(self.color), self.width * math.sqrt(abs(transform.determinant())), self.smooth, self.layer)
+        for x, y, pressure in points:
+            mapped = transform.map(QPointF(x, y))
+            stroke.add_point(mapped.x(), mapped.y(), pressure)
+        return stroke
+
+    def nbytes(self) -> int:
+        return (self.xs.itemsize + self.ys.itemsize + self.pressures.itemsize) * len(self.xs)
+
+    def hit(self, x: float, y: float, tolerance: float = 0.0) -> bool:
+        """Returns True if the point lies on the stroke's ink."""
+        if not self.bounds().adjusted(-tolerance, -tolerance, tolerance, tolerance).contains(QPointF(x, y)):
+            return False
+        if self.tool in ("rectangle", "ellipse"):
+            reach = self.width / 2 + tolerance
+            shape = QRectF(QPointF(self.xs[0], self.ys[0]), QPointF(self.xs[-1], self.ys[-1])).normalized()
+            outer = shape.adjusted(-reach, -reach, reach, reach)
+            inner = shape.adjusted(reach, reach, -reach, -reach)
+            if self.tool == "rectangle":
+                return outer.contains(QPointF(x, y)) and not inner.contains(QPointF(x, y))
+            return _in_ellipse(outer, x, y) and not _in_ellipse(inner, x, y)
+        segments = [(i - 1, i) for i in range(1, len(self.xs))] or [(0, 0)]
+        for i, j in segments:
+            reach = self.pen_width(max(self.pressures[i], self.pressures[j])) / 2 + tolerance
+            if _segment_distance(x, y, self.xs[i], self.ys[i], self.xs[j], self.ys[j]) <= reach:
+                return True
+        return False
+
+    def render(self, painter: QPainter, start: int = 1, stop: int = None):
+        """Draws the stroke with painter. Eraser strokes erase what painter has drawn so far to transparency.
+
+        start and stop limit pen and eraser strokes to the segments ending at those point indices."""
+        if not self.xs:
+            return
+        color = QColor.fromRgba(self.color)
+        if self.tool == "eraser":
+            painter.save()
+            painter.setCompositionMode(QPainter.CompositionMode_DestinationOut)
+            painter.fillPath(self.outline(start, stop), QColor(Qt.black))
+            painter.restore()
+            return
+        if self.tool in SHAPE_TOOLS:
+            pen = QPen(color)
+            pen.setWidthF(self.width)
+            pen.setJoinStyle(Qt.MiterJoin)
+            painter.setPen(pen)
+            painter.setBrush(Qt.NoBrush)
+            start, end = QPointF(self.xs[0], self.ys[0]), QPointF(self.xs[-1], self.ys[-1])
+            if self.tool == "rectangle":
+                painter.drawRect(QRectF(start, end).normalized())
+            elif self.tool == "ellipse":
+                painter.drawEllipse(QRectF(start, end).normalized())
+            else:
+                painter.drawLine(start, end)
+            return
+
+        painter.fillPath(self.outline(start, stop), color)
+
+    def outline(self, start: int = 1, stop: int = None) -> QPainterPath:
+        """Returns the ink of a pen or eraser stroke as a filled outline, tapered by the pressure,
+        of only the segments ending at point indices start..stop-1 if given.
+
+        Built from the same segments as JCanvas draws while the stroke is made, see strokeOutline.py."""
+        start, stop = max(start, 1), len(self.xs) if stop is None else min(stop, len(self.xs))
+        points = list(zip(self.xs, self.ys))
+        last = len(points) - 1
+        outline = StrokeOutline(*points[start - 1], self.pen_width(self.pressures[start - 1]) / 2)
+        for i in range(start, stop):
+            radius = self.pen_width(self.pressures[i]) / 2
+            if self.smooth:
+                c1, c2 = catmull_rom_controls(points[max(i - 2, 0)], points[i - 1], points[i], points[min(i + 1, last)])
+                outline.curve_to(*c1, *c2, *points[i], radius)
+            else:
+                outline.line_to(*points[i], radius)
+        return outline.path(caps=True)
+
+class StrokeStore:
+    """Retained display list of strokes with a uniform grid index over their segments."""
+    def __init__(self, cell_size: int = 256):
+        self.cell_size = cell_size
+        self.strokes = {}  # id -> Stroke, ids double as the z-order
+        self.cells = {}  # (cx, cy) -> set of stroke ids
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self.strokes)
+
+    def __iter__(self):
+        """Iterates over all strokes, bottom-most first."""
+        return (self.strokes[i] for i in sorted(self.strokes))
+
+    def add(self, stroke: Stroke) -> Stroke:
+        """Adds a stroke, or re-adds a removed one at its original z-order."""
+        if stroke.id is None:
+            stroke.id = self._next_id
+            self._next_id += 1
+        self.strokes[stroke.id] = stroke
+        for i in range(len(stroke)):
+            self._index(stroke.id, stroke.segment_bounds(i))
+        if stroke.tool in SHAPE_TOOLS:
+            self._index(stroke.id, stroke.bounds())
+        return stroke
+
+    def add_point(self, stroke: Stroke, x: float, y: float, pressure: float = 1.0):
+        """Appends a point to a stroke already in the store and indexes the new segment."""
+        stroke.add_point(x, y, pressure)
+        if stroke.tool in SHAPE_TOOLS:
+            self._index(stroke.id, stroke.bounds())
+            return
+        # The same area add() indexes, smooth strokes included with their control point overshoot
+        self._index(stroke.id, stroke.segment_bounds(len(stroke) - 1))
+
+    def remove(self, stroke: Stroke):
+        if self.strokes.pop(stroke.id, None) is None:
+            return
+        for key in self._cells_in(stroke.bounds()):
+            ids = self.cells.get(key)
+            if ids is not None:
+                ids.discard(stroke.id)
+                if not ids:
+                    del self.cells[key]
+
+    def clear(self):
+        self.strokes.clear()
+        self.cells.clear()
+
+    def query(self, rect) -> list:
+        """Returns the strokes whose ink may overlap rect, bottom-most first."""
+        rect = QRectF(rect)
+        ids = set()
+        for key in self._cells_in(rect):
+            ids.update(self.cells.get(key, ()))
+        found = (self.strokes[i] for i in sorted(ids) if i in self.strokes)
+        return [stroke for stroke in found if stroke.bounds().intersects(rect)]
+
+    def hit_test(self, x: float, y: float, tolerance: float = 2.0, layer: int = None) -> Stroke:
+        """Returns the top-most pen or shape stroke under the point, of only that layer if given, or None.
+
+        Only the strokes in the grid cells around the point are tested."""
+        area = QRectF(x - tolerance, y - tolerance, tolerance * 2, tolerance * 2)
+        for stroke in reversed(self.query(area)):
+            if stroke.tool != "eraser" and (layer is None or stroke.layer == layer) and stroke.hit(x, y, tolerance):
+                return stroke
+        return None
+
+    def render(self, painter: QPainter, rect, layer: int = None):
+        """Draws the strokes that overlap rect, of only that layer if given, clipped to it.
+        Pen strokes are antialiased, shapes are drawn aliased as on the canvas."""
+        painter.save()
+        painter.setClipRect(QRectF(rect), Qt.IntersectClip)
+        for stroke in self.query(rect):
+            if layer is None or stroke.layer == layer:
+                painter.setRenderHint(QPainter.Antialiasing, stroke.tool not in SHAPE_TOOLS)
+                stroke.render(painter)
+        painter.restore()
+
+    def nbytes(self) -> int:
+        return sum(stroke.nbytes() for stroke in self.strokes.values())
+
+    def _index(self, stroke_id: int, rect: QRectF):
+        for key in self._cells_in(rect):
+            self.cells.setdefault(key, set()).add(stroke_id)
+
+    def _cells_in(self, rect: QRectF):
+        if rect.isEmpty():
+            return
+        size = self.cell_size
+        for cy in range(math.floor(rect.top() / size), math.floor(rect.bottom() / size) + 1):
+            for cx in range(math.floor(rect.left() / size), math.floor(rect.right() / size) + 1):
+                yield cx, cy
+
+class StrokeTileCache:
+    """Tiles of the strokes of a LayerStack's visible layers rasterized at a given scale over the
+    canvas color, invalidated by region.
+
+    Each layer's strokes are drawn on their own, so eraser strokes erase that layer to
+    transparency as they do on the canvas, and the layers are then drawn bottom first."""
+    def __init__(self, store: StrokeStore, layers, tile_size: int = 256, max_tiles: int = 256):
+        self.store = store
+        self.layers = layers
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()  # (scale, tx, ty) -> QImage, least recently used first
+
+    def tile(self, tx: int, ty: int, scale: float = 1.0) -> QImage:
+        """Returns tile (tx, ty) of the board rendered at scale, in scaled coordinates."""
+        key = (scale, tx, ty)
+        image = self.tiles.get(key)
+        if image is not None:
+            self.tiles.move_to_end(key)
+            return image
+        size = self.tile_size
+        image = QImage(size, size, QImage.Format_ARGB32_Premultiplied)
+        image.fill(self.layers.background)
+        area = QRectF(tx * size / scale, ty * size / scale, size / scale, size / scale)
+        strokes = self.store.query(area)
+        last = len(self.layers) - 1
+        buffer = None
+        for index, layer in enumerate(self.layers):
+            own = [stroke for stroke in strokes if min(stroke.layer, last) == index]
+            if not own or not layer.visible:
+                continue
+            if buffer is None:
+                buffer = QImage(size, size, QImage.Format_ARGB32_Premultiplied)
+            buffer.fill(Qt.transparent)
+            painter = QPainter(buffer)
+            painter.translate(-tx * size, -ty * size)
+            painter.scale(scale, scale)
+            painter.setClipRect(area)
+            for stroke in own:
+                painter.setRenderHint(QPainter.Antialiasing, stroke.tool not in SHAPE_TOOLS)
+                stroke.render(painter)
+            painter.end()
+            painter = QPainter(image)
+            painter.drawImage(0, 0, buffer)
+            painter.end()
+        self.tiles[key] = image
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return image
+
+    def render(self, painter: QPainter, rect: QRect, scale: float = 1.0):
+        """Draws the scaled-coordinate area rect from cached tiles."""
+        size = self.tile_size
+        for ty in range(rect.top() // size, rect.bottom() // size + 1):
+            for tx in range(rect.left() // size, rect.right() // size + 1):
+                painter.drawImage(tx * size, ty * size, self.tile(tx, ty, scale))
+
+    def invalidate(self, rect=None):
+        """Drops cached tiles overlapping rect (board coordinates), or every tile if rect is None."""
+        if rect is None:
+            self.tiles.clear()
+            return
+        rect = QRectF(rect)
+        size = self.tile_size
+        for key in [key for key in self.tiles if QRectF(key[1] * size / key[0], key[2] * size / key[0], size / key[0], size / key[0]).intersects(rect)]:
+            del self.tiles[key]
+
+    def nbytes(self) -> int:
+        return sum(image.sizeInBytes() for image in self.tiles.values())
+
+def _in_ellipse(rect: QRectF, x: float, y: float) -> bool:
+    if rect.width() <= 0 or rect.height() <= 0:
+        return False
+    dx = (x - rect.center().x()) / (rect.width() / 2)
+    dy = (y - rect.center().y()) / (rect.height() / 2)
+    return dx * dx + dy * dy <= 1.0
+
+def _segment_distance(px: float, py: float, x1: float, y1: float, x2: float, y2: float) -> float:
+    dx, dy = x2 - x1, y2 - y1
+    length = dx * dx + dy * dy
+    t = 0.0 if length == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length))
+    return math.hypot(px - (x1 + t * dx), py - (y1 + t * dy))
@@ -0,0 +1,270 @@
+"""Filled, pressure-tapered outlines of pen and eraser strokes.
+
+The ink of a stroke is the area a disc sweeps along its centre line, with the radius
+following the pressure. StrokeOutline builds the outline of that area as points are added:
+every new segment is flattened and offset once, so however long a stroke gets, adding to it
+only costs its new tail. The outline is filled, with antialiasing, instead of stroking each
+segment with a pen of its own width, which stepped the width and overdrew every joint.
+"""
+import math
+from PyQt5.QtCore import Qt, QPointF, QRect, QRectF
+from PyQt5.QtGui import QColor, QPainter, QPainterPath, QPolygonF
+
+from tiledPixmap import painter_for, put_images
+
+TOLERANCE = 0.2  # Pixels flattened curves and round joins may stray from the true outline
+MIN_RADIUS = 0.25  # Half of the thinnest line the pens drew
+CELL_SIZE = 64  # Grid of the piece index, and of the layer pixels a LiveStroke keeps
+
+class StrokeOutline:
+    """Outline of the ink of a stroke, built from its centre line one segment at a time.
+
+    The centre line is kept as a polyline with a radius per point; curves are flattened into
+    it. Each piece of the polyline stores where its left and right edges touch the discs at
+    both ends. Once the next piece is known, a turn too sharp for a straight edge gets a
+    round join on its outer side, the inner side overlaps; gentler turns share one point per
+    side. Where the centre line bends tighter than the ink is wide, the inner edge would run
+    backwards and cancel out ink under the winding rule, so the outline breaks there into
+    separate strips with a disc over the joint.
+
+    path() strings the pieces together with round caps, as polygons that all run the same
+    way round and are filled with the winding rule, so overlaps stay filled. With indexed,
+    a grid index over the pieces finds those that reach into an area."""
+    def __init__(self, x: float, y: float, radius: float, indexed: bool = False):
+        self.points = [(x, y, max(radius, MIN_RADIUS))]
+        self.left = []  # Per piece, its left edge (x, y) points and then those of the join after it
+        self.right = []
+        self.angles = []  # Per piece, (direction, angle between it and the edge touch points, length)
+        self.breaks = set()  # Pieces after which the outline breaks
+        self.bounds = []  # Per piece, the area its ink can reach, if indexed
+        self.cells = {} if indexed else None  # (cx, cy) -> piece indices reaching into that cell
+
+    def __len__(self):
+        """Returns the number of pieces."""
+        return len(self.angles)
+
+    def line_to(self, x: float, y: float, radius: float):
+        """Extends the centre line straight to (x, y), where the ink has the given radius."""
+        x0, y0, r0 = self.points[-1]
+        r1 = max(radius, MIN_RADIUS)
+        length = math.hypot(x - x0, y - y0)
+        if length < 1e-3:
+            if r1 > r0 and not self.angles:
+                self.points[-1] = (x0, y0, r1)  # Pressing harder on the spot widens the start
+            return
+        direction = math.atan2(y - y0, x - x0)
+        # Where the radii differ the edges touch the discs off the normals, spread is the angle
+        # between the direction and the touch points; it is clamped where one disc holds the other
+        spread = math.acos(max(-0.9, min(0.9, (r0 - r1) / length)))
+        cos_left, sin_left = math.cos(direction + spread), math.sin(direction + spread)
+        cos_right, sin_right = math.cos(direction - spread), math.sin(direction - spread)
+        left = [(x0 + r0 * cos_left, y0 + r0 * sin_left), (x + r1 * cos_left, y + r1 * sin_left)]
+        right = [(x0 + r0 * cos_right, y0 + r0 * sin_right), (x + r1 * cos_right, y + r1 * sin_right)]
+        if self.angles:
+            self._join(direction, spread, length, left, right)
+        self.angles.append((direction, spread, length))
+        self.left.append(left)
+        self.right.append(right)
+        self.points.append((x, y, r1))
+        if self.cells is not None:
+            rect = QRectF(QPointF(min(x0 - r0, x - r1) - 1, min(y0 - r0, y - r1) - 1),
+                          QPointF(max(x0 + r0, x + r1) + 1, max(y0 + r0, y + r1) + 1))  # 1 for antialiasing
+            for key in _cells(rect):
+                self.cells.setdefault(key, []).append(len(self.bounds))
+            self.bounds.append(rect)
+
+    def curve_to(self, cx1: float, cy1: float, cx2: float, cy2: float, x: float, y: float, radius: float):
+        """Extends the centre line along a cubic Bezier curve, the radius changing evenly along it."""
+        x0, y0, r0 = self.points[-1]
+        # A cubic strays at most 3/4 of its control points' distance from the chord, halving
+        # the step quarters that
+        chord = math.hypot(x - x0, y - y0)
+        if chord < 1e-3:
+            bend = max(math.hypot(cx1 - x0, cy1 - y0), math.hypot(cx2 - x0, cy2 - y0))
+        else:
+            bend = max(abs((x - x0) * (y0 - cy) - (x0 - cx) * (y - y0)) for cx, cy in ((cx1, cy1), (cx2, cy2))) / chord
+        steps = max(1, min(32, math.ceil(math.sqrt(0.75 * bend / TOLERANCE))))
+        for step in range(1, steps):
+            t = step / steps
+            s = 1 - t
+            a, b, c, d = s * s * s, 3 * s * s * t, 3 * s * t * t, t * t * t
+            self.line_to(a * x0 + b * cx1 + c * cx2 + d * x, a * y0 + b * cy1 + c * cy2 + d * y, r0 + (radius - r0) * t)
+        self.line_to(x, y, radius)
+
+    def path(self, first: int = 0, last: int = None, caps: bool = False) -> QPainterPath:
+        """Returns the outline of pieces first..last as a path to fill with the winding rule.
+
+        The ends of the stroke get round caps. Ends inside it only get them with caps, they
+        are cut straight across the ink otherwise."""
+        path = QPainterPath()
+        path.setFillRule(Qt.WindingFill)
+        if not self.angles:
+            _add_polygon(path, _arc(*self.points[0], 0.0, -2 * math.pi))
+            return path
+        last = len(self.angles) - 1 if last is None else last
+        start = first
+        for index in range(first, last + 1):
+            if index == last or index in self.breaks:
+                self._add_strip(path, start, index, caps and start == first, caps and index == last)
+                start = index + 1
+            if index in self.breaks and index < last:
+                _add_polygon(path, _arc(*self.points[index + 1], 0.0, -2 * math.pi))
+        return path
+
+    def pieces_in(self, rect: QRectF) -> list:
+        """Returns the sorted indices of the pieces whose ink can reach into rect, the outline must be indexed."""
+        found = set()
+        for key in _cells(rect):
+            found.update(self.cells.get(key, ()))
+        return sorted(index for index in found if self.bounds[index].intersects(rect))
+
+    def area_path(self, rect: QRectF) -> QPainterPath:
+        """Returns a path that, inside rect, covers exactly what the whole outline does.
+
+        Every run of pieces reaching into rect is taken with one more piece on either side,
+        which do not reach into it, so the cuts at the ends of the runs fall outside rect."""
+        path = QPainterPath()
+        path.setFillRule(Qt.WindingFill)
+        runs = []
+        for index in self.pieces_in(rect):
+            if runs and index <= runs[-1][1] + 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        for first, last in runs:
+            path.addPath(self.path(max(first - 1, 0), min(last + 1, len(self.angles) - 1)))
+        return path
+
+    def _add_strip(self, path: QPainterPath, first: int, last: int, start_cap: bool, end_cap: bool):
+        # Adds the outline of pieces first..last, which has no breaks, as one polygon
+        points = []
+        for index in range(first, last + 1):
+            _extend(points, self.left[index] if index < last else self.left[index][:2])
+        if end_cap or last == len(self.angles) - 1:
+            direction, spread, _ = self.angles[last]
+            x, y, r = self.points[last + 1]
+            points += _arc(x, y, r, direction + spread, -2 * spread)[1:-1]
+        for index in range(last, first - 1, -1):
+            _extend(points, (self.right[index] if index < last else self.right[index][:2])[::-1])
+        if start_cap or first == 0:
+            direction, spread, _ = self.angles[first]
+            x, y, r = self.points[first]
+            points += _arc(x, y, r, direction - spread, 2 * spread - 2 * math.pi)[1:-1]
+        _add_polygon(path, points)
+
+    def _join(self, direction: float, spread: float, length: float, left: list, right: list):
+        # Joins each edge of the last piece to that of the next, which starts with left[0]
+        # or right[0]: where it opens outward a round join fills the gap, where the ends
+        # are within the tolerance they share their middle, otherwise they overlap
+        x, y, r = self.points[-1]
+        last, last_spread, last_length = self.angles[-1]
+        turn = _wrapped(direction - last)
+        sweeps = (turn + spread - last_spread, turn - spread + last_spread)
+        # An edge overlapping by more than half the shorter piece would run backwards
+        if abs(turn) > math.pi / 2 or max(sweeps[0], -sweeps[1]) * r > min(length, last_length) / 2:
+            self.breaks.add(len(self.angles) - 1)
+            return
+        step = _step(r)
+        for edge, after, start, sweep, outward in (
+                (self.left[-1], left, last + last_spread, sweeps[0], -1),
+                (self.right[-1], right, last - last_spread, sweeps[1], 1)):
+            if sweep * outward > step:
+                edge += _arc(x, y, r, start, sweep)[1:-1]
+            elif abs(sweep) <= step:
+                edge[-1] = after[0] = ((edge[-1][0] + after[0][0]) / 2, (edge[-1][1] + after[0][1]) / 2)
+
+class LiveStroke:
+    """Paints a stroke onto a layer while it is drawn, as the filled outline of everything so far.
+
+    Filling a translucent outline again over its own ink would darken it, so the layer
+    pixels under the stroke are kept, per CELL_SIZE cell, from before the stroke first
+    reached them. A frame puts back the cells its new pieces reach and fills just the
+    outline inside them, which costs the same however long the stroke already is."""
+    def __init__(self, pixmap, color: QColor, erase: bool = False):
+        self.pixmap = pixmap  # The layer's QImage or TiledPixmap
+        self.color = QColor(color)
+        self.erase = erase
+        self.outline = None
+        self.base = {}  # (cx, cy) -> QImage of the cell before the stroke
+
+    def add(self, segments: list) -> QRect:
+        """Extends the stroke by StrokeFilter segments with the radius in place of the pressure.
+
+        Returns the area to paint, whole cells so the kept pixels are whole too."""
+        if self.outline is None:
+            x, y = segments[0][:2]
+            self.outline = StrokeOutline(x, y, segments[0][8], indexed=True)
+        first = len(self.outline)
+        for x1, y1, cx1, cy1, cx2, cy2, x2, y2, radius in segments:
+            if (cx1, cy1, cx2, cy2) == (x1, y1, x2, y2):
+                self.outline.line_to(x2, y2, radius)
+            else:
+                self.outline.curve_to(cx1, cy1, cx2, cy2, x2, y2, radius)
+        area = QRectF()
+        for rect in self.outline.bounds[first:]:
+            area = area.united(rect)
+        if not self.outline.bounds:
+            x, y, r = self.outline.points[0]
+            area = QRectF(x - r - 1, y - r - 1, 2 * r + 2, 2 * r + 2)
+        rect = QRect()
+        for key in _cells(area):
+            rect = rect.united(_cell_rect(*key))
+        return rect
+
+    def lift(self, rect: QRect) -> QRect:
+        """Takes the stroke off the kept cells that reach into rect, putting back the layer pixels
+        from before it, and forgets them, so that paint() keeps them again as they are then.
+        Returns the area of those cells, to paint once the layer was changed underneath."""
+        area = QRect()
+        images = []
+        for key in [key for key in self.base if _cell_rect(*key).intersects(rect)]:
+            images.append((_cell_rect(*key).topLeft(), self.base.pop(key)))
+            area = area.united(_cell_rect(*key))
+        put_images(self.pixmap, images)
+        return area
+
+    def paint(self, rect: QRect):
+        """Paints the stroke within rect, an area add() or lift() returned, over the layer as it was before."""
+        cells = list(_cells(QRectF(rect.topLeft(), rect.bottomRight())))
+        for key in cells:
+            if key not in self.base:
+                self.base[key] = self.pixmap.copy(_cell_rect(*key))
+        with painter_for(self.pixmap, rect) as painter:
+            painter.setClipRect(rect)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            for key in cells:
+                painter.drawImage(_cell_rect(*key).topLeft(), self.base[key])
+            painter.setCompositionMode(QPainter.CompositionMode_DestinationOut if self.erase
+                                       else QPainter.CompositionMode_SourceOver)
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.fillPath(self.outline.area_path(QRectF(rect)), QColor(Qt.black) if self.erase else self.color)
+
+def _extend(points: list, edge: list):
+    """Appends edge to points, leaving out its first point if the last piece shares it."""
+    points += edge[1:] if points and edge[0] is points[-1] else edge
+
+def _add_polygon(path: QPainterPath, points: list):
+    path.addPolygon(QPolygonF([QPointF(x, y) for x, y in points]))
+    path.closeSubpath()
+
+def _step(r: float) -> float:
+    """Returns the angle a straight line can cut off a circle of radius r while staying within the tolerance."""
+    return 2 * math.acos(1 - TOLERANCE / r) if r > TOLERANCE else math.pi
+
+def _arc(x: float, y: float, r: float, start: float, sweep: float) -> list:
+    """Returns (x, y) points on the circle around (x, y) from angle start through sweep, both ends included."""
+    steps = max(1, math.ceil(abs(sweep) / _step(r)))
+    return [(x + r * math.cos(start + sweep * k / steps), y + r * math.sin(start + sweep * k / steps))
+            for k in range(steps + 1)]
+
+def _wrapped(angle: float) -> float:
+    """Returns angle in radians wrapped into -pi..pi."""
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+def _cells(rect: QRectF):
+    for cy in range(math.floor(rect.top() / CELL_SIZE), math.floor(rect.bottom() / CELL_SIZE) + 1):
+        for cx in range(math.floor(rect.left() / CELL_SIZE), math.floor(rect.right() / CELL_SIZE) + 1):
+            yield cx, cy
+
+def _cell_rect(cx: int, cy: int) -> QRect:
+    return QRect(cx * CELL_SIZE, cy * CELL_SIZE, CELL_SIZE, CELL_SIZE)
@@ -0,0 +1,138 @@
+"""Tests for the vector stroke model: the grid index must cover every segment's ink, and hit
+tests and cached tiles must only visit the strokes near them.
+
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+import math
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from PyQt5.QtCore import QCoreApplication, QRect
+from PyQt5.QtGui import QColor, QImage, QPainter
+
+from canvasLayers import LayerStack
+from canvasObjects import JCanvas
+from headless import application
+from inputSession import input_event
+from strokeModel import Stroke, StrokeStore, StrokeTileCache
+
+BACKGROUND = '#1c1c1c'
+GRID = 100  # Strokes per row and column of the board the visit counts are taken on
+
+app = None
+
+def setUpModule():
+    global app
+    app = application()
+
+def stroke_grid() -> StrokeStore:
+    """Returns a store of GRID x GRID short pen strokes, one every 40 pixels."""
+    store = StrokeStore()
+    for row in range(GRID):
+        for column in range(GRID):
+            stroke = Stroke("pen", QColor('#ffffff'), 4, layer=1)
+            stroke.add_point(column * 40 + 5, row * 40 + 20)
+            stroke.add_point(column * 40 + 35, row * 40 + 20)
+            store.add(stroke)
+    return store
+
+def zigzag() -> list:
+    """Points with sharp turns, where a smooth stroke's curve overshoots them the most."""
+    return [(100 + 40 * i, 300 + (250 if i % 2 else -250), 0.5 + 0.5 * abs(math.sin(i))) for i in range(24)]
+
+class GridIndexTest(unittest.TestCase):
+    def test_recorded_points_index_like_whole_strokes(self):
+        for smooth in (False, True):
+            recorded, whole = StrokeStore(cell_size=64), StrokeStore(cell_size=64)
+            stroke = recorded.add(Stroke("pen", QColor('#ffffff'), 12, smooth))
+            copy = Stroke("pen", QColor('#ffffff'), 12, smooth)
+            for x, y, pressure in zigzag():
+                recorded.add_point(stroke, x, y, pressure)
+                copy.add_point(x, y, pressure)
+            whole.add(copy)
+            with self.subTest(smooth=smooth):
+                self.assertEqual(set(recorded.cells), set(whole.cells))
+
+class VisitTest(unittest.TestCase):
+    def test_hit_test_visits_only_nearby_strokes(self):
+        store = stroke_grid()
+        with mock.patch.object(Stroke, 'hit', autospec=True, side_effect=Stroke.hit) as hit:
+            found = store.hit_test(20 * 40 + 20, 30 * 40 + 21)
+            missed = store.hit_test(20 * 40 + 20, 30 * 40 + 30)
+        self.assertEqual((found.xs[0], found.ys[0]), (20 * 40 + 5, 30 * 40 + 20))
+        self.assertIsNone(missed)
+        self.assertLessEqual(hit.call_count, 10, f"{hit.call_count} of {len(store)} strokes tested")
+
+    def test_cached_tiles_render_only_nearby_strokes(self):
+        store = stroke_grid()
+        cache = StrokeTileCache(store, LayerStack(GRID * 40, GRID * 40, QColor(BACKGROUND)))
+        with mock.patch.object(Stroke, 'render', autospec=True, side_effect=Stroke.render) as render:
+            cache.tile(3, 5, 2.0)
+            drawn = render.call_count
+            cache.tile(3, 5, 2.0)
+        self.assertEqual(render.call_count, drawn, "a cached tile was drawn again")
+        self.assertLessEqual(drawn, 25, f"{drawn} of {len(store)} strokes drawn for one tile")
+        # The tile covers 128 x 128 board pixels, a few rows and columns of strokes
+        self.assertGreater(drawn, 0)
+
+    def test_cached_erasers_erase_their_layer_to_what_is_below(self):
+        layers = LayerStack(256, 256, QColor(BACKGROUND))
+        store = StrokeStore()
+        for tool, color, layer in (("pen", '#ff0000', 0), ("pen", '#ffffff', 1), ("eraser", '#00ff00', 1)):
+            stroke = Stroke(tool, QColor(color), 20, layer=layer)
+            stroke.add_point(20, 128)
+            stroke.add_point(236, 128)
+            store.add(stroke)
+        cache = StrokeTileCache(store, layers)
+        image = cache.tile(0, 0)
+        # The ink layer is erased, the red stroke on the background layer below it shows
+        self.assertEqual(QColor(image.pixel(128, 128)), QColor('#ff0000'))
+        self.assertEqual(QColor(image.pixel(128, 20)), QColor(BACKGROUND))
+        cache.invalidate(QRect(0, 0, 10, 10))
+        self.assertFalse(cache.tiles)
+
+def click(canvas: JCanvas, x: int, y: int, points: list = ()):
+    """Presses at (x, y), moves through points and releases at the last one, in canvas coordinates."""
+    for kind, (x, y) in [('press', (x, y))] + [('move', point) for point in points] + [('release', (points or [(x, y)])[-1])]:
+        QCoreApplication.sendEvent(canvas, input_event(kind, x, y))
+        app.processEvents()
+
+class CanvasHitTest(unittest.TestCase):
+    def setUp(self):
+        self.canvas = JCanvas(320, 240, BACKGROUND)
+        self.canvas.set_tool("pen")
+        click(self.canvas, 20, 60, [(100 + 10 * i, 60) for i in range(20)])
+        click(self.canvas, 160, 20, [(160, 40 + 10 * i) for i in range(19)])
+
+    def tearDown(self):
+        self.canvas.deleteLater()
+
+    def test_eraser_click_erases_the_stroke_under_it(self):
+        canvas = self.canvas
+        before = canvas.layer().image().copy()
+        canvas.set_tool("eraser")
+        click(canvas, 60, 60)
+        self.assertEqual(len(canvas.strokes), 1)
+        self.assertEqual(QColor.fromRgba(canvas.layer().pixmap.pixel(60, 60)).alpha(), 0)
+        # The crossing stroke left in the erased area is drawn again
+        self.assertGreater(QColor.fromRgba(canvas.layer().pixmap.pixel(160, 60)).alpha(), 0)
+        canvas.undo()
+        self.assertEqual(len(canvas.strokes), 2)
+        self.assertEqual(canvas.layer().image(), before)
+
+    def test_select_click_selects_the_stroke_under_it(self):
+        canvas = self.canvas
+        canvas.set_tool("select")
+        click(canvas, 160, 200)
+        self.assertIsNotNone(canvas.selection)
+        self.assertEqual([(stroke.xs[0], stroke.ys[0]) for stroke in canvas.selected_strokes(canvas.selection)], [(160, 20)])
+        click(canvas, 300, 200)
+        self.assertIsNone(canvas.selection)
+
+if __name__ == '__main__':
+    unittest.main()
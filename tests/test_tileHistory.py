@@ -0,0 +1,184 @@
+"""Tests for the tile-based undo history: undo and redo must restore the layers pixel for pixel,
+and memory_usage() must stay the exact size of the tiles the stacks hold.
+
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from PyQt5.QtCore import QCoreApplication, QRect
+from PyQt5.QtGui import QColor, QImage, QPainter
+
+from canvasObjects import JCanvas
+from headless import application
+from inputSession import input_event
+from tileHistory import TileHistory
+
+ROUNDS = 5  # Times every state is undone to the start and redone to the end
+AREA = QRect(0, 0, 640, 480)
+
+app = None
+
+def setUpModule():
+    global app
+    app = application()
+
+def layer_bytes(canvas: JCanvas) -> list:
+    """Returns the pixels of every layer in the area the tests draw on, bottom first.
+    Infinite canvases only grow, so the area stays the same."""
+    result = []
+    for image in canvas.layers.images(AREA):
+        if image is None:
+            # Never painted on, or only restored by an undo, both are transparent
+            result.append(bytes(AREA.width() * AREA.height() * 4))
+            continue
+        image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        result.append(bytes(bits))
+    return result
+
+def stored_bytes(history: TileHistory) -> int:
+    return sum(len(data) for delta in history.undo_stack + history.redo_stack for _, data in delta.tiles.values())
+
+def drag(canvas: JCanvas, points: list):
+    """Presses at the first point, moves through the others and releases at the last, in canvas coordinates."""
+    def send(kind, x, y):
+        # An infinite canvas grows while it is drawn on, which moves the widget position of a canvas point
+        origin = canvas.extent().topLeft()
+        QCoreApplication.sendEvent(canvas, input_event(kind, (x - origin.x()) * canvas.zoom, (y - origin.y()) * canvas.zoom))
+        app.processEvents()
+    send('press', *points[0])
+    for x, y in points[1:]:
+        send('move', x, y)
+    send('release', *points[-1])
+
+class JCanvasHistoryTest(unittest.TestCase):
+    infinite = False
+
+    def setUp(self):
+        self.canvas = JCanvas(640, 480, '#1c1c1c', infinite=self.infinite)
+        self.states = [layer_bytes(self.canvas)]
+
+    def tearDown(self):
+        self.canvas.deleteLater()
+        app.processEvents()
+
+    def record(self):
+        self.states.append(layer_bytes(self.canvas))
+        self.assertNotEqual(self.states[-1], self.states[-2], "the step did not change the canvas")
+        self.assertMemoryExact()
+
+    def assertMemoryExact(self):
+        history = self.canvas.history
+        self.assertEqual(history.memory_usage(), stored_bytes(history))
+        self.assertEqual(history.memory_usage(), history.undo_memory_usage() + history.redo_memory_usage())
+
+    def draw_fill_erase(self):
+        canvas = self.canvas
+        canvas.set_tool('pen')
+        drag(canvas, [(60 + i * 4, 120 + 60 * math.sin(i / 8)) for i in range(120)])
+        self.record()
+        canvas.set_tool('rectangle')
+        drag(canvas, [(100, 260), (300, 420)])
+        self.record()
+        canvas.pen_color = QColor('#3060a0')
+        canvas.set_tool('fill')
+        drag(canvas, [(200, 340)])
+        self.record()
+        canvas.set_tool('eraser')
+        canvas.set_tool_width(30)
+        drag(canvas, [(80 + i * 5, 60 + i * 4) for i in range(90)])
+        self.record()
+        canvas.set_active_layer(0)
+        canvas.set_tool('fill')
+        canvas.pen_color = QColor('#a03060')
+        drag(canvas, [(600, 20)])
+        self.record()
+
+    def test_undo_redo_restore_every_state(self):
+        self.draw_fill_erase()
+        self.assertEqual(len(self.canvas.history.undo_stack), len(self.states) - 1)
+        for _ in range(ROUNDS):
+            for state in reversed(self.states[:-1]):
+                self.canvas.undo()
+                self.assertEqual(layer_bytes(self.canvas), state)
+                self.assertMemoryExact()
+            self.assertFalse(self.canvas.history.can_undo())
+            for state in self.states[1:]:
+                self.canvas.redo()
+                self.assertEqual(layer_bytes(self.canvas), state)
+                self.assertMemoryExact()
+            self.assertFalse(self.canvas.history.can_redo())
+
+    def test_new_change_drops_redo(self):
+        self.draw_fill_erase()
+        self.canvas.undo()
+        self.canvas.undo()
+        self.canvas.set_tool('pen')
+        drag(self.canvas, [(400 + i * 2, 200) for i in range(60)])
+        self.assertFalse(self.canvas.history.can_redo())
+        self.assertMemoryExact()
+        self.canvas.undo()
+        self.assertEqual(layer_bytes(self.canvas), self.states[-3])
+
+class InfiniteCanvasHistoryTest(JCanvasHistoryTest):
+    infinite = True
+
+class TileHistoryTest(unittest.TestCase):
+    def paint(self, history: TileHistory, image: QImage, rect: QRect, color: str):
+        history.begin()
+        history.touch(image, rect)
+        painter = QPainter(image)
+        painter.fillRect(rect, QColor(color))
+        painter.end()
+        history.commit()
+
+    def test_memory_follows_budget_and_step_limit(self):
+        image = QImage(512, 512, QImage.Format_ARGB32_Premultiplied)
+        image.fill(QColor('#1c1c1c'))
+        history = TileHistory(tile_size=64, max_steps=6, memory_budget=40 * 1024, compress=False)
+        for k in range(20):
+            self.paint(history, image, QRect(k * 20, k * 20, 90, 90), '#ffffff' if k % 2 else '#ff0000')
+            self.assertEqual(history.memory_usage(), stored_bytes(history))
+            self.assertLessEqual(len(history.undo_stack), 6)
+            self.assertTrue(len(history.undo_stack) == 1 or history.memory_usage() <= 40 * 1024)
+        while history.can_undo():
+            history.undo({0: image})
+            self.assertEqual(history.memory_usage(), stored_bytes(history))
+
+    def test_recolor_keeps_memory_exact(self):
+        image = QImage(256, 256, QImage.Format_ARGB32_Premultiplied)
+        image.fill(QColor('#1c1c1c'))
+        history = TileHistory(tile_size=64)
+        before = QImage(image.size(), image.format())
+        self.paint(history, image, QRect(10, 10, 100, 30), '#ffffff')
+        history.recolor(0, QColor('#1c1c1c'), QColor('#f0f0f0'))
+        self.assertEqual(history.memory_usage(), stored_bytes(history))
+        history.undo({0: image})
+        # The canvas recolors its layers itself, the stored tiles come back in the new color
+        tiles = QRect(0, 0, 128, 64)
+        before.fill(QColor('#f0f0f0'))
+        self.assertEqual(image.copy(tiles), before.copy(tiles))
+
+    def test_forget_drops_steps_reaching_the_area(self):
+        image = QImage(512, 256, QImage.Format_ARGB32_Premultiplied)
+        image.fill(QColor('#1c1c1c'))
+        history = TileHistory(tile_size=64)
+        self.paint(history, image, QRect(0, 0, 40, 40), '#ffffff')
+        self.paint(history, image, QRect(300, 0, 40, 40), '#ffffff')
+        self.paint(history, image, QRect(400, 100, 40, 40), '#ffffff')
+        history.forget(QRect(310, 10, 5, 5), 0)
+        # The step at 300 reaches into the area, the one before it goes with it
+        self.assertEqual(len(history.undo_stack), 1)
+        self.assertEqual(history.memory_usage(), stored_bytes(history))
+        history.forget(QRect(310, 10, 5, 5), 1)
+        self.assertEqual(len(history.undo_stack), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+import zlib
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QColor, QImage
+
+from tiledPixmap import put_images
+
+class TileDelta:
+    """One undo step: the pixels of every tile a change touched, keyed by tile position,
+    plus the vector strokes the change added to or removed from the board."""
+    __slots__ = ('tiles', 'added', 'removed')
+
+    def __init__(self, tiles: dict = None, added: list = None, removed: list = None):
+        self.tiles = tiles if tiles is not None else {}  # (layer, tx, ty) -> (QRect, bytes)
+        self.added = added if added is not None else []
+        self.removed = removed if removed is not None else []
+
+    def nbytes(self) -> int:
+        return sum(len(data) for _, data in self.tiles.values())
+
+    def bounds(self) -> QRect:
+        rect = QRect()
+        for tile_rect, _ in self.tiles.values():
+            rect = rect.united(tile_rect)
+        return rect
+
+class TileHistory:
+    """Undo/redo history that stores only the tiles a change touched instead of full frames.
+
+    A change is recorded by calling begin(), then touch() with every area before it is
+    painted, then commit() once the change is done. Entries hold the tiles as they were
+    before the change; the opposite side is grabbed from the canvas when an entry moves
+    between the undo and redo stacks, so each step is stored exactly once."""
+    def __init__(self, tile_size: int = 128, max_steps: int = 500, memory_budget: int = 256 * 1024 * 1024, compress: bool = True):
+        self.tile_size = tile_size
+        self.max_steps = max_steps
+        self.memory_budget = memory_budget  # Bytes of tile data kept across both stacks
+        self.compress = compress
+        self.undo_stack = []
+        self.redo_stack = []
+        self._pending = None
+        self._pending_lost = False  # The open change's tiles were changed by someone else meanwhile
+        self._memory = 0
+
+    def begin(self):
+        """Starts recording a new change. Calling it while a change is open keeps the open one."""
+        if self._pending is None:
+            self._pending = TileDelta()
+
+    def is_recording(self) -> bool:
+        return self._pending is not None
+
+    def touch(self, pixmap, rect: QRect, layer: int = 0):
+        """Remembers the current content of every tile in rect of pixmap, the layer at index layer,
+        that the open change has not seen yet. pixmap is the layer's QImage or TiledPixmap."""
+        if self._pending is None:
+            return
+        for (tx, ty), tile_rect in self.tiles_in(rect, pixmap.rect()):
+            if (layer, tx, ty) not in self._pending.tiles:
+                self._pending.tiles[(layer, tx, ty)] = (tile_rect, self._grab(pixmap, tile_rect))
+
+    def record_strokes(self, added: list = (), removed: list = ()):
+        """Remembers vector strokes the open change added to or removed from the board."""
+        if self._pending is None:
+            return
+        self._pending.added.extend(added)
+        self._pending.removed.extend(removed)
+
+    def commit(self):
+        """Closes the open change and pushes it onto the undo stack."""
+        pending, self._pending = self._pending, None
+        lost, self._pending_lost = self._pending_lost, False
+        if pending is None or not (pending.tiles or pending.added or pending.removed):
+            return
+        self._clear_redo()
+        if lost:
+            return  # Undoing it would put back what someone else painted since
+        self._push(self.undo_stack, pending)
+        self._enforce_limits()
+
+    def cancel(self):
+        self._pending = None
+        self._pending_lost = False
+
+    def forget(self, rect: QRect, layer: int):
+        """Drops the steps that would put back pixels of rect of a layer, for an area that was changed
+        outside of the history, e.g. by a collaborator. Steps are only undone in order, so all steps
+        before the newest one that reaches into rect go too, on both stacks. An open change that
+        reaches into rect is not recorded when it is committed, and the steps before it go."""
+        def reaches(delta):
+            return any(key[0] == layer and tile_rect.intersects(rect) for key, (tile_rect, _) in delta.tiles.items())
+        for stack in (self.undo_stack, self.redo_stack):
+            newest = max((index for index, delta in enumerate(stack) if reaches(delta)), default=-1)
+            for _ in range(newest + 1):
+                self._pop(stack, 0)
+        if self._pending is not None and reaches(self._pending):
+            self._pending_lost = True
+            self._pop_all(self.undo_stack)
+
+    def undo(self, pixmaps: dict) -> TileDelta:
+        """Restores the previous state into pixmaps, {layer: pixmap}, and returns the step that was undone, or None.
+
+        The caller is responsible for removing the step's added strokes and restoring its removed ones."""
+        return self._swap(pixmaps, self.undo_stack, self.redo_stack)
+
+    def redo(self, pixmaps: dict) -> TileDelta:
+        """Reapplies the last undone change into the layer pixmaps and returns the step that was redone, or None."""
+        return self._swap(pixmaps, self.redo_stack, self.undo_stack)
+
+    def peek(self, redo: bool = False) -> TileDelta:
+        """Returns the step the next undo, or redo, would restore without restoring it, or None."""
+        stack = self.redo_stack if redo else self.undo_stack
+        return stack[-1] if stack else None
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self._pending = None
+        self._pending_lost = False
+        self._memory = 0
+
+    def recolor(self, layer: int, old: QColor, new: QColor):
+        """Sets the pixels of a layer's stored tiles that are exactly old to new, on both stacks,
+        so steps recorded before the canvas color changed restore the new color."""
+        from pixelKernels import recolor_bytes
+        for delta in self.undo_stack + self.redo_stack:
+            self._memory -= delta.nbytes()
+            for key, (tile_rect, data) in delta.tiles.items():
+                if key[0] == layer:
+                    # Single color tiles are recolored as they are stored, a pixel
+                    pixels = data if len(data) == 4 else self._pixels(tile_rect, data)
+                    recolored = recolor_bytes(pixels, old, new)
+                    if recolored is not pixels:
+                        delta.tiles[key] = (tile_rect, recolored if len(data) == 4 else self._encode(recolored))
+            self._memory += delta.nbytes()
+
+    def can_undo(self) -> bool:
+        return bool(self.undo_stack)
+
+    def can_redo(self) -> bool:
+        return bool(self.redo_stack)
+
+    def memory_usage(self) -> int:
+        """Returns the exact number of bytes of tile data held by the undo and redo stacks."""
+        return self._memory
+
+    def undo_memory_usage(self) -> int:
+        return sum(delta.nbytes() for delta in self.undo_stack)
+
+    def redo_memory_usage(self) -> int:
+        return sum(delta.nbytes() for delta in self.redo_stack)
+
+    def tiles_in(self, rect: QRect, bounds: QRect):
+        """Yields ((tx, ty), tile_rect) for every tile of a canvas covering bounds that intersects rect."""
+        rect = rect.intersected(bounds)
+        if rect.isEmpty():
+            return
+        size = self.tile_size
+        for ty in range(rect.top() // size, rect.bottom() // size + 1):
+            for tx in range(rect.left() // size, rect.right() // size + 1):
+                tile_rect = QRect(tx * size, ty * size, size, size).intersected(bounds)
+                yield (tx, ty), tile_rect
+
+    def _swap(self, pixmaps: dict, source: list, target: list) -> TileDelta:
+        if not source:
+            return None
+        delta = self._pop(source)
+        current = {key: (tile_rect, self._grab(pixmaps[key[0]], tile_rect)) for key, (tile_rect, _) in delta.tiles.items()}
+        for layer in {key[0] for key in delta.tiles}:
+            put_images(pixmaps[layer], [(tile_rect.topLeft(), self._decode(tile_rect, data))
+                                        for key, (tile_rect, data) in delta.tiles.items() if key[0] == layer])
+        self._push(target, TileDelta(current, delta.added, delta.removed))
+        return delta
+
+    def _grab(self, pixmap, rect: QRect) -> bytes:
+        # Premultiplied like the layer pixmaps, so translucent pixels restore exactly
+        image = pixmap.copy(rect).convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        return self._encode(bytes(bits))
+
+    def _encode(self, data: bytes) -> bytes:
+        if data == data[:4] * (len(data) // 4):
+            return data[:4]  # A single color, like the untouched parts of a layer
+        return zlib.compress(data, 1) if self.compress else data
+
+    def _decode(self, rect: QRect, data: bytes) -> QImage:
+        data = self._pixels(rect, data)
+        return QImage(data, rect.width(), rect.height(), rect.width() * 4, QImage.Format_ARGB32_Premultiplied).copy()
+
+    def _pixels(self, rect: QRect, data: bytes) -> bytes:
+        if len(data) == 4:
+            return data * (rect.width() * rect.height())
+        return zlib.decompress(data) if self.compress else data
+
+    def _push(self, stack: list, delta: TileDelta):
+        stack.append(delta)
+        self._memory += delta.nbytes()
+
+    def _pop(self, stack: list, index: int = -1) -> TileDelta:
+        delta = stack.pop(index)
+        self._memory -= delta.nbytes()
+        return delta
+
+    def _clear_redo(self):
+        self._pop_all(self.redo_stack)
+
+    def _pop_all(self, stack: list):
+        while stack:
+            self._pop(stack)
+
+    def _enforce_limits(self):
+        # Always keep the most recent step, even if it alone exceeds the budget
+        while len(self.undo_stack) > 1 and (len(self.undo_stack) > self.max_steps or self._memory > self.memory_budget):
+            self._pop(self.undo_stack, 0)
@@ -0,0 +1,111 @@
+import math
+from PyQt5.QtCore import Qt, QRect, QRectF
+from PyQt5.QtGui import QImage, QPixmap, QPainter
+
+from tiledPixmap import draw_area
+
+class TilePyramid:
+    """Downsampled copies of a canvas image, split into tiles, for drawing zoomed-out views.
+
+    Level 0 is the canvas itself, level n is scaled down by 2**n. Tiles are built on first
+    use from the level below and rebuilt lazily after invalidate() marks them dirty, so a
+    stroke only costs the tiles it landed in. The source may also be a TiledPixmap, whose
+    area can start at negative coordinates."""
+    def __init__(self, tile_size: int = 256):
+        self.tile_size = tile_size
+        self.levels = {}  # level -> {(tx, ty): QPixmap}
+        self.dirty = {}  # level -> set of (tx, ty)
+        self.source = None
+
+    def set_source(self, pixmap: QImage):
+        """Sets the full resolution image, or the same one after it grew, and drops every cached level."""
+        self.source = pixmap
+        self.levels.clear()
+        self.dirty.clear()
+
+    def max_level(self) -> int:
+        if self.source is None:
+            return 0
+        longest = max(self.source.width(), self.source.height(), 1)
+        return max(0, math.ceil(math.log2(longest / self.tile_size)))
+
+    def level_for(self, zoom: float) -> int:
+        """Returns the coarsest level that still has at least one texel per screen pixel."""
+        if zoom >= 1:
+            return 0
+        return min(int(math.floor(math.log2(1 / zoom))), self.max_level())
+
+    def invalidate(self, rect: QRect):
+        """Marks the built tiles that cover rect (canvas coordinates) as stale on every level."""
+        for level, tiles in self.levels.items():
+            dirty = self.dirty.setdefault(level, set())
+            for key in self._keys_in(QRectF(rect), level):
+                if key in tiles:
+                    dirty.add(key)
+
+    def render(self, painter: QPainter, rect: QRect, zoom: float):
+        """Draws the canvas area rect (canvas coordinates) at zoom with painter in widget coordinates."""
+        level = self.level_for(zoom)
+        painter.save()
+        painter.scale(zoom, zoom)
+        if level == 0:
+            draw_area(painter, rect, self.source, rect)
+        else:
+            # Tiles are 2**level times smaller than the area they cover
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            span = self.tile_size * 2 ** level
+            for tx, ty in self._keys_in(QRectF(rect), level):
+                tile = self.tile(level, tx, ty)
+                painter.drawPixmap(QRectF(tx * span, ty * span, span, span), tile, QRectF(tile.rect()))
+        painter.restore()
+
+    def tile(self, level: int, tx: int, ty: int) -> QPixmap:
+        tiles = self.levels.setdefault(level, {})
+        dirty = self.dirty.setdefault(level, set())
+        tile = tiles.get((tx, ty))
+        if tile is None or (tx, ty) in dirty:
+            tile = self._build(level, tx, ty, tile)
+            tiles[(tx, ty)] = tile
+            dirty.discard((tx, ty))
+        return tile
+
+    def nbytes(self) -> int:
+        return sum(tile.width() * tile.height() * tile.depth() // 8 for tiles in self.levels.values() for tile in tiles.values())
+
+    def _build(self, level: int, tx: int, ty: int, tile: QPixmap = None) -> QPixmap:
+        size = self.tile_size
+        if tile is None:
+            tile = QPixmap(size, size)
+        tile.fill(Qt.transparent)
+        painter = QPainter(tile)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        if level == 1:
+            area = QRectF(tx * size * 2, ty * size * 2, size * 2, size * 2)
+            # Parts outside the source stay transparent, as beyond a fixed canvas
+            part = area.intersected(QRectF(self.source.rect()))
+            if not part.isEmpty():
+                target = QRectF((part.x() - area.x()) / 2, (part.y() - area.y()) / 2, part.width() / 2, part.height() / 2)
+                draw_area(painter, target, self.source, part)
+        else:
+            # Average the four children from the level below
+            half = size / 2
+            for dy in range(2):
+                for dx in range(2):
+                    child_x, child_y = tx * 2 + dx, ty * 2 + dy
+                    if self._in_bounds(level - 1, child_x, child_y):
+                        painter.drawPixmap(QRectF(dx * half, dy * half, half, half), self.tile(level - 1, child_x, child_y), QRectF(0, 0, size, size))
+        painter.end()
+        return tile
+
+    def _in_bounds(self, level: int, tx: int, ty: int) -> bool:
+        span = self.tile_size * 2 ** level
+        return QRect(tx * span, ty * span, span, span).intersects(self.source.rect())
+
+    def _keys_in(self, rect: QRectF, level: int):
+        span = self.tile_size * 2 ** level
+        rect = rect.intersected(QRectF(self.source.rect()))
+        if rect.isEmpty():
+            return
+        for ty in range(int(rect.top() // span), int(math.ceil(rect.bottom() / span))):
+            for tx in range(int(rect.left() // span), int(math.ceil(rect.right() / span))):
+                yield tx, ty
@@ -0,0 +1,200 @@
+from contextlib import contextmanager
+from PyQt5.QtCore import QPoint, QRect, QRectF
+from PyQt5.QtGui import QColor, QImage, QPainter
+
+TILE_SIZE = 256
+
+class TiledPixmap:
+    """Sparse stand-in for a layer's QImage without fixed bounds, for canvases that grow as they are drawn on.
+
+    Only the tiles that were painted on are stored, everywhere else the pixmap is its fill
+    color, so memory follows the inked area. rect() is the extent the canvas currently shows,
+    which can start at negative coordinates. Painting goes through painter(rect), which paints
+    on a scratch image of the area and stores its tiles back, dropping those that ended up all
+    fill color again; put() copies images in without a scratch image."""
+    def __init__(self, rect: QRect, fill: QColor, tile_size: int = TILE_SIZE):
+        self.extent = QRect(rect)
+        self.fill_color = QColor(fill)
+        self.tile_size = tile_size
+        self.tiles = {}  # (tx, ty) -> QImage
+        self._blank = None  # One tile of fill color, to spot tiles painted back to it
+
+    def rect(self) -> QRect:
+        return QRect(self.extent)
+
+    def width(self) -> int:
+        return self.extent.width()
+
+    def height(self) -> int:
+        return self.extent.height()
+
+    def set_rect(self, rect: QRect):
+        self.extent = QRect(rect)
+
+    def fill(self, color: QColor):
+        """Sets the whole pixmap to color, which drops every tile."""
+        self.fill_color = QColor(color)
+        self.tiles.clear()
+        self._blank = None
+
+    def recolor(self, color: QColor):
+        """Changes the fill to color, along with the pixels of the stored tiles that were the old fill."""
+        from pixelKernels import recolor_image
+        old, self.fill_color = self.fill_color, QColor(color)
+        self._blank = None
+        for key, tile in list(self.tiles.items()):
+            if recolor_image(tile, old, color):
+                self._store(key, tile)
+
+    def nbytes(self) -> int:
+        return sum(tile.sizeInBytes() for tile in self.tiles.values())
+
+    def tile_rect(self, tx: int, ty: int) -> QRect:
+        return QRect(tx * self.tile_size, ty * self.tile_size, self.tile_size, self.tile_size)
+
+    def tiles_in(self, rect: QRect):
+        """Yields the (tx, ty) keys of the tile grid cells that intersect rect, stored or not."""
+        if rect.isEmpty():
+            return
+        size = self.tile_size
+        for ty in range(rect.top() // size, rect.bottom() // size + 1):
+            for tx in range(rect.left() // size, rect.right() // size + 1):
+                yield tx, ty
+
+    def content_rect(self) -> QRect:
+        """Returns the area covered by stored tiles, everything outside it is fill color."""
+        rect = QRect()
+        for tx, ty in self.tiles:
+            rect = rect.united(self.tile_rect(tx, ty))
+        return rect
+
+    def copy(self, rect: QRect = None) -> QImage:
+        """Returns the area rect, or the extent, as a premultiplied image, like QImage.copy."""
+        return self.image(rect)
+
+    def image(self, rect: QRect = None) -> QImage:
+        """Returns the area rect, or the extent, as a premultiplied image."""
+        rect = self.extent if rect is None else rect
+        image = QImage(rect.size(), QImage.Format_ARGB32_Premultiplied)
+        image.fill(self.fill_color)
+        painter = None
+        for key in self.tiles_in(rect):
+            tile = self.tiles.get(key)
+            if tile is not None:
+                if painter is None:
+                    painter = QPainter(image)
+                    painter.setCompositionMode(QPainter.CompositionMode_Source)
+                painter.drawImage(self.tile_rect(*key).topLeft() - rect.topLeft(), tile)
+        if painter is not None:
+            painter.end()
+        return image
+
+    def draw(self, painter: QPainter, target: QRectF, source: QRectF):
+        """Draws the area source scaled into target with painter, like QPainter.drawImage."""
+        scale_x, scale_y = target.width() / source.width(), target.height() / source.height()
+        for key in self.tiles_in(source.toAlignedRect()):
+            tile_rect = QRectF(self.tile_rect(*key))
+            part = tile_rect.intersected(source)
+            if part.isEmpty():
+                continue
+            to = QRectF(target.x() + (part.x() - source.x()) * scale_x, target.y() + (part.y() - source.y()) * scale_y,
+                        part.width() * scale_x, part.height() * scale_y)
+            tile = self.tiles.get(key)
+            if tile is None:
+                painter.fillRect(to, self.fill_color)
+            else:
+                painter.drawImage(to, tile, part.translated(-tile_rect.topLeft()))
+
+    @contextmanager
+    def painter(self, rect: QRect):
+        """Yields a QPainter in canvas coordinates for painting within rect."""
+        area = self._aligned(rect)
+        scratch = self.image(area)
+        painter = QPainter(scratch)
+        painter.translate(-area.x(), -area.y())
+        try:
+            yield painter
+        finally:
+            if painter.isActive():
+                painter.end()
+            for key in self.tiles_in(area):
+                self._store(key, scratch.copy(self.tile_rect(*key).translated(-area.topLeft())))
+
+    @contextmanager
+    def tile_images(self, rect: QRect):
+        """Yields [(tile rect, QImage)] of the tiles that intersect rect, to change their pixels in
+        place, and stores them back afterwards."""
+        tiles = [(key, self.tiles.get(key)) for key in self.tiles_in(rect)]
+        tiles = [(key, self._blank_tile().copy() if tile is None else tile) for key, tile in tiles]
+        try:
+            yield [(self.tile_rect(*key), tile) for key, tile in tiles]
+        finally:
+            for key, tile in tiles:
+                self._store(key, tile)
+
+    def put(self, point: QPoint, image: QImage):
+        """Replaces the pixels at point with image, translucent pixels included."""
+        rect = QRect(point, image.size())
+        for key in self.tiles_in(rect):
+            tile_rect = self.tile_rect(*key)
+            tile = self.tiles.get(key)
+            tile = self._blank_tile().copy() if tile is None else tile
+            painter = QPainter(tile)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.drawImage(point - tile_rect.topLeft(), image)
+            painter.end()
+            self._store(key, tile)
+
+    def _store(self, key: tuple, tile: QImage):
+        if tile == self._blank_tile():
+            self.tiles.pop(key, None)
+        else:
+            self.tiles[key] = tile
+
+    def _blank_tile(self) -> QImage:
+        if self._blank is None:
+            self._blank = QImage(self.tile_size, self.tile_size, QImage.Format_ARGB32_Premultiplied)
+            self._blank.fill(self.fill_color)
+        return self._blank
+
+    def _aligned(self, rect: QRect) -> QRect:
+        size = self.tile_size
+        left, top = rect.left() // size * size, rect.top() // size * size
+        return QRect(left, top, (rect.right() // size + 1) * size - left, (rect.bottom() // size + 1) * size - top)
+
+def painter_for(target, rect: QRect):
+    """Returns a context manager with a QPainter on target, a QImage or TiledPixmap, for painting within rect."""
+    if isinstance(target, TiledPixmap):
+        return target.painter(rect)
+    return _image_painter(target)
+
+@contextmanager
+def _image_painter(image: QImage):
+    painter = QPainter(image)
+    try:
+        yield painter
+    finally:
+        if painter.isActive():
+            painter.end()
+
+def draw_area(painter: QPainter, target, source, source_rect):
+    """Draws source_rect of source, a QImage or TiledPixmap, into target with painter.
+
+    Images are drawn straight from their pixels; on the raster engine only source_rect is
+    converted for the target, so a repaint never uploads more than the area it exposes."""
+    if isinstance(source, TiledPixmap):
+        source.draw(painter, QRectF(target), QRectF(source_rect))
+    else:
+        painter.drawImage(target, source, source_rect)
+
+def put_images(target, images: list):
+    """Copies [(QPoint, QImage)] into target, a QImage or TiledPixmap, replacing the pixels below."""
+    if isinstance(target, TiledPixmap):
+        for point, image in images:
+            target.put(point, image)
+        return
+    painter = QPainter(target)
+    painter.setCompositionMode(QPainter.CompositionMode_Source)
+    for point, image in images:
+        painter.drawImage(point, image)
+    painter.end()
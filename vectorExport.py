@@ -0,0 +1,204 @@
+"""SVG and PDF export of boards.
+
+A JCanvas keeps every pen and shape stroke as vector data next to its layer pixels. Exports
+draw those strokes as paths, then cover the areas whose pixels the strokes do not account
+for with pixels of the flattened canvas: filled areas, loaded images and board tiles, moved
+selections, and everything an eraser stroke touched. The pixels go on top and are opaque,
+so the page always looks like the canvas without relying on clipping, which SVG output from
+Qt does not support.
+
+write_pdf() takes any number of pages, VectorPages or board file names, and renders them
+one at a time, so a long session only ever holds one page in memory.
+"""
+import os
+import uuid
+from PyQt5.QtCore import QMarginsF, QPoint, QRect, QSize, QSizeF
+from PyQt5.QtGui import QColor, QPageSize, QPainter, QPdfWriter, QRegion
+
+from boardFormat import BoardReader
+from canvasLayers import parse_layers
+
+VECTOR_EXTENSIONS = ('.svg', '.pdf')
+EXPORT_DPI = 96  # Canvas pixels per inch on exported pages
+RASTER_GRID = 64  # Embedded areas are rounded out to this grid, which keeps them few and simple
+RASTER_TILE = 1024  # Largest piece of an embedded area drawn as one image
+
+def is_vector_file(filename: str) -> bool:
+    return os.path.splitext(filename)[1].lower() in VECTOR_EXTENSIONS
+
+def grid_rect(rect: QRect, size: int = RASTER_GRID) -> QRect:
+    """Returns rect rounded out to the size grid."""
+    left, top = rect.left() // size * size, rect.top() // size * size
+    return QRect(left, top, (rect.right() // size + 1) * size - left, (rect.bottom() // size + 1) * size - top)
+
+class VectorPage:
+    """One board as it is exported: the visible vector strokes, bottom layer first, and the
+    pixels drawn over them. rect is the canvas area of the page.
+
+    Built from a canvas on the GUI thread with from_canvas(), rendered on any thread."""
+    def __init__(self, rect: QRect, background: QColor):
+        self.rect = QRect(rect)
+        self.background = QColor(background)
+        self.strokes = []
+        self.images = []  # [(QPoint, QImage)] of the flattened canvas
+
+    @classmethod
+    def from_canvas(cls, canvas) -> 'VectorPage':
+        canvas.load_tiles(canvas.pixmap.rect())
+        rect = canvas.content_rect()
+        page = cls(rect, canvas.color)
+        last = len(canvas.layers) - 1
+        visible = [layer.visible for layer in canvas.layers]
+        strokes = [stroke for stroke in canvas.strokes.query(rect) if visible[min(stroke.layer, last)]]
+        raster = QRegion()
+        for layer in canvas.layers:
+            if layer.visible:
+                for area in layer.raster.rects():
+                    raster += grid_rect(area)
+        for stroke in strokes:
+            if stroke.tool == "eraser":
+                raster += grid_rect(stroke.bounds().toAlignedRect())
+        raster &= QRegion(rect)
+        # Strokes entirely below the pixels would only make the file bigger
+        page.strokes = sorted((stroke for stroke in strokes if stroke.tool != "eraser"
+                               and not (QRegion(stroke.bounds().toAlignedRect()) - raster).isEmpty()),
+                              key=lambda stroke: (min(stroke.layer, last), stroke.id))
+        for area in raster.rects():
+            for piece in pieces(area):
+                page.images.append((piece.topLeft(), canvas.layers.flatten(piece)))
+        return page
+
+    def size(self) -> QSize:
+        return self.rect.size()
+
+    def render(self, painter: QPainter):
+        """Draws the page with painter, its top left corner at (0, 0)."""
+        painter.save()
+        painter.translate(-self.rect.x(), -self.rect.y())
+        painter.fillRect(self.rect, self.background)
+        for stroke in self.strokes:
+            stroke.render(painter)
+        for point, image in self.images:
+            painter.drawImage(point, image)
+        painter.restore()
+
+class BoardPage:
+    """A board file as an export page. Boards hold no vector data, so their tiles are embedded
+    as they are, read one at a time."""
+    def __init__(self, filename: str):
+        self.filename = filename
+        reader = BoardReader(filename)
+        self.rect = QRect(0, 0, reader.width, reader.height)
+        reader.close()
+
+    def size(self) -> QSize:
+        return self.rect.size()
+
+    def render(self, painter: QPainter):
+        reader = BoardReader(self.filename)
+        try:
+            painter.fillRect(self.rect, reader.color)
+            layers = parse_layers(reader.text("layers"), reader.layer_count)
+            for layer, (_, visible) in enumerate(layers[:reader.layer_count]):
+                if not visible:
+                    continue
+                for ty in range(reader.tiles_y):
+                    for tx in range(reader.tiles_x):
+                        if reader.is_stored(tx, ty, layer):
+                            painter.drawImage(reader.tile_rect(tx, ty).topLeft(), reader.read_tile(tx, ty, layer))
+        finally:
+            reader.close()
+
+def pieces(rect: QRect, size: int = RASTER_TILE):
+    """Yields rect split into parts of at most size x size."""
+    for y in range(rect.top(), rect.bottom() + 1, size):
+        for x in range(rect.left(), rect.right() + 1, size):
+            yield QRect(x, y, size, size).intersected(rect)
+
+def page_size(size: QSize) -> QPageSize:
+    return QPageSize(QSizeF(size.width() / EXPORT_DPI, size.height() / EXPORT_DPI), QPageSize.Inch, "", QPageSize.ExactMatch)
+
+def write_pdf(pages, filename: str, title: str = "") -> str:
+    """Writes pages, VectorPages, BoardPages or board file names, as one PDF with a page each.
+
+    pages may be a generator; each page is rendered and written before the next is taken.
+    Returns an empty string on success or the error message, like write_image."""
+    temp_path = _temp_path(filename)
+    writer = QPdfWriter(temp_path)
+    writer.setResolution(EXPORT_DPI)
+    writer.setTitle(title)
+    writer.setCreator("Blackboard")
+    painter = None
+    try:
+        for page in pages:
+            if isinstance(page, str):
+                page = BoardPage(page)
+            writer.setPageSize(page_size(page.size()))
+            writer.setPageMargins(QMarginsF(0, 0, 0, 0))
+            if painter is None:
+                painter = QPainter()
+                if not painter.begin(writer):
+                    return f"Cannot write {filename}"
+            elif not writer.newPage():
+                return f"Cannot add a page to {filename}"
+            page.render(painter)
+        if painter is None:
+            return "Nothing to export"
+        painter.end()
+        writer = None  # Close the file before it is moved
+        os.replace(temp_path, filename)
+    except OSError as e:
+        return str(e)
+    finally:
+        if painter is not None and painter.isActive():
+            painter.end()
+        writer = None
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return ""
+
+def write_svg(page, filename: str, title: str = "") -> str:
+    """Writes one page as an SVG image. Returns an empty string on success or the error message."""
+    # QtSvg is only needed here, so it is not loaded with the application
+    from PyQt5.QtSvg import QSvgGenerator
+    temp_path = _temp_path(filename)
+    generator = QSvgGenerator()
+    generator.setFileName(temp_path)
+    generator.setSize(page.size())
+    generator.setViewBox(QRect(QPoint(0, 0), page.size()))
+    generator.setResolution(EXPORT_DPI)
+    generator.setTitle(title)
+    painter = QPainter()
+    try:
+        if not painter.begin(generator):
+            return f"Cannot write {filename}"
+        page.render(painter)
+        painter.end()
+        generator = None  # Close the file before it is moved
+        os.replace(temp_path, filename)
+    except OSError as e:
+        return str(e)
+    finally:
+        if painter.isActive():
+            painter.end()
+        generator = None
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return ""
+
+def write_vector(pages, filename: str, texts: dict = None, compression: int = 6) -> str:
+    """Writes a page, or any iterable of pages for PDF, to an .svg or .pdf file; the signature of
+    write_image so it can stand in for it. compression is unused, vector files are always compressed by Qt."""
+    title = (texts or {}).get("title", "")
+    if isinstance(pages, (str, VectorPage, BoardPage)):
+        pages = [pages]
+    if filename.lower().endswith('.svg'):
+        pages = list(pages)
+        if len(pages) != 1:
+            return "SVG files hold a single page"
+        return write_svg(BoardPage(pages[0]) if isinstance(pages[0], str) else pages[0], filename, title)
+    return write_pdf(pages, filename, title)
+
+def _temp_path(filename: str) -> str:
+    directory = os.path.dirname(os.path.abspath(filename))
+    return os.path.join(directory, f".{os.path.basename(filename)}.{uuid.uuid4().hex[:8]}.tmp")
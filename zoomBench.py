@@ -0,0 +1,93 @@
+"""Zoom benchmark: frame time of a large board shown at several zoom levels.
+
+Draws strokes all over a large board on the offscreen Qt platform and shows it in a
+JCanvasContainer the size of a screen. At every zoom level the view is panned over a grid
+of positions and repainted, first while the zoomed-out tiles are still being made (cold),
+then again over the same positions (warm). Zoomed-out frames should cost about the same
+as 1:1 ones, they are drawn from the tile pyramid's smaller levels.
+
+    python zoomBench.py
+    python zoomBench.py --size 8000x8000 --zoom 1 0.25 0.0625
+"""
+import argparse
+import math
+import sys
+import time
+
+from PyQt5.QtGui import QColor
+
+from headless import application
+from replayBench import peak_rss
+
+ZOOMS = (2.0, 1.0, 0.5, 0.25, 0.125, 1 / 32)
+VIEWPORT = (1920, 1080)
+PAN_STEPS = 6  # Positions per axis the view is panned over at each zoom level
+
+def build_canvas(width: int, height: int, count: int):
+    """Returns a width x height canvas with count pen strokes spread over all of it."""
+    from canvasObjects import JCanvas
+    from strokeModel import Stroke
+    canvas = JCanvas(width, height, '#1c1c1c')
+    for k in range(count):
+        stroke = Stroke("pen", QColor.fromHsv(k * 37 % 360, 160, 255), 4 + k % 12, layer=0)
+        x, y = k * 7919 % width, k * 104729 % height
+        for i in range(80):
+            stroke.add_point(x + i * 6, y + 50 * math.sin(i / 10 + k), 0.4 + 0.6 * abs(math.sin(i / 25)))
+        canvas.apply_strokes(added=[stroke])
+        canvas.paint_stroke(stroke)
+    return canvas
+
+def pan_positions(container) -> list:
+    h_bar, v_bar = container.horizontalScrollBar(), container.verticalScrollBar()
+    return [(h_bar.maximum() * i // max(1, PAN_STEPS - 1), v_bar.maximum() * j // max(1, PAN_STEPS - 1))
+            for j in range(PAN_STEPS) for i in range(PAN_STEPS)]
+
+def frame_times(app, container, canvas, positions: list) -> list:
+    """Scrolls to every position and returns the seconds each repaint of the canvas took."""
+    times = []
+    for x, y in positions:
+        container.horizontalScrollBar().setValue(x)
+        container.verticalScrollBar().setValue(y)
+        app.processEvents()
+        start = time.perf_counter()
+        canvas.repaint()
+        times.append(time.perf_counter() - start)
+    return times
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measures the frame time of a large board at several zoom levels.")
+    parser.add_argument('--size', default='16000x16000', help="Board size, WIDTHxHEIGHT")
+    parser.add_argument('--strokes', type=int, default=4000, help="Strokes drawn on the board")
+    parser.add_argument('--zoom', type=float, nargs='+', default=ZOOMS, help="Zoom levels to measure")
+    args = parser.parse_args(argv)
+    width, height = (int(value) for value in args.size.lower().split('x'))
+
+    app = application()
+    from canvasObjects import JCanvasContainer
+    start = time.perf_counter()
+    canvas = build_canvas(width, height, args.strokes)
+    container = JCanvasContainer(canvas)
+    container.resize(*VIEWPORT)
+    container.show()
+    app.processEvents()
+    print(f"board {width}x{height}, {args.strokes} strokes, drawn in {time.perf_counter() - start:.1f} s, "
+          f"viewport {VIEWPORT[0]}x{VIEWPORT[1]}")
+    for zoom in args.zoom:
+        canvas.set_zoom(zoom)
+        container.widget().adjustSize()
+        app.processEvents()
+        positions = pan_positions(container)
+        cold = frame_times(app, container, canvas, positions)
+        warm = frame_times(app, container, canvas, positions)
+        print(f"  zoom {zoom:<8.4g} cold p50 {percentile(cold, 0.5) * 1000:7.2f}  max {max(cold) * 1000:7.2f} ms   "
+              f"warm p50 {percentile(warm, 0.5) * 1000:7.2f}  p95 {percentile(warm, 0.95) * 1000:7.2f} ms", flush=True)
+    print(f"peak memory {peak_rss() / 1024 / 1024:.0f} MB, pyramid {canvas.pyramid.nbytes() / 1024 / 1024:.0f} MB")
+    container.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())